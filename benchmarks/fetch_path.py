@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Compares the old and new ways of getting a cached page into lxml.
+
+The old path read a flat cache file, decoded it to unicode, wrapped it
+in a StringIO and handed that to lxml.html.parse. The new path streams
+byte string chunks out of the compressed cache straight into lxml's
+feed parser.
+
+Each path is run in its own process so peak memory can be compared.
+
+    python benchmarks/fetch_path.py [PAGE]
+"""
+
+import os
+import sys
+import time
+import shutil
+import resource
+import tempfile
+import subprocess
+from io import StringIO
+
+from lxml.html import parse as lxml_parser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from nhlstats.cache import FileCache
+from nhlstats.collect import NHLEvents
+
+DEFAULT_PAGE = os.path.join(
+    os.path.dirname(__file__), '..', 'tests', 'pages', 'PL021014.HTM'
+)
+URL = 'http://www.nhl.com/scores/htmlreports/20132014/PL021014.HTM'
+ROUNDS = 20
+
+
+def old_path(directory):
+    with open(os.path.join(directory, 'page.html')) as fp:
+        data = StringIO(fp.read().decode('utf-8'))
+    return lxml_parser(data).getroot()
+
+
+def new_path(directory):
+    collector = NHLEvents(
+        '20132014', '021014', use_cache=True, cache=FileCache(directory)
+    )
+    return collector.build_document(collector.iter_data(URL))
+
+
+PATHS = {
+    'old': old_path,
+    'new': new_path,
+}
+
+
+def measure(name, directory):
+    """
+    Runs in a child process, reporting the best time to build the
+    document and the growth in peak memory while doing so.
+    """
+    path = PATHS[name]
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    best = None
+    for _ in range(ROUNDS):
+        start = time.time()
+        root = path(directory)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+        del root
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    print '{} {} {}'.format(name, best, peak)
+
+
+def main(page):
+    directory = tempfile.mkdtemp()
+    try:
+        with open(page, 'rb') as fp:
+            content = fp.read()
+
+        with open(os.path.join(directory, 'page.html'), 'wb') as fp:
+            fp.write(content)
+        FileCache(directory).store(URL, content, final=True)
+
+        print 'Page: {} ({} bytes)'.format(page, len(content))
+        print '{:<6}{:>12}{:>16}'.format('path', 'best (ms)', 'peak (KiB)')
+
+        for name in sorted(PATHS, reverse=True):
+            output = subprocess.check_output(
+                [sys.executable, __file__, '--measure', name, directory]
+            )
+            _, best, peak = output.split()
+            print '{:<6}{:>12.2f}{:>16}'.format(
+                name, float(best) * 1000, peak
+            )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--measure']:
+        measure(sys.argv[2], sys.argv[3])
+    else:
+        main(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_PAGE)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+Compares the old and new ways of parsing a game report's events.
+
+The old parse evaluated a fresh XPath query for each row, each on ice
+cell and twice for each player on the ice. The new one compiles its
+queries once and makes a single query per row and per player.
+
+Both are run over the same parsed documents, and must agree on the
+events they find.
+
+    python benchmarks/parse_events.py [PAGE ...]
+"""
+
+import os
+import sys
+import glob
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from nhlstats.collect import NHLEvents
+
+DEFAULT_PAGES = glob.glob(os.path.join(
+    os.path.dirname(__file__), '..', 'tests', 'pages', 'PL*.HTM'
+))
+ROUNDS = 20
+
+
+def old_parse(data):
+    events = []
+    for row in data.xpath('//tr[@class="evenColor"]'):
+        rowdata = row.xpath('td')
+        awayice = [cell for cell in rowdata[6].xpath(
+            'table/tr/td') if u'\xa0' not in cell.text_content()]
+        homeice = [cell for cell in rowdata[7].xpath(
+            'table/tr/td') if u'\xa0' not in cell.text_content()]
+
+        clock = rowdata[3]
+
+        events.append({
+            'number': rowdata[0].text,
+            'period': rowdata[1].text,
+            'strength': (rowdata[2].text or '').strip() or None,
+            'time': clock.text,
+            'remaining': clock[0].tail if len(clock) else None,
+            'event': rowdata[4].text,
+            'description': rowdata[5].text,
+            'away': [],
+            'home': []
+        })
+
+        for player in awayice:
+            events[-1]['away'].append({
+                'player': player.xpath(
+                    'table/tr/td'
+                )[0].text_content().strip(),
+                'position': player.xpath(
+                    'table/tr/td'
+                )[1].text_content().strip()
+            })
+
+        for player in homeice:
+            events[-1]['home'].append({
+                'player': player.xpath(
+                    'table/tr/td'
+                )[0].text_content().strip(),
+                'position': player.xpath(
+                    'table/tr/td'
+                )[1].text_content().strip()
+            })
+
+    return events
+
+
+def best_of(parse, data):
+    best = None
+    for _ in range(ROUNDS):
+        start = time.time()
+        parse(data)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(pages):
+    collector = NHLEvents('20132014', '021014')
+
+    print '{:<16}{:>8}{:>12}{:>12}{:>10}'.format(
+        'page', 'events', 'old (ms)', 'new (ms)', 'speedup'
+    )
+
+    for page in pages:
+        with open(page, 'rb') as fp:
+            data = collector.build_document([fp.read()])
+
+        events = collector.parse(data)
+        if events != old_parse(data):
+            sys.exit('Parsers disagree on {}'.format(page))
+
+        old = best_of(old_parse, data)
+        new = best_of(collector.parse, data)
+        print '{:<16}{:>8}{:>12.2f}{:>12.2f}{:>9.1f}x'.format(
+            os.path.basename(page), len(events), old * 1000, new * 1000,
+            old / new
+        )
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or DEFAULT_PAGES)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Measures how re-parsing cached game reports scales with --parse-workers.
+
+A synthetic report is stored in a scratch cache under many game URLs, and
+every one is then collected through the engine from the cache, first
+parsing in threads and then in increasing numbers of processes.
+
+    python benchmarks/parse_workers.py [REPORTS] [WORKERS ...]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from nhlstats.cache import FileCache
+from nhlstats.collect import NHLEvents, EVENT_URL
+from nhlstats.engine import Engine
+
+PAGE = os.path.join(
+    os.path.dirname(__file__), '..', 'tests', 'pages', 'PL021014.HTM'
+)
+DEFAULT_REPORTS = 200
+
+
+def run(cache, reports, parse_workers):
+    collectors = [
+        NHLEvents('20132014', '02{:04d}'.format(i), use_cache=True,
+                  cache=cache)
+        for i in range(reports)
+    ]
+
+    start = time.time()
+    with Engine(8, parse_workers=parse_workers) as engine:
+        engine.gather(collectors)
+    return time.time() - start
+
+
+def main(reports, workers):
+    directory = tempfile.mkdtemp()
+    try:
+        cache = FileCache(directory)
+        with open(PAGE, 'rb') as fp:
+            content = fp.read()
+        for i in range(reports):
+            url = EVENT_URL.format('20132014', '02{:04d}'.format(i))
+            cache.store(url, content, final=True)
+
+        print '{} reports, {} cpus'.format(
+            reports, multiprocessing.cpu_count()
+        )
+        print '{:<10}{:>12}{:>14}{:>10}'.format(
+            'workers', 'time (s)', 'reports/s', 'speedup'
+        )
+
+        baseline = None
+        for parse_workers in workers:
+            elapsed = run(cache, reports, parse_workers)
+            baseline = baseline or elapsed
+            print '{:<10}{:>12.2f}{:>14.1f}{:>9.1f}x'.format(
+                parse_workers or 'threads', elapsed, reports / elapsed,
+                baseline / elapsed
+            )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    reports = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_REPORTS
+    workers = [int(arg) for arg in sys.argv[2:]] or [0, 1, 2, 4, 8]
+    main(reports, workers)
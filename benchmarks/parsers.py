@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+"""
+Benchmarks every collector's parse over the pages in tests/pages,
+without going anywhere near nhl.com. Every page there is synthetic,
+written to the shape of nhl.com's rather than recorded from it, so the
+numbers are for comparing commits, not for predicting production.
+
+Each collector is run in a process of its own, so its peak memory can be
+told apart from the others'. A page is parsed repeatedly for at least
+--min-time seconds, and the throughput, latency percentiles and growth
+in peak RSS are reported. Pages are handed over in the same sized chunks
+as they come out of the cache.
+
+Results can be written out as JSON with --output, and two sets of
+results compared with --compare, so a change can be checked against the
+commit before it.
+
+    python benchmarks/parsers.py [--output FILE] [--min-time SECONDS] [CASE ...]
+    python benchmarks/parsers.py --compare BASE.json [NEW.json]
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import optparse
+import subprocess
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import lxml.etree
+from monotonic import monotonic
+
+from nhlstats.cache import PageCache, CHUNK_SIZE
+from nhlstats.collect import NHLDivisions, NHLSchedule, NHLGameReports, \
+    NHLTeams, NHLRoster, NHLArena, NHLEvents, NHLEventLocations
+
+PAGES = os.path.join(os.path.dirname(__file__), '..', 'tests', 'pages')
+
+DEFAULT_MIN_TIME = 2.0
+MIN_ROUNDS = 5
+
+
+class MemoryCache(PageCache):
+
+    """
+    Serves one page from memory, for collectors that read through the
+    cache themselves.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def open(self, url):
+        return iter(self.chunks)
+
+
+def parse(factory):
+    def run(chunks):
+        return factory().parse_page(chunks)
+    return run
+
+
+def stream(chunks):
+    collector = NHLEvents('20132014', '021014', use_cache=True,
+                          cache=MemoryCache(chunks))
+    return list(collector.iter_events())
+
+
+# name, page, and a function parsing the page's chunks.
+CASES = [
+    ('NHLDivisions', 'standings.htm',
+     parse(lambda: NHLDivisions('20132014'))),
+    ('NHLSchedule', 'schedule_season.htm',
+     parse(lambda: NHLSchedule('20132014'))),
+    ('NHLGameReports', 'schedule_season.htm',
+     parse(lambda: NHLGameReports('20132014'))),
+    ('NHLTeams', 'teams.htm', parse(NHLTeams)),
+    ('NHLRoster', 'roster.htm', parse(lambda: NHLRoster('capitals'))),
+    ('NHLArena', 'arena.htm', parse(lambda: NHLArena('wsh'))),
+    ('NHLEvents', 'PL021014.HTM',
+     parse(lambda: NHLEvents('20132014', '021014'))),
+    ('NHLEvents.iter_events', 'PL021014.HTM', stream),
+    ('NHLEventLocations', 'PlayByPlay.json',
+     parse(lambda: NHLEventLocations('20132014', '021014'))),
+]
+
+
+def count_items(result):
+    # Play-by-play JSON comes back with the teams alongside the plays.
+    if isinstance(result, dict) and 'plays' in result:
+        return len(result['plays'])
+    return len(result)
+
+
+def percentile(ordered, fraction):
+    """
+    The nearest rank percentile of an already sorted list.
+    """
+    rank = max(int(round(fraction * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def peak_rss_kb():
+    # Linux reports kilobytes, OS X bytes.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 if sys.platform == 'darwin' else peak
+
+
+def measure(page, function, min_time):
+    with open(os.path.join(PAGES, page), 'rb') as fp:
+        content = fp.read()
+    chunks = [content[i:i + CHUNK_SIZE]
+              for i in range(0, len(content), CHUNK_SIZE)]
+
+    baseline = peak_rss_kb()
+    result = function(chunks)
+
+    timings = []
+    started = monotonic()
+    while len(timings) < MIN_ROUNDS or monotonic() - started < min_time:
+        start = monotonic()
+        function(chunks)
+        timings.append(monotonic() - start)
+
+    timings.sort()
+    total = sum(timings)
+    return {
+        'page': page,
+        'bytes': len(content),
+        'items': count_items(result),
+        'rounds': len(timings),
+        'mean_ms': 1000 * total / len(timings),
+        'min_ms': 1000 * timings[0],
+        'p50_ms': 1000 * percentile(timings, 0.5),
+        'p90_ms': 1000 * percentile(timings, 0.9),
+        'p99_ms': 1000 * percentile(timings, 0.99),
+        'max_ms': 1000 * timings[-1],
+        'pages_per_s': len(timings) / total,
+        'mb_per_s': len(content) * len(timings) / total / (1024 * 1024),
+        'peak_rss_kb': peak_rss_kb() - baseline,
+    }
+
+
+def run_case(queue, page, function, min_time):
+    try:
+        queue.put(measure(page, function, min_time))
+    except Exception as error:
+        queue.put({'error': repr(error)})
+
+
+def benchmark(name, page, function, min_time):
+    # A process of its own, so peak memory is this case's alone.
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=run_case, args=(queue, page, function, min_time)
+    )
+    process.start()
+    result = queue.get()
+    process.join()
+
+    if 'error' in result:
+        raise RuntimeError('{} failed: {}'.format(name, result['error']))
+    return result
+
+
+def commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(__file__) or '.',
+            stderr=open(os.devnull, 'w')
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    print '{:<24}{:>10}{:>10}{:>10}{:>10}{:>10}{:>12}'.format(
+        'case', 'items', 'p50 ms', 'p90 ms', 'p99 ms', 'MB/s', 'peak KB'
+    )
+    for name, _, _ in CASES:
+        if name in results['cases']:
+            case = results['cases'][name]
+            print '{:<24}{:>10}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.1f}{:>12}'.format(
+                name, case['items'], case['p50_ms'], case['p90_ms'],
+                case['p99_ms'], case['mb_per_s'], case['peak_rss_kb']
+            )
+
+
+def print_comparison(base, new):
+    print 'base {}\nnew  {}'.format(base.get('commit'), new.get('commit'))
+    print '{:<24}{:>12}{:>12}{:>10}{:>14}'.format(
+        'case', 'base p50', 'new p50', 'speedup', 'peak KB diff'
+    )
+    for name, _, _ in CASES:
+        if name in base['cases'] and name in new['cases']:
+            old, case = base['cases'][name], new['cases'][name]
+            print '{:<24}{:>12.2f}{:>12.2f}{:>9.2f}x{:>+14}'.format(
+                name, old['p50_ms'], case['p50_ms'],
+                old['p50_ms'] / case['p50_ms'],
+                case['peak_rss_kb'] - old['peak_rss_kb']
+            )
+
+
+def main():
+    parser = optparse.OptionParser(
+        usage='usage: %prog [options] [CASE ...]\n'
+              '       %prog --compare BASE.json [NEW.json]'
+    )
+    parser.add_option(
+        '-o', '--output', dest='output',
+        help='write the results to this file as JSON'
+    )
+    parser.add_option(
+        '--min-time', dest='min_time', type='float',
+        default=DEFAULT_MIN_TIME,
+        help='parse each page for at least this many seconds '
+             '(default %default)'
+    )
+    parser.add_option(
+        '--compare', dest='compare', action='store_true', default=False,
+        help='compare two sets of results, or one against a fresh run'
+    )
+    options, args = parser.parse_args()
+
+    if options.compare:
+        if len(args) not in (1, 2):
+            parser.error('--compare takes one or two result files')
+        results = [json.load(open(path)) for path in args]
+        if len(results) == 2:
+            print_comparison(*results)
+            return
+        args = []
+
+    names = [name for name, _, _ in CASES]
+    unknown = set(args) - set(names)
+    if unknown:
+        parser.error('unknown cases {}, choose from {}'.format(
+            ', '.join(sorted(unknown)), ', '.join(names)
+        ))
+
+    run = {
+        'commit': commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'lxml': lxml.etree.__version__,
+        'platform': platform.platform(),
+        'cpus': multiprocessing.cpu_count(),
+        'min_time': options.min_time,
+        'cases': {},
+    }
+    for name, page, function in CASES:
+        if not args or name in args:
+            run['cases'][name] = benchmark(
+                name, page, function, options.min_time
+            )
+
+    if options.output:
+        with open(options.output, 'w') as fp:
+            json.dump(run, fp, indent=2, sort_keys=True,
+                      separators=(',', ': '))
+            fp.write('\n')
+
+    if options.compare:
+        print_comparison(results[0], run)
+    else:
+        print_results(run)
+
+
+if __name__ == '__main__':
+    main()
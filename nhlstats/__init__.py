@@ -1,17 +1,30 @@
 import sys
 import re
-import time
 import urllib2
 import logging
 import datetime
+import itertools
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from version import __version__
 
-from .db import create_tables, drop_tables, connect_db
-from .models import League, Season, SeasonType, Team, Conference, \
-                    Division, Arena, Game
+from .db import create_tables, drop_tables, migrate_tables, connect_db
+from .models import db_proxy, League, Season, SeasonType, Team, \
+                    Conference, Division, Arena, Game, BackfillJournal, \
+                    identity_map_stats
 from .collect import NHLTeams, NHLDivisions, NHLArena, NHLGameReports, \
-                     NHLEvents
+                     NHLEvents, NotModified, ReportRevised
+from .ingest import ingest_game_events, store_schedule
+from .aggregates import rebuild_stats
+from .shifts import build_game_shifts, build_season_shifts
+from .throttle import throttle
+from .cache import page_cache
+from .connection import pool as connection_pool
+from .engine import Engine, DEFAULT_CONCURRENCY
+from .poller import GamePoller
+from .metrics import metrics
+from .profiling import profiler
 
 
 logger = logging.getLogger(__name__)
@@ -24,8 +37,14 @@ actions = [
     'collect',
     'update',
     'populate',
+    'backfill',
+    'poll',
+    'stats',
+    'shifts',
     'syncdb',
+    'migrate',
     'dropdb',
+    'cache',
     'shell',
     'testignore',   # Allows the bin app to be run without calling into here.
 ]
@@ -36,7 +55,6 @@ actions = [
 # TODO: Handle timezones.
 # TODO: Allow for multiple levels of verbosity, squelch db stuff in debug
 # TODO: Add ability to specify current time via CLI/env
-# TODO: Add ability to specify wait timer when grabbing new pages via CLI/env
 # TODO: Add ability to specify seasons to collect via CLI/env
 # TODO: Make logging a pass through by default in the library itself.
 # TODO: Do a unicode/str audit
@@ -45,12 +63,62 @@ seasons = [
 ]
 
 
-def get_data_for_game(game, use_cache=False):
-    logger.info('Getting data for {}'.format(game))
+def identity_map_samples():
+    """
+    Reference model lookups, for the metrics registry.
+    """
+    for model, (hits, misses) in identity_map_stats().items():
+        for result, count in (('hit', hits), ('miss', misses)):
+            yield ('nhlstats_identity_map_lookups_total',
+                   {'model': model, 'result': result}, count)
+
+
+def throttle_samples():
+    """
+    What the throttle has made of our requests, for the metrics registry.
+    """
+    for host, (requests, waits, waited) in throttle.get_stats().items():
+        yield 'nhlstats_throttle_requests_total', {'host': host}, requests
+        yield 'nhlstats_throttle_waits_total', {'host': host}, waits
+        yield 'nhlstats_throttle_wait_seconds_total', {'host': host}, waited
+
+
+metrics.register(identity_map_samples)
+metrics.register(throttle_samples)
+
+
+def fetch_game_events(season, report_id, use_cache=False, since=None):
+    """
+    Retrieve and parse the events for a game past the since high water
+    mark. This does not touch the database, so it is safe to run from
+    worker threads. Raises NotModified if the report hasn't changed
+    since we last saw it.
+    """
+    try:
+        return list(NHLEvents(
+            season,
+            report_id,
+            since=since,
+            use_cache=use_cache,
+            conditional=True
+        ).iter_events())
+    except ReportRevised:
+        # The report has changed under our high water mark, so we need
+        # all of it again.
+        logger.info('Report {} has been revised, retrieving it in full'
+                    .format(report_id))
+        return list(NHLEvents(
+            season,
+            report_id,
+            use_cache=use_cache
+        ).iter_events())
 
-    events = NHLEvents(game.season.year, game.report_id, use_cache=use_cache)
 
-    for event in events.scrape():
+def game_end(game, events):
+    """
+    When game ended, if its scraped events include the end of the game.
+    """
+    for event in events:
         if event['event'] == 'GEND':
             # TODO: Inevitably there are some bugs here - we don't consider
             # what happens when a game runs past midnight or somehow starts
@@ -64,7 +132,7 @@ def get_data_for_game(game, use_cache=False):
 
             if time_match:
                 try:
-                    game.end = datetime.datetime.strptime(
+                    return datetime.datetime.strptime(
                         '{}-{:02d}-{:02d} {:02d}:{}'.format(
                             game.start.year,
                             int(game.start.month),
@@ -76,44 +144,136 @@ def get_data_for_game(game, use_cache=False):
                     )
                 except ValueError:
                     # TODO: DO NOT CHECK THIS IN!!!!!!
-                    game.end = datetime.datetime(2000, 01, 01, 1, 1, 1)
-                game.save()
-                logger.info('Game {} has ended at {}'.format(
-                    game, game.end
-                ))
+                    return datetime.datetime(2000, 01, 01, 1, 1, 1)
             else:
                 raise ValueError('Unable to parse GEND')
+    return None
+
+
+def process_game_events(game, events):
+    """
+    Record what we've learned about game from its scraped events. The
+    game is only marked as ended along with its events being stored, so
+    a game whose events failed to store is collected again.
+    """
+    end = game_end(game, events)
+
+    with db_proxy.atomic():
+        ingest_game_events(game, events)
+        if end is not None:
+            game.end = end
+            game.save()
+
+    if end is not None:
+        logger.info('Game {} has ended at {}'.format(game, game.end))
+        # Shifts are only worked out once the game is over.
+        build_game_shifts(game)
 
-    if not events.loaded_from_cache:
-        logger.warning('Waiting to download to be polite.')
-        time.sleep(5)
 
+def windowed(games, submit, window):
+    """
+    Yields (game, profile, future) for each of games once its future is
+    done, where submit(game, profile) starts work on a game and returns
+    its future. A window of games is kept in flight, a new one submitted
+    each time one is yielded, so results are handled while later games
+    are still being fetched and parsed, one slow game doesn't hold up
+    the rest, and we never hold more than a window of them. Games still
+    in flight are cancelled if we're closed early.
+    """
+    games = iter(games)
+    pending = {}
+
+    def fill():
+        for game in itertools.islice(games, window - len(pending)):
+            profile = profiler.game(game)
+            pending[submit(game, profile)] = game, profile
 
-def get_data_for_games(games, use_cache=False):
+    try:
+        fill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                game, profile = pending.pop(future)
+                yield game, profile, future
+            fill()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def get_data_for_games(games, use_cache=False,
+                       concurrency=DEFAULT_CONCURRENCY, parse_workers=None):
+    """
+    Fetch and parse the reports for games using a pool of concurrency
+    workers. Per host politeness is left to the collectors' throttle,
+    while database work happens back here on the calling thread.
+
+    Given parse_workers, reports are instead parsed in that many
+    processes, which pays off when they're coming from a warm cache.
+    A game's profile covers its fetch and parse, wherever they're done
+    in a thread, along with storing it.
+    """
     if games is None:
         games = []
 
     success_counter = 0
     failure_counter = 0
 
-    for game in games:
-        try:
-            get_data_for_game(game, use_cache)
-            success_counter += 1
-        except urllib2.HTTPError:
-            logger.warning(
-                'Unable to retrieve game report for {}'.format(game)
+    # Workers are handed what they need from game up front, so they never
+    # have to touch the database themselves.
+    if parse_workers:
+        pool = Engine(concurrency, parse_workers=parse_workers)
+
+        def submit(game, profile):
+            logger.info('Getting data for {}'.format(game))
+            return pool.submit(NHLEvents(
+                game.season.year,
+                game.report_id,
+                since=game.watermark,
+                use_cache=use_cache,
+                conditional=True
+            ), profile)
+    else:
+        pool = ThreadPoolExecutor(max_workers=concurrency)
+
+        def submit(game, profile):
+            logger.info('Getting data for {}'.format(game))
+            return pool.submit(
+                profile.call,
+                fetch_game_events,
+                game.season.year,
+                game.report_id,
+                use_cache,
+                game.watermark
             )
-            failure_counter += 1
-        except:
-            logger.exception('Error getting data for {}'.format(game))
-            sys.exit(1)
+
+    # Games are read up front, as committing would reset a query still
+    # being read on SQLite. Results are closed before the pool, so queued
+    # games don't keep it alive on the way out.
+    with pool, closing(windowed(list(games), submit,
+                                concurrency * 2)) as results:
+        for game, profile, future in results:
+            try:
+                with profile:
+                    process_game_events(game, future.result())
+                success_counter += 1
+            except NotModified:
+                logger.debug('Game report for {} is unchanged'.format(game))
+                success_counter += 1
+            except urllib2.HTTPError:
+                logger.warning(
+                    'Unable to retrieve game report for {}'.format(game)
+                )
+                failure_counter += 1
+            except:
+                logger.exception('Error getting data for {}'.format(game))
+                sys.exit(1)
 
     logger.info('Processed {} games'.format(success_counter))
     logger.info('Failed to process {} games'.format(failure_counter))
 
 
-def populate(use_cache):
+def populate(use_cache, concurrency=DEFAULT_CONCURRENCY, parse_workers=None):
     """
     Retrieves base information including
     teams, rosters, seasons, arenas, etc.
@@ -132,74 +292,324 @@ def populate(use_cache):
     SeasonType.get_or_create(league=league, name='Regular', external_id='2')
     SeasonType.get_or_create(league=league, name='Playoffs', external_id='3')
 
-    # Get the latest set of division information
-    divisions = NHLDivisions(use_cache=use_cache).scrape()
-    for conference in divisions:
-        con_model = Conference.get_or_create(league=league, name=conference)
-        for division in divisions[conference]:
-            Division.get_or_create(conference=con_model, name=division)
-
-    for team in NHLTeams(use_cache=use_cache).scrape():
-        # Convert the textual divison name to a Division model
-        team['division'] = Division.get(Division.name ** team['division'])
-        Team.get_or_create(**team)
-        Arena.get_or_create(
-            **NHLArena(team['code'], use_cache=use_cache).scrape()
-        )
+    with Engine(concurrency, parse_workers=parse_workers) as engine:
+        # Get the latest set of division information
+        divisions, teams = engine.gather([
+            NHLDivisions(use_cache=use_cache),
+            NHLTeams(use_cache=use_cache),
+        ])
+        for conference in divisions:
+            con_model = Conference.get_or_create(
+                league=league,
+                name=conference
+            )
+            for division in divisions[conference]:
+                Division.get_or_create(conference=con_model, name=division)
 
-    # Gather our seasons:
-    for years in seasons:
-        divisions = NHLDivisions(years, use_cache=use_cache).scrape()
+        # Every team's arena is on its own site
+        arenas = engine.gather([
+            NHLArena(team['code'], use_cache=use_cache) for team in teams
+        ])
 
-        for season_type in SeasonType.select():
-            season = Season.get_or_create(
-                league=league,
-                year=years,
-                type=season_type
+        for team, arena in zip(teams, arenas):
+            # Convert the textual divison name to a Division model
+            team['division'] = Division.cached(name=team['division'])
+            Team.get_or_create(**team)
+            Arena.get_or_create(**arena)
+
+        # Gather our seasons:
+        season_types = list(SeasonType.select())
+        for years in seasons:
+            schedules = engine.gather([
+                NHLGameReports(years, season_type.name, use_cache=use_cache)
+                for season_type in season_types
+            ])
+
+            for season_type, games in zip(season_types, schedules):
+                season = Season.get_or_create(
+                    league=league,
+                    year=years,
+                    type=season_type
+                )
+
+                store_schedule(season, games)
+
+
+def season_range(first, last=None):
+    """
+    The seasons from first to last inclusive, each as its two years
+    concatenated, ie season_range('20122013', '20142015').
+    """
+    last = last or first
+    for season in (first, last):
+        if not re.match('^[0-9]{8}$', season):
+            raise ValueError(
+                'Season "{}" is not of the correct format, which is two '
+                'directly concatenated YYYY values, ie 20132014'.format(
+                    season
+                )
             )
 
-            games = NHLGameReports(
-                years,
-                season_type.name,
-                use_cache=use_cache
-            ).scrape()
+    return [
+        '{}{}'.format(year, year + 1)
+        for year in range(int(first[:4]), int(last[:4]) + 1)
+    ]
+
+
+def backfill(first, last=None, use_cache=False,
+             concurrency=DEFAULT_CONCURRENCY, parse_workers=None):
+    """
+    Load the schedule and every played game for the seasons first to
+    last, inclusive. Each season type's schedule and each game is
+    recorded in the backfill journal once stored, so running the same
+    backfill again picks up where it left off, retrying what failed.
+    Returns how many units of work failed.
+    """
+    try:
+        league = League.get(League.abbreviation == 'NHL')
+    except League.DoesNotExist:
+        raise ValueError('No league to backfill, run populate first')
+
+    season_types = list(SeasonType.select())
+    failures = 0
+
+    with Engine(concurrency, parse_workers=parse_workers) as engine:
+        for years in season_range(first, last):
+            years_seasons = [
+                Season.get_or_create(
+                    league=league,
+                    year=years,
+                    type=season_type
+                )
+                for season_type in season_types
+            ]
+
+            pending = [
+                season for season in years_seasons
+                if not BackfillJournal.is_done(season)
+            ]
+            futures = [
+                engine.submit(NHLGameReports(
+                    years,
+                    season.type.name,
+                    use_cache=use_cache
+                ))
+                for season in pending
+            ]
+            for season, future in zip(pending, futures):
+                try:
+                    store_schedule(season, future.result())
+                except Exception as error:
+                    logger.warning('Unable to store the {} {} schedule: '
+                                   '{!r}'.format(years, season.type.name, error))
+                    BackfillJournal.record(season, error=error)
+                    failures += 1
+                else:
+                    BackfillJournal.record(season)
+
+            for season in years_seasons:
+                failures += backfill_games(engine, season, use_cache,
+                                           concurrency * 2)
+
+    logger.info('Backfill of {} to {} finished with {} failures'.format(
+        first, last or first, failures
+    ))
+    return failures
+
+
+def backfill_games(engine, season, use_cache, window):
+    """
+    Load the events for the played games in season that aren't yet done,
+    keeping a window of them in flight so we never hold more than a
+    window of results. Returns how many games failed.
+    """
+    done = BackfillJournal.completed_games(season)
+    games = [
+        game for game in Game.select().where(
+            (Game.season == season) &
+            (Game.start <= datetime.datetime.now()) &
+            Game.report_id.is_null(False)
+        )
+        if game.id not in done
+    ]
+    logger.info('Backfilling {} games for {} {}'.format(
+        len(games), season.year, season.type.name
+    ))
+
+    def submit(game, profile):
+        return engine.submit(NHLEvents(
+            season.year,
+            game.report_id,
+            since=game.watermark,
+            use_cache=use_cache
+        ), profile)
+
+    failures = 0
+    with closing(windowed(games, submit, window)) as results:
+        for game, profile, future in results:
+            try:
+                with profile:
+                    process_game_events(game, future.result())
+            except Exception as error:
+                logger.warning('Unable to backfill {}: {!r}'.format(
+                    game, error
+                ))
+                BackfillJournal.record(season, game, error=error)
+                failures += 1
+            else:
+                # A game that hasn't finished will be tried again.
+                if game.end is not None:
+                    BackfillJournal.record(season, game)
+
+    return failures
 
-            for game in games:
-                game['home'] = Team.get(code=game['home'])
-                game['road'] = Team.get(code=game['road'])
-                game['season'] = season
-                Game.get_or_create(**game).save()
 
+def rebuild_season_stats(fix=True, first=None, last=None):
+    """
+    Work the player season totals out afresh from the stored events, for
+    the seasons first to last if given or every season otherwise. Unless
+    fix is False the stored totals are replaced. Returns how many
+    players' totals differed from those kept as games were ingested.
+    """
+    query = Season.select().order_by(Season.year, Season.type)
+    if first:
+        query = query.where(Season.year << season_range(first, last))
+
+    return sum(rebuild_stats(season, fix) for season in query)
 
-def main(action='collect', use_cache=False):
+
+def season_shifts(first=None, last=None):
     """
-    The main entry point for the application
+    Work out the shifts of every finished game, for the seasons first to
+    last if given or every season otherwise.
     """
+    query = Season.select().order_by(Season.year, Season.type)
+    if first:
+        query = query.where(Season.year << season_range(first, last))
+
+    for season in query:
+        build_season_shifts(season)
+
+
+def forget_game_report(game):
+    """
+    Have the next conditional fetch of game's report retrieve it in full,
+    so events we fetched but failed to store aren't taken as unchanged.
+    """
+    connection_pool.validators.forget(
+        NHLEvents(game.season.year, game.report_id).url
+    )
+
+
+def poll(use_cache=False, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Follow games as they're played until killed, polling each as often
+    as the state of the game calls for.
+    """
+    def fetch(season, report_id, since):
+        return fetch_game_events(season, report_id, use_cache, since)
+
+    try:
+        GamePoller(fetch, process_game_events, concurrency,
+                   forget=forget_game_report).run()
+    finally:
+        throttle.log_stats()
+
+
+def main(action='collect', use_cache=False,
+         concurrency=DEFAULT_CONCURRENCY, arguments=None, parse_workers=None):
+    """
+    The main entry point for the application. Some actions take further
+    arguments, ie `cache gc`. Pages are parsed in parse_workers processes
+    if given. Each run of an action is profiled if the profiler has been
+    configured. Returns how many units of work the action failed, for
+    those that carry on past failures.
+    """
+    with profiler.profile(action):
+        return run_action(action, use_cache, concurrency, arguments or [],
+                          parse_workers)
+
+
+def run_action(action, use_cache, concurrency, arguments, parse_workers):
     logger.debug('Dispatching action {}'.format(action))
+    failures = 0
     # By default, we collect info on current games
     if action == 'collect':
         connect_db()
         get_data_for_games(
             Game.get_active_games(),
-            use_cache
+            use_cache,
+            concurrency,
+            parse_workers
         )
+        throttle.log_stats()
     # Otherwise we can look to update finished games
     elif action == 'update':
         connect_db()
         get_data_for_games(
             Game.get_orphaned_games(),
-            use_cache
+            use_cache,
+            concurrency,
+            parse_workers
         )
         get_data_for_games(
             Game.get_games_in_date_range(),
-            use_cache
+            use_cache,
+            concurrency,
+            parse_workers
         )
+        throttle.log_stats()
     elif action == 'populate':
-        populate(use_cache)
+        populate(use_cache, concurrency, parse_workers)
+        throttle.log_stats()
+    elif action == 'backfill':
+        if len(arguments) not in (1, 2):
+            raise ValueError(
+                'backfill takes the first season and optionally the last, '
+                'ie `backfill 20102011 20142015`'
+            )
+        create_tables()
+        failures = backfill(*arguments, use_cache=use_cache,
+                            concurrency=concurrency,
+                            parse_workers=parse_workers)
+        throttle.log_stats()
+    elif action == 'poll':
+        connect_db()
+        poll(use_cache, concurrency)
+    elif action == 'stats':
+        if not arguments or arguments[0] not in ('rebuild', 'verify') or \
+                len(arguments) > 3:
+            raise ValueError(
+                'stats takes rebuild or verify, and optionally the first '
+                'and last season, ie `stats verify 20132014`'
+            )
+        connect_db()
+        differed = rebuild_season_stats(arguments[0] == 'rebuild',
+                                        *arguments[1:])
+        if differed and arguments[0] == 'verify':
+            logger.warning('{} player season totals need rebuilding'.format(
+                differed
+            ))
+    elif action == 'shifts':
+        if len(arguments) > 2:
+            raise ValueError(
+                'shifts takes optionally the first and last season, ie '
+                '`shifts 20132014 20142015`'
+            )
+        connect_db()
+        season_shifts(*arguments)
     elif action == 'syncdb':
         create_tables()
+    elif action == 'migrate':
+        migrate_tables()
     elif action == 'dropdb':
         drop_tables()
+    elif action == 'cache':
+        if arguments == ['gc']:
+            page_cache.gc()
+        else:
+            raise ValueError(
+                'Unknown cache action "{}"'.format(' '.join(arguments)))
     elif action == 'shell':
         connect_db()
         # Ghetto ass shell command!
@@ -210,3 +620,5 @@ def main(action='collect', use_cache=False):
             'Action "{}" is known, but not (yet?) implemented'.format(action))
     else:
         raise ValueError('Unknown action "{}"'.format(action))
+
+    return failures
@@ -0,0 +1,308 @@
+"""
+Aggregates keeps each player's season totals, PlayerSkaterStat and
+PlayerGoalieStat, up to date with the events we store.
+
+Events added to a game are totalled on their own and the totals added
+to the season's rows in the same transaction, with a game played only
+for those who weren't on the ice earlier in the game. When a revised
+report replaces a game's events, its totals are instead worked out
+before and after and the difference applied. Either way it costs a look
+at no more than one game's events, however far into the season we are.
+Reading a player's totals is then a single row.
+
+Skaters are credited with goals, assists, points, penalty minutes,
+power play and short handed goals, and shots on goal (which include
+goals) for the events they're named in, and with a game played for each
+game they were on the ice in. Goalies are charged with the goals and
+shots against while they were on the ice, and a game played in each
+game they took the ice. Goalies aren't credited with skater stats.
+Shootout attempts, period 5 of a regular season or preseason game, don't
+count as goals or shots.
+
+rebuild_stats works every total out afresh from the stored events,
+reporting where they differ from those kept incrementally.
+"""
+
+import logging
+
+from peewee import fn
+
+from .version import __version__
+from .models import db_proxy, insert_rows, Event, EventPlayer, Game, \
+    Player, PlayerSkaterStat, PlayerGoalieStat, Season, SeasonType
+
+logger = logging.getLogger(__name__)
+logger.debug('Loading {} ver {}'.format(__name__, __version__))
+
+
+SKATER_FIELDS = ('gp', 'g', 'a', 'pts', 'pim', 'ppg', 'shg', 'shots')
+GOALIE_FIELDS = ('gpi', 'ga', 'sha')
+
+STAT_FIELDS = {
+    PlayerSkaterStat: SKATER_FIELDS,
+    PlayerGoalieStat: GOALIE_FIELDS,
+}
+
+GOALIE = 'G'
+
+# Games still tied after overtime go to a shootout, which the reports
+# list as period 5, other than in the playoffs where overtime goes on.
+PLAYOFFS = 'Playoffs'
+SHOOTOUT_PERIOD = 5
+
+
+def credit(totals, model, player, season, team, field, value=1):
+    stats = totals.setdefault((model, player, season, team), {})
+    stats[field] = stats.get(field, 0) + value
+
+
+def event_totals(condition):
+    """
+    The totals earned in the events matching condition, which may refer
+    to Event and Game, as {(model, player, season, team): {field: value}}.
+    """
+    totals = {}
+    attempts = (Event.type << ['goal', 'shot']) & ~(
+        (Event.period == SHOOTOUT_PERIOD) & (SeasonType.name != PLAYOFFS)
+    )
+
+    positions = {}
+    for season, game, team, player, position in EventPlayer.select(
+        Game.season, Event.game, EventPlayer.team, EventPlayer.player,
+        Player.pos
+    ).join(Event).join(Game).switch(EventPlayer).join(Player).where(
+        condition
+    ).distinct().tuples():
+        positions[player] = position
+        if position == GOALIE:
+            credit(totals, PlayerGoalieStat, player, season, team, 'gpi')
+        else:
+            credit(totals, PlayerSkaterStat, player, season, team, 'gp')
+
+    goalies = {}
+    for event, team, player in EventPlayer.select(
+        EventPlayer.event, EventPlayer.team, EventPlayer.player
+    ).join(Event).join(Game).join(Season).join(SeasonType).switch(
+        EventPlayer
+    ).join(Player).where(
+        condition & (Player.pos == GOALIE) & attempts
+    ).tuples():
+        goalies.setdefault(event, []).append((team, player))
+
+    events = list(Event.select(
+        Event.id, Game.season, Event.team, Event.type, Event.strength,
+        Event.player1, Event.player2, Event.player3, Event.penalty_minutes
+    ).join(Game).join(Season).join(SeasonType).where(
+        condition & ((Event.type == 'penalty') | attempts)
+    ).tuples())
+
+    # Players can be named without having been on the ice, serving a
+    # penalty from the bench say.
+    unknown = set(
+        player for row in events for player in row[5:8]
+        if player is not None and player not in positions
+    )
+    if unknown:
+        positions.update(Player.select(Player.id, Player.pos).where(
+            Player.id << list(unknown)
+        ).tuples())
+
+    def skater(player, season, team, field, value=1):
+        if player is not None and positions.get(player) != GOALIE:
+            credit(totals, PlayerSkaterStat, player, season, team, field,
+                   value)
+
+    for event, season, team, kind, strength, scorer, first, second, \
+            minutes in events:
+        if team is None:
+            continue
+
+        if kind == 'penalty':
+            skater(scorer, season, team, 'pim', minutes or 0)
+            continue
+
+        skater(scorer, season, team, 'shots')
+        for goalie_team, goalie in goalies.get(event, []):
+            if goalie_team != team:
+                credit(totals, PlayerGoalieStat, goalie, season,
+                       goalie_team, 'sha')
+                if kind == 'goal':
+                    credit(totals, PlayerGoalieStat, goalie, season,
+                           goalie_team, 'ga')
+
+        if kind == 'goal':
+            skater(scorer, season, team, 'g')
+            skater(scorer, season, team, 'pts')
+            if strength in ('pp', 'sh'):
+                skater(scorer, season, team, '{}g'.format(strength))
+            for assist in (first, second):
+                skater(assist, season, team, 'a')
+                skater(assist, season, team, 'pts')
+
+    return totals
+
+
+def game_totals(game):
+    """
+    The totals earned in game.
+    """
+    return event_totals(Event.game == game)
+
+
+def differences(before, after):
+    """
+    What needs adding to before's totals to make after's, leaving out
+    those that are the same.
+    """
+    changes = {}
+    for key in set(before) | set(after):
+        old, new = before.get(key, {}), after.get(key, {})
+        change = dict(
+            (field, new.get(field, 0) - old.get(field, 0))
+            for field in STAT_FIELDS[key[0]]
+            if new.get(field, 0) != old.get(field, 0)
+        )
+        if change:
+            changes[key] = change
+    return changes
+
+
+def stored_rows(model, keys):
+    """
+    {(player, season, team): row id} for those of keys model has rows
+    for.
+    """
+    stored = {}
+    players = sorted(set(player for player, _, _ in keys))
+    seasons = sorted(set(season for _, season, _ in keys))
+    for start in range(0, len(players), 500):
+        for row_id, player, season, team in model.select(
+            model.id, model.player, model.season, model.team
+        ).where(
+            (model.player << players[start:start + 500]) &
+            (model.season << seasons)
+        ).tuples():
+            if (player, season, team) in keys:
+                stored[(player, season, team)] = row_id
+    return stored
+
+
+def apply_changes(changes):
+    """
+    Add changes, as returned by differences, to the stored totals,
+    creating rows for players new to a team's season.
+    """
+    for model, fields in STAT_FIELDS.items():
+        keyed = dict(
+            (key[1:], change) for key, change in changes.items()
+            if key[0] is model
+        )
+        if not keyed:
+            continue
+
+        stored = stored_rows(model, set(keyed))
+        new = []
+        for (player, season, team), change in keyed.items():
+            if (player, season, team) in stored:
+                model.update(**dict(
+                    (field, fn.COALESCE(getattr(model, field), 0) + value)
+                    for field, value in change.items()
+                )).where(
+                    model.id == stored[(player, season, team)]
+                ).execute()
+            else:
+                row = dict((field, change.get(field, 0)) for field in fields)
+                row.update(player=player, season=season, team=team)
+                new.append(row)
+        insert_rows(model, new)
+
+
+def update_stats(game, before):
+    """
+    Bring the season totals up to date with game, given its totals
+    before its events were replaced. Called within ingest's transaction.
+    """
+    changes = differences(before, game_totals(game))
+    apply_changes(changes)
+    return changes
+
+
+def append_stats(game, first):
+    """
+    Add the totals earned in game's events numbered first onwards, just
+    added to those stored, to the season totals. Called within ingest's
+    transaction.
+    """
+    in_game = Event.game == game
+    seen = set(EventPlayer.select(
+        EventPlayer.player, EventPlayer.team
+    ).join(Event).where(in_game & (Event.number < first)).distinct().tuples())
+
+    changes = {}
+    for key, totals in event_totals(in_game & (Event.number >= first)).items():
+        _, player, _, team = key
+        change = dict(
+            (field, value) for field, value in totals.items()
+            if value and not (field in ('gp', 'gpi') and
+                              (player, team) in seen)
+        )
+        if change:
+            changes[key] = change
+    apply_changes(changes)
+    return changes
+
+
+def stored_totals(season):
+    """
+    The season totals we have stored for season.
+    """
+    totals = {}
+    for model, fields in STAT_FIELDS.items():
+        for row in model.select(
+            model.player, model.season, model.team,
+            *[getattr(model, field) for field in fields]
+        ).where(model.season == season).tuples():
+            stats = dict(
+                (field, value) for field, value in zip(fields, row[3:])
+                if value
+            )
+            if stats:
+                totals[(model,) + row[:3]] = stats
+    return totals
+
+
+def rebuild_stats(season, fix=True):
+    """
+    Work season's totals out from every stored event, logging each that
+    differs from what was kept incrementally. Unless fix is False, the
+    stored totals are then replaced. Returns how many players' totals
+    differed.
+    """
+    with db_proxy.atomic():
+        stored = stored_totals(season)
+        rebuilt = event_totals(Game.season == season)
+        changes = differences(stored, rebuilt)
+
+        for (model, player, _, team), change in sorted(changes.items()):
+            logger.warning('{} totals for player {} with team {} are off '
+                           'by {}'.format(model.__name__, player, team,
+                                          change))
+
+        if fix:
+            for model, fields in STAT_FIELDS.items():
+                model.delete().where(model.season == season).execute()
+                rows = []
+                for key, stats in rebuilt.items():
+                    if key[0] is model:
+                        row = dict((field, stats.get(field, 0))
+                                   for field in fields)
+                        row.update(zip(('player', 'season', 'team'),
+                                       key[1:]))
+                        rows.append(row)
+                insert_rows(model, rows)
+
+    logger.info('{} {} totals: {} of {} players differed{}'.format(
+        season.year, season.type.name, len(changes), len(rebuilt),
+        ', rebuilt' if fix else ''
+    ))
+    return len(changes)
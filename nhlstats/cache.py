@@ -0,0 +1,399 @@
+"""
+Cache keeps local copies of the pages we scrape.
+
+Entries are zlib compressed and sharded into subdirectories by the sha1
+of their URL. Each entry records when it expires, which is decided by
+matching its URL against a list of TTL rules unless the page is known to
+be final, and the cache as a whole is kept under a byte budget by
+evicting the least recently used entries.
+
+Content is handled as byte strings throughout, and may be read and
+written a chunk at a time so pages can be streamed through the cache.
+As a page is being streamed out by the time a bad chunk would be read,
+each entry's header records the length and CRC of its compressed data,
+which are checked before any of it is handed out. An entry that's
+corrupt or cut short is discarded as if it were never there.
+"""
+
+import os
+import re
+import time
+import zlib
+import errno
+import logging
+import tempfile
+import threading
+from hashlib import sha1
+
+from .version import __version__
+
+logger = logging.getLogger(__name__)
+logger.debug('Loading {} ver {}'.format(__name__, __version__))
+
+
+DEFAULT_CACHE_DIR = 'cache'
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+# A TTL of None means an entry never expires.
+FOREVER = None
+
+CHUNK_SIZE = 64 * 1024
+
+# Rules are tried in order, the first pattern to match a URL decides its
+# TTL. Game reports are short lived here, but a report for a finished
+# game is stored as final and never expires.
+DEFAULT_TTLS = [
+    (re.compile(r'/scores/htmlreports/[0-9]{8}/PL[0-9]+\.HTM$'), MINUTE),
+    (re.compile(r'/GameData/[0-9]{8}/[0-9]+/PlayByPlay\.json$'), MINUTE),
+    (re.compile(r'/ice/schedulebyseason\.htm'), HOUR),
+    (re.compile(r'/ice/standings\.htm'), HOUR),
+]
+DEFAULT_TTL = DAY
+
+# Entries begin with a fixed width header line holding the magic, expiry
+# time (0 for never), and the length and CRC32 of the compressed page that
+# follows. Entries from before the length and CRC were kept have the older
+# magic, and are treated as expired.
+MAGIC = 'NHLC2'
+LEGACY_MAGIC = 'NHLC1'
+HEADER = '{} {:010d} {:010d} {:08x}\n'
+
+# The names of the files we keep, so gc leaves anything else in the cache
+# directory alone: the two levels of shard directories, the entries and
+# writers' temporary files within them, and old style uncompressed pages
+# kept flat in the cache directory.
+SHARD = re.compile(r'^[0-9a-f]{2}$')
+ENTRY = re.compile(r'^[0-9a-f]{40}\.z$')
+TEMPORARY = re.compile(r'^tmp\w+\.tmp$')
+LEGACY_ENTRY = re.compile(r'^[0-9a-f]{40}\.html$')
+
+
+class PageCache(object):
+
+    """
+    The interface collectors expect of a cache. Content is always a byte
+    string.
+    """
+
+    def open(self, url):
+        """
+        Return an iterator over the chunks of the cached content for url,
+        or None if there isn't a fresh copy.
+        """
+        raise NotImplementedError
+
+    def writer(self, url):
+        """
+        Return a writer for a new copy of url. Chunks written to it are
+        only visible once it has been committed.
+        """
+        raise NotImplementedError
+
+    def load(self, url):
+        """
+        Return the cached content for url, or None if there isn't a
+        fresh copy.
+        """
+        chunks = self.open(url)
+        if chunks is None:
+            return None
+        return ''.join(chunks)
+
+    def store(self, url, content, final=False):
+        """
+        Store content for url. Final content never expires.
+        """
+        writer = self.writer(url)
+        writer.write(content)
+        writer.commit(final=final)
+
+    def gc(self):
+        """
+        Remove expired entries and trim the cache to its budget.
+        """
+        raise NotImplementedError
+
+
+class FileCache(PageCache):
+
+    """
+    A PageCache kept on the local filesystem.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR,
+                 max_bytes=DEFAULT_MAX_BYTES, ttls=None,
+                 default_ttl=DEFAULT_TTL, clock=time.time):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttls = DEFAULT_TTLS if ttls is None else ttls
+        self.default_ttl = default_ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.stored_since_gc = 0
+
+    def configure(self, directory=None, max_bytes=None):
+        with self.lock:
+            if directory:
+                self.directory = directory
+            if max_bytes:
+                self.max_bytes = max_bytes
+
+    def url_to_filename(self, url):
+        digest = sha1(url).hexdigest()
+        return os.path.join(
+            self.directory, digest[:2], digest[2:4], digest + '.z'
+        )
+
+    def get_ttl(self, url):
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+        return self.default_ttl
+
+    def read_header(self, fp):
+        """
+        Returns the expiry, compressed length and CRC of the entry in fp,
+        the latter two None for an entry in the legacy format.
+        """
+        fields = fp.readline().split()
+        if len(fields) == 4 and fields[0] == MAGIC:
+            return int(fields[1]), int(fields[2]), int(fields[3], 16)
+        if len(fields) == 2 and fields[0] == LEGACY_MAGIC:
+            return int(fields[1]), None, None
+        raise ValueError('Not a cache entry')
+
+    def open(self, url):
+        local_path = self.url_to_filename(url)
+
+        try:
+            fp = open(local_path, 'rb')
+        except IOError:
+            return None
+
+        with fp:
+            try:
+                expires, length, checksum = self.read_header(fp)
+            except ValueError:
+                expires = length = None
+
+            if length is None:
+                logger.warning('Discarding unreadable cache entry {}'.format(
+                    local_path
+                ))
+                self.remove(local_path)
+                return None
+
+            if expires and expires <= self.clock():
+                logger.debug('Cached copy of {} has expired'.format(url))
+                return None
+
+            try:
+                chunks = self.read_entry(fp, length, checksum)
+            except zlib.error:
+                logger.warning('Discarding corrupt cache entry {}'.format(
+                    local_path
+                ))
+                self.remove(local_path)
+                return None
+
+        # Access times drive eviction, so keep them up to date ourselves
+        # rather than trusting the filesystem to.
+        try:
+            os.utime(local_path, (self.clock(), os.path.getmtime(local_path)))
+        except OSError:
+            pass
+
+        logger.debug('Loaded {} from cache ({})'.format(url, local_path))
+        return chunks
+
+    def read_entry(self, fp, length, checksum):
+        """
+        Read the compressed page from fp, raising zlib.error unless it has
+        the length and CRC its header gives, and return an iterator over
+        its decompressed chunks. Only the compressed page is held, the
+        page itself is decompressed a chunk at a time.
+        """
+        data = fp.read()
+        if len(data) != length or \
+                zlib.crc32(data) & 0xffffffff != checksum:
+            raise zlib.error('Incomplete or corrupt cache entry')
+        return self.decompress(data)
+
+    def decompress(self, data):
+        decoder = zlib.decompressobj()
+        for start in range(0, len(data), CHUNK_SIZE):
+            chunk = decoder.decompress(data[start:start + CHUNK_SIZE])
+            if chunk:
+                yield chunk
+
+        chunk = decoder.flush()
+        if chunk:
+            yield chunk
+
+    def writer(self, url):
+        return CacheWriter(self, url)
+
+    def stored(self, size):
+        """
+        Called as entries are committed, collecting garbage once enough
+        has been written since we last did.
+        """
+        with self.lock:
+            self.stored_since_gc += size
+            due = self.stored_since_gc > self.max_bytes / 10
+
+        if due:
+            self.gc()
+
+    def remove(self, local_path):
+        try:
+            os.remove(local_path)
+        except OSError:
+            pass
+
+    def entries(self):
+        """
+        Yields the path of every file under the cache directory that we
+        could have put there.
+        """
+        patterns = {0: (LEGACY_ENTRY,), 2: (ENTRY, TEMPORARY)}
+        for root, directories, files in os.walk(self.directory):
+            relative = os.path.relpath(root, self.directory)
+            depth = 0 if relative == os.curdir else relative.count(os.sep) + 1
+
+            # Don't wander any further than our shards go.
+            directories[:] = [
+                name for name in directories
+                if depth < 2 and SHARD.match(name)
+            ]
+            for name in files:
+                if any(pattern.match(name)
+                       for pattern in patterns.get(depth, ())):
+                    yield os.path.join(root, name)
+
+    def gc(self):
+        with self.lock:
+            self.stored_since_gc = 0
+
+        now = self.clock()
+        expired = 0
+        evicted = 0
+        live = []
+
+        for local_path in self.entries():
+            # Temporary files belong to writers, but any that have been
+            # lying around for a while have been abandoned.
+            if local_path.endswith('.tmp'):
+                try:
+                    if os.path.getmtime(local_path) < now - HOUR:
+                        self.remove(local_path)
+                except OSError:
+                    pass
+                continue
+
+            if LEGACY_ENTRY.match(os.path.basename(local_path)):
+                self.remove(local_path)
+                expired += 1
+                continue
+
+            # A file named like an entry that doesn't start like one isn't
+            # ours to remove.
+            try:
+                with open(local_path, 'rb') as fp:
+                    expires, length, _ = self.read_header(fp)
+                stat = os.stat(local_path)
+            except (IOError, OSError, ValueError):
+                logger.warning('Skipping unrecognised file {}'.format(
+                    local_path
+                ))
+                continue
+
+            if length is None or expires and expires <= now:
+                self.remove(local_path)
+                expired += 1
+            else:
+                live.append((stat.st_atime, stat.st_size, local_path))
+
+        total = sum(size for _, size, _ in live)
+
+        # Evict the least recently used entries until we fit the budget.
+        for _, size, local_path in sorted(live):
+            if total <= self.max_bytes:
+                break
+            self.remove(local_path)
+            total -= size
+            evicted += 1
+
+        logger.info(
+            'Cache gc removed {} expired and evicted {} entries, '
+            '{} entries totalling {} bytes remain'.format(
+                expired, evicted, len(live) - evicted, total
+            )
+        )
+
+        return expired, evicted
+
+
+class CacheWriter(object):
+
+    """
+    Compresses chunks into a temporary file alongside the entry, moving it
+    into place on commit so readers never see a partially written entry.
+    """
+
+    def __init__(self, cache, url):
+        self.cache = cache
+        self.url = url
+        self.local_path = cache.url_to_filename(url)
+
+        directory = os.path.dirname(self.local_path)
+        try:
+            os.makedirs(directory)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+
+        fd, self.temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        self.fp = os.fdopen(fd, 'wb')
+        # Reserve room for the header, none of it is known until commit.
+        self.fp.write(HEADER.format(MAGIC, 0, 0, 0))
+        self.encoder = zlib.compressobj()
+        self.length = 0
+        self.checksum = 0
+
+    def write(self, chunk):
+        self.write_compressed(self.encoder.compress(chunk))
+
+    def write_compressed(self, data):
+        self.fp.write(data)
+        self.length += len(data)
+        self.checksum = zlib.crc32(data, self.checksum)
+
+    def commit(self, final=False):
+        ttl = FOREVER if final else self.cache.get_ttl(self.url)
+        expires = 0 if ttl is FOREVER else int(self.cache.clock() + ttl)
+
+        self.write_compressed(self.encoder.flush())
+        size = self.fp.tell()
+        self.fp.seek(0)
+        self.fp.write(HEADER.format(MAGIC, expires, self.length,
+                                    self.checksum & 0xffffffff))
+        self.fp.close()
+
+        logger.debug('Storing {} in cache as {}'.format(
+            self.url, self.local_path
+        ))
+        os.rename(self.temp_path, self.local_path)
+        self.cache.stored(size)
+
+    def abort(self):
+        self.fp.close()
+        self.cache.remove(self.temp_path)
+
+
+# The process wide cache used by collectors unless told otherwise.
+page_cache = FileCache()
@@ -5,18 +5,21 @@ Collect concerns itself with the screen scraping functionality.
 
 # TODO(jkelly) Ensure team names are consistent
 
-import os
 import re
 import pytz
 import json
 import logging
 import urllib2
 import datetime
-from io import StringIO
-from hashlib import sha1
-from lxml.html import parse as lxml_parser
+import itertools
+from lxml import etree
+from lxml.html import HTMLParser, HtmlElementClassLookup
 
 from .version import __version__
+from .throttle import throttle
+from .connection import pool, NotModified, USER_AGENT
+from .cache import FileCache, page_cache
+from .metrics import metrics
 
 logger = logging.getLogger(__name__)
 logger.debug('Loading {} ver {}'.format(__name__, __version__))
@@ -31,7 +34,39 @@ EVENT_URL = 'http://www.nhl.com/scores/htmlreports/{}/PL{}.HTM'
 TEAMS_URL = 'http://www.nhl.com/ice/teams.htm'
 ROSTER_URL = 'http://{}.nhl.com/club/roster.htm'
 
-USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2227.1 Safari/537.36'
+# Game report queries, compiled once as they're run for every event. On
+# ice cells hold a table of players, padded out with &nbsp; spacers, and
+# each player is a table of their number above their position.
+EVENT_ROWS = etree.XPath('//tr[@class="evenColor"]')
+CELLS = etree.XPath('td')
+ON_ICE = etree.XPath(u'table/tr/td[not(contains(., "\xa0"))]')
+PLAYER = etree.XPath('table/tr/td')
+
+# A game report has a table for each team, and its events are headed by
+# these columns, then each team's players on ice.
+REPORT_TEAMS = ('Visitor', 'Home')
+EVENT_HEADINGS = ['#', 'Per', 'Str', 'Time:ElapsedGame', 'Event',
+                  'Description']
+
+# Standings queries. Teams that don't exist anymore aren't links to team
+# pages, so are picked up by their span instead.
+CONFERENCE_HEADER = 'conferenceHeader'
+STANDINGS = etree.XPath(
+    '//div[starts-with(@class, "conferenceHeader")]'
+    ' | //thead/tr[1]/th[@abbr="DIV"]'
+    ' | //tbody/tr/td[@style="text-align:left;"]/a[2]'
+    ' | //tbody/tr/td/span[@class="team"]'
+)
+
+
+def to_seconds(clock):
+    """
+    Converts a M:SS game clock to seconds.
+    """
+    if not clock:
+        return None
+    minutes, seconds = clock.strip().split(':')
+    return int(minutes) * 60 + int(seconds)
 
 
 class UnexpectedPageContents(Exception):
@@ -43,6 +78,15 @@ class UnexpectedPageContents(Exception):
     pass
 
 
+class ReportRevised(Exception):
+
+    """
+    Raised when streaming a game report past a high water mark that the
+    report no longer matches.
+    """
+    pass
+
+
 class Collector(object):
 
     """
@@ -55,11 +99,17 @@ class Collector(object):
     class HTTPError(urllib2.HTTPError):
         pass
 
-    def __init__(self, url, cache_dir='cache', use_cache=False):
+    def __init__(self, url, cache_dir=None, use_cache=False,
+                 conditional=False, cache=None):
         self.url = url
         self.use_cache = use_cache
-        self.cache_dir = cache_dir
+        self.conditional = conditional
         self.loaded_from_cache = False
+        self.cache_writer = None
+
+        if cache is None:
+            cache = FileCache(cache_dir) if cache_dir else page_cache
+        self.cache = cache
 
     def check_season_type(self, season_type):
         """
@@ -96,70 +146,163 @@ class Collector(object):
         """
         return tz.localize(date).astimezone(pytz.timezone('UTC'))
 
-    def url_to_filename(self, url):
-        hash_file = sha1(url).hexdigest() + '.html'
-        return os.path.join(self.cache_dir, hash_file)
-
-    def store_cache(self, url, content):
+    def iter_data(self, url):
         """
-        Cache a local copy of the file.
+        Yields the contents of url as byte string chunks, from the cache
+        if we're using it and it has a fresh copy, otherwise from the web.
+        Pages downloaded while using the cache are written to it as they
+        stream past, but are only kept once commit_cache is called.
         """
+        collector = type(self).__name__
 
-        # If the cache directory does not exist, make one.
-        if not os.path.isdir(self.cache_dir):
-            os.makedirs(self.cache_dir)
+        if self.use_cache:
+            chunks = self.cache.open(url)
+            if chunks is not None:
+                metrics.inc('nhlstats_cache_requests_total',
+                            collector=collector, result='hit')
+                self.loaded_from_cache = True
+                for chunk in metrics.timed(
+                    chunks, 'nhlstats_fetch_seconds',
+                    'nhlstats_fetch_bytes_total',
+                    collector=collector, source='cache'
+                ):
+                    yield chunk
+                return
+
+            metrics.inc('nhlstats_cache_requests_total',
+                        collector=collector, result='miss')
+            logger.debug(
+                'Unable to load {} from cache, downloading.'.format(url)
+            )
+            self.cache_writer = self.cache.writer(url)
 
-        local_path = self.url_to_filename(url)
+        for chunk in metrics.timed(
+            self.stream_from_web(url), 'nhlstats_fetch_seconds',
+            'nhlstats_fetch_bytes_total', collector=collector, source='web'
+        ):
+            if self.cache_writer:
+                self.cache_writer.write(chunk)
+            yield chunk
 
-        logger.debug('Storing {} in cache as {}'.format(url, local_path))
+    def commit_cache(self, final=False):
+        """
+        Keep the copy of the page downloaded into the cache, if any. Final
+        pages are kept forever.
+        """
+        if self.cache_writer:
+            self.cache_writer.commit(final=final)
+            self.cache_writer = None
 
-        with open(local_path, 'wb') as fp:
-            fp.write(content.read().encode('utf-8'))
+    def abort_cache(self):
+        """
+        Throw away the copy of the page downloaded into the cache, if any.
+        """
+        if self.cache_writer:
+            self.cache_writer.abort()
+            self.cache_writer = None
 
     def load_data(self, url):
-        if self.use_cache:
-            return self.load_from_cache(url)
-        else:
-            return self.load_from_web(url)
-
-    def load_from_cache(self, url):
         """
-        If we do not have a cached version,
-        get one. Return pointer to that.
+        Returns the contents of url as a single byte string.
         """
-        local_path = self.url_to_filename(url)
-        if not os.path.exists(local_path):
-            logger.debug(
-                'Unable to load {} from cache ({}), downloading.'.format(
-                    url, local_path
-                )
-            )
-
-            self.store_cache(url, self.load_from_web(url))
-        else:
-            self.loaded_from_cache = True
-            logger.debug('Loaded {} from cache ({})'.format(
-                url, local_path
-            ))
+        try:
+            data = ''.join(self.iter_data(url))
+            self.commit_cache()
+            return data
+        finally:
+            self.abort_cache()
 
-        with open(local_path) as fp:
-            data = StringIO(fp.read().decode('utf-8'))
+    def stream_from_web(self, url):
+        """
+        Yields url from the shared connection pool as byte string chunks.
+        If this collector is conditional, NotModified is raised when the
+        page hasn't changed since we last retrieved it.
+        """
+        logger.debug('Loading {} from the web'.format(url))
 
-        return data
+        try:
+            with throttle.request(url):
+                for chunk in pool.stream(url, conditional=self.conditional):
+                    yield chunk
+        except (urllib2.HTTPError, urllib2.URLError):
+            logger.error('Unable to load page at {}'.format(url))
+            raise
 
     def load_from_web(self, url):
+        return ''.join(self.stream_from_web(url))
+
+    def scrape(self):
+        """
+        Retrieve, verify and parse our page. A freshly downloaded page is
+        only kept in the cache once it has been successfully parsed.
+        """
         try:
-            logger.debug('Loading {} from the web'.format(url))
+            with metrics.timer('nhlstats_scrape_seconds',
+                               collector=type(self).__name__):
+                return self.process(self.iter_data(self.url))
+        finally:
+            self.abort_cache()
 
-            request = urllib2.Request(url)
-            request.add_header('User-Agent', USER_AGENT)
+    def fetch(self):
+        """
+        Retrieve our page, returning its byte string chunks, for those
+        that want to process it elsewhere. A freshly downloaded page is
+        held for the cache until process commits it or abort_cache is
+        called.
+        """
+        return list(self.iter_data(self.url))
 
-            data = urllib2.urlopen(request)
+    def process(self, chunks):
+        """
+        Build, verify and parse our page from its chunks, keeping a freshly
+        downloaded page in the cache once it has been parsed.
+        """
+        result = self.parse_page(chunks)
+        self.commit_cache(final=self.is_final(result))
+        return result
 
-            return StringIO(data.read().decode('utf-8'))
-        except (urllib2.HTTPError, urllib2.URLError):
-            logger.error('Unable to load page at {}'.format(url))
-            raise
+    def parse_page(self, chunks):
+        """
+        Build, verify and parse our page from its chunks. This touches
+        nothing but the collector, so may be run in another process.
+        """
+        collector = type(self).__name__
+
+        with metrics.timer('nhlstats_parse_seconds', collector=collector,
+                           stage='build'):
+            data = self.build_document(chunks)
+
+        # The parse functionality must be implemented by
+        # our sub.  We currently aren't
+        with metrics.timer('nhlstats_parse_seconds', collector=collector,
+                           stage='verify'):
+            self.verify(data)
+        with metrics.timer('nhlstats_parse_seconds', collector=collector,
+                           stage='parse'):
+            return self.parse(data)
+
+    def __getstate__(self):
+        # The cache stays with us when we're sent to another process to
+        # be parsed.
+        state = self.__dict__.copy()
+        state['cache'] = None
+        state['cache_writer'] = None
+        return state
+
+    def build_document(self, chunks):
+        """
+        This should be implemented by classes that inherit from us, turning
+        the page's byte string chunks into the data handed to parse.
+        """
+        raise NotImplementedError
+
+    def is_final(self, result):
+        """
+        Collectors for pages that will never change once some state is
+        reached (a game ending, say) should return True here once result
+        shows it has been, so the page is cached for good.
+        """
+        return False
 
     def parse(self, data):
         """
@@ -184,13 +327,13 @@ class HTMLCollector(Collector):
     page.
     """
 
-    def scrape(self):
-        data = lxml_parser(self.load_data(self.url)).getroot()
-
-        # The parse functionality must be implemented by
-        # our sub.  We currently aren't
-        self.verify(data)
-        return self.parse(data)
+    def build_document(self, chunks):
+        # Feed the raw bytes straight to lxml as they arrive, rather than
+        # decoding the page ourselves first.
+        parser = HTMLParser(encoding='utf-8')
+        for chunk in chunks:
+            parser.feed(chunk)
+        return parser.close()
 
 
 class JSONCollector(Collector):
@@ -200,12 +343,8 @@ class JSONCollector(Collector):
     a JSON page.
     """
 
-    def scrape(self):
-        with self.load_data(self.url) as fp:
-            data = json.load(fp)
-
-        self.verify(data)
-        return self.parse(data)
+    def build_document(self, chunks):
+        return json.loads(''.join(chunks))
 
 
 class NHLArena(HTMLCollector):
@@ -258,47 +397,21 @@ class NHLDivisions(HTMLCollector):
         )
 
     def parse(self, data):
-        conferenceText = 'conferenceHeader'
-        i = 0
-
-        # Pick up normal teams
-        teams = [item.text for item in data.xpath(
-            '//td[@style="text-align:left;"]/a[2]')]
-
-        # Pick up teams that don't exist anymore (they're not links to team
-        # pages)
-        teams.extend(
-            [item.text for item in data.xpath('//span[@class="team"]')])
-
         results = {}
-
-        for team in teams:
-            i += 1
-            # An exception to our policy of using '{}'.format(foo)
-            # occurs here, as for some reason this throws unicode
-            # errors, in a way I don't care to further investigate
-            # beyond trying expected fixes.
-            division = data.xpath(
-                '//*[text()="%s"]/parent::td/parent::tr/parent::tbody/'
-                'preceding-sibling::thead/tr[1]/th[@abbr="DIV"]' % team
-            )[0].text
-
-            conference = [
-                item.get('class').replace(conferenceText, '')
-                for item in data.xpath(
-                    '//*[text()="%s"]/parent::td/parent::tr/parent::tbody/'
-                    'parent::table/preceding-sibling::div[starts-with('
-                    '@class, "%s")]' % (team, conferenceText)
-                )
-            ][-1]
-
-            if conference not in results:
-                results[conference] = {}
-
-            if division not in results[conference]:
-                results[conference][division] = []
-
-            results[conference][division].append(team)
+        conference = None
+        division = None
+
+        # The standings come in document order, so each team belongs to
+        # the most recent conference header and division table we've
+        # passed.
+        for item in STANDINGS(data):
+            if item.tag == 'div':
+                conference = item.get('class').replace(CONFERENCE_HEADER, '')
+            elif item.tag == 'th':
+                division = item.text
+            elif conference is not None and division is not None:
+                divisions = results.setdefault(conference, {})
+                divisions.setdefault(division, []).append(item.text)
 
         return results
 
@@ -559,68 +672,194 @@ class NHLEventLocations(JSONCollector):
 
 class NHLEvents(HTMLCollector):
 
-    def __init__(self, season, reportid, url=EVENT_URL, *args, **kwargs):
+    """
+    Scrapes the play by play report for a game. Given since, the
+    (number, period, elapsed) of the last event already seen, only the
+    events after it are parsed. Should the report have been revised so
+    that event no longer matches, every event is parsed again.
+    """
+
+    def __init__(self, season, reportid, url=EVENT_URL, since=None,
+                 *args, **kwargs):
         self.season = season
         self.reportid = reportid
+        self.since = since
         super(NHLEvents, self).__init__(
             url.format(season, reportid),
             *args,
             **kwargs
         )
 
-    def parse(self, data):
-        events = []
-        for row in data.xpath('//tr[@class="evenColor"]'):
-            rowdata = row.xpath('td')
-            awayice = [cell for cell in rowdata[6].xpath(
-                'table/tr/td') if u'\xa0' not in cell.text_content()]
-            homeice = [cell for cell in rowdata[7].xpath(
-                'table/tr/td') if u'\xa0' not in cell.text_content()]
-
-            events.append({
-                'period': rowdata[1].text,
-                'time': rowdata[3].text,
-                'event': rowdata[4].text,
-                'description': rowdata[5].text,
-                'away': [],
-                'home': []
+    def at_since(self, row):
+        """
+        Whether row is the event at our high water mark, as we remember it.
+        """
+        number, period, elapsed = self.since
+        return (int(row[0].text) == number and
+                int(row[1].text) == period and
+                to_seconds(row[3].text) == elapsed)
+
+    def rows_since(self, rows):
+        """
+        Returns the rows after our high water mark, or every row if the
+        high water mark can't be found as we remember it.
+        """
+        for i, row in enumerate(rows):
+            if int(row[0].text) < self.since[0]:
+                continue
+            if self.at_since(row):
+                return rows[i + 1:]
+            break
+
+        logger.info('Report {} has been revised since event {}'.format(
+            self.reportid, self.since[0]
+        ))
+        return rows
+
+    def parse_on_ice(self, cell):
+        players = []
+        for player in ON_ICE(cell):
+            details = PLAYER(player)
+            players.append({
+                'player': details[0].text_content().strip(),
+                'position': details[1].text_content().strip(),
             })
+        return players
 
-            for player in awayice:
-                events[-1]['away'].append({
-                    'player': player.xpath(
-                        'table/tr/td'
-                    )[0].text_content().strip(),
-                    'position': player.xpath(
-                        'table/tr/td'
-                    )[1].text_content().strip()
-                })
-
-            for player in homeice:
-                events[-1]['home'].append({
-                    'player': player.xpath(
-                        'table/tr/td'
-                    )[0].text_content().strip(),
-                    'position': player.xpath(
-                        'table/tr/td'
-                    )[1].text_content().strip()
-                })
-
-        return events
+    def parse_row(self, row):
+        rowdata = CELLS(row)
 
-    def verify(self, data):
-        header = '\r\n#\r\nPer\r\nStr\r\nTime:ElapsedGame\r\nEvent\r\n'
-        header += 'Description\r\nTOR On Ice\r\nWSH On Ice\r\n'
+        # Elapsed and remaining time share a cell, split by a <br>, as do
+        # a goal and its assists.
+        clock = rowdata[3]
 
-        headerSearch = [
-            e for e in data.xpath('//tr') if e.text_content() == header
-        ]
+        return {
+            'number': rowdata[0].text,
+            'period': rowdata[1].text,
+            'strength': (rowdata[2].text or '').strip() or None,
+            'time': clock.text,
+            'remaining': clock[0].tail if len(clock) else None,
+            'event': rowdata[4].text,
+            'description': ' '.join(rowdata[5].itertext()) or None,
+            'away': self.parse_on_ice(rowdata[6]),
+            'home': self.parse_on_ice(rowdata[7]),
+        }
+
+    def parse(self, data):
+        rows = EVENT_ROWS(data)
+        if self.since:
+            rows = self.rows_since(rows)
 
-        if headerSearch and not (data.xpath('//table[@id="Visitor"]') and
-           data.xpath('//table[@id="Home"]')):
+        return [self.parse_row(row) for row in rows]
 
+    def report_part(self, row):
+        """
+        The part of a game report row shows we have, if any: the name of
+        the team table it's in, or that it's the heading of the events.
+        """
+        table = row.getparent()
+        if table is not None and table.get('id') in REPORT_TEAMS:
+            return table.get('id')
+
+        cells = [cell.text_content().strip() for cell in CELLS(row)]
+        if cells[:len(EVENT_HEADINGS)] == EVENT_HEADINGS and \
+                len(cells) == len(EVENT_HEADINGS) + 2:
+            return 'heading'
+        return None
+
+    def verify_parts(self, parts):
+        if not set(REPORT_TEAMS + ('heading',)) <= parts:
             raise UnexpectedPageContents(
                 'Unable to locate events page as expected on {}'.format(
-                    data.base_url
+                    self.url
                 )
             )
+
+    def stream_rows(self, chunks):
+        """
+        Yields each event row as soon as it has been parsed, throwing it
+        and anything before it away once the caller is done with it.
+        Raises UnexpectedPageContents before the first row, or at the end
+        if there are none, should this not be a game report.
+        """
+        parser = etree.HTMLPullParser(
+            events=('end',), tag='tr', encoding='utf-8'
+        )
+        parser.set_element_class_lookup(HtmlElementClassLookup())
+        parts = set()
+        verified = False
+
+        for chunk in itertools.chain(chunks, [None]):
+            if chunk is None:
+                parser.close()
+            else:
+                parser.feed(chunk)
+
+            for _, row in parser.read_events():
+                # On ice players are laid out in rows of their own, which
+                # have been dealt with by the time their event row ends.
+                if row.get('class') != 'evenColor':
+                    if not verified:
+                        parts.add(self.report_part(row))
+                    continue
+
+                if not verified:
+                    self.verify_parts(parts)
+                    verified = True
+
+                yield row
+
+                row.clear()
+                while row.getprevious() is not None:
+                    del row.getparent()[0]
+
+        if not verified:
+            self.verify_parts(parts)
+
+    def iter_events(self):
+        """
+        Like scrape, but yields events one by one as the report streams
+        in, without ever holding the whole report, so memory use doesn't
+        grow with its length. As the rows before our high water mark are
+        gone once passed, ReportRevised is raised if it isn't matched.
+        """
+        since = self.since
+        final = False
+        parsing = 0.0
+
+        try:
+            for row in self.stream_rows(self.iter_data(self.url)):
+                if since:
+                    if int(row[0].text) < since[0]:
+                        continue
+                    if not self.at_since(row):
+                        raise ReportRevised(self.url)
+                    since = None
+                    continue
+
+                start = metrics.clock()
+                event = self.parse_row(row)
+                parsing += metrics.clock() - start
+                final = final or event['event'] == 'GEND'
+                yield event
+
+            if since:
+                raise ReportRevised(self.url)
+
+            self.commit_cache(final=final)
+        finally:
+            # Rows are built as the page streams in, so only the time
+            # spent parsing them can be told apart from fetching.
+            metrics.observe('nhlstats_parse_seconds', parsing,
+                            collector=type(self).__name__, stage='parse')
+            self.abort_cache()
+
+    def is_final(self, result):
+        # Once the game has ended the report won't change.
+        return any(event['event'] == 'GEND' for event in result)
+
+    def verify(self, data):
+        self.verify_parts(set(
+            self.report_part(row) for row in
+            data.xpath('//table[@id]/tr | //tr[@class="heading"]')
+        ))
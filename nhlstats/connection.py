@@ -0,0 +1,279 @@
+"""
+Connection provides the HTTP layer the collectors fetch pages through.
+
+Connections are kept alive and reused per host, bodies are requested
+gzipped, and validators (ETag and Last-Modified) are remembered for
+each URL so pages can be fetched conditionally.
+"""
+
+import zlib
+import socket
+import urllib2
+import httplib
+import logging
+import threading
+from Queue import LifoQueue, Empty, Full
+from urlparse import urlsplit, urljoin
+from StringIO import StringIO
+
+from .version import __version__
+
+logger = logging.getLogger(__name__)
+logger.debug('Loading {} ver {}'.format(__name__, __version__))
+
+
+USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2227.1 Safari/537.36'
+
+# How many idle connections we'll hang on to for each host.
+DEFAULT_POOL_SIZE = 4
+DEFAULT_TIMEOUT = 30
+CHUNK_SIZE = 64 * 1024
+MAX_REDIRECTS = 5
+
+# Errors that tell us a kept alive connection went stale underneath us.
+STALE_CONNECTION_ERRORS = (
+    httplib.BadStatusLine,
+    httplib.IncompleteRead,
+    httplib.CannotSendRequest,
+    socket.error,
+)
+
+
+class NotModified(Exception):
+
+    """
+    Raised when a conditional request finds the page unchanged since we
+    last retrieved it.
+    """
+    pass
+
+
+class Validators(object):
+
+    """
+    Remembers the ETag and Last-Modified headers we've seen for each URL.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.validators = {}
+
+    def headers(self, url):
+        """
+        The headers needed to make a conditional request for url.
+        """
+        with self.lock:
+            etag, last_modified = self.validators.get(url, (None, None))
+
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def update(self, url, response):
+        etag = response.getheader('etag')
+        last_modified = response.getheader('last-modified')
+
+        with self.lock:
+            if etag or last_modified:
+                self.validators[url] = (etag, last_modified)
+            else:
+                self.validators.pop(url, None)
+
+    def forget(self, url):
+        """
+        Have the next conditional request for url made in full, when what
+        we last retrieved from it wasn't kept.
+        """
+        with self.lock:
+            self.validators.pop(url, None)
+
+    def clear(self):
+        with self.lock:
+            self.validators = {}
+
+
+class ConnectionPool(object):
+
+    """
+    Hands out persistent connections, keyed by scheme and host, and
+    fetches pages over them.
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.pools = {}
+        self.validators = Validators()
+
+    def get_pool(self, key):
+        with self.lock:
+            if key not in self.pools:
+                self.pools[key] = LifoQueue(self.size)
+            return self.pools[key]
+
+    def checkout(self, scheme, host):
+        """
+        Returns a connection to host and whether it was reused.
+        """
+        try:
+            return self.get_pool((scheme, host)).get_nowait(), True
+        except Empty:
+            if scheme == 'https':
+                connection_class = httplib.HTTPSConnection
+            else:
+                connection_class = httplib.HTTPConnection
+            return connection_class(host, timeout=self.timeout), False
+
+    def checkin(self, scheme, host, connection):
+        try:
+            self.get_pool((scheme, host)).put_nowait(connection)
+        except Full:
+            connection.close()
+
+    def close(self):
+        """
+        Close every idle connection.
+        """
+        with self.lock:
+            pools, self.pools = self.pools, {}
+
+        for pool in pools.values():
+            while True:
+                try:
+                    pool.get_nowait().close()
+                except Empty:
+                    break
+
+    def request(self, url, headers):
+        """
+        Make a single GET request for url, returning the connection it was
+        made on and the response, whose body is left for the caller to
+        read. A reused connection that turns out to be stale is retried
+        once on a fresh one.
+        """
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        while True:
+            connection, reused = self.checkout(parts.scheme, parts.netloc)
+            try:
+                connection.request('GET', path, headers=headers)
+                return connection, connection.getresponse()
+            except STALE_CONNECTION_ERRORS as error:
+                connection.close()
+                if reused:
+                    logger.debug('Retrying {} on a new connection'.format(url))
+                    continue
+                raise urllib2.URLError(error)
+
+    def release(self, url, connection, response):
+        """
+        Return a connection whose response has been fully read to the pool.
+        """
+        if response.will_close:
+            connection.close()
+        else:
+            parts = urlsplit(url)
+            self.checkin(parts.scheme, parts.netloc, connection)
+
+    def read(self, url, connection, response):
+        """
+        Read the rest of a response we don't care to stream.
+        """
+        try:
+            body = response.read()
+        except STALE_CONNECTION_ERRORS as error:
+            connection.close()
+            raise urllib2.URLError(error)
+
+        self.release(url, connection, response)
+        return body
+
+    def stream(self, url, conditional=False, chunk_size=CHUNK_SIZE):
+        """
+        Retrieve url, yielding the decoded body as byte string chunks as
+        they arrive.
+
+        If conditional is set and we've seen url before, the server is
+        asked to only send the page if it has changed, and NotModified is
+        raised if it hasn't. HTTP errors are raised as urllib2.HTTPError
+        so callers can treat us like urllib2.urlopen.
+        """
+        headers = {
+            'User-Agent': USER_AGENT,
+            'Accept-Encoding': 'gzip',
+        }
+        if conditional:
+            headers.update(self.validators.headers(url))
+
+        location = url
+        for _ in range(MAX_REDIRECTS + 1):
+            connection, response = self.request(location, headers)
+
+            if response.status in (301, 302, 303, 307, 308):
+                self.read(location, connection, response)
+                location = urljoin(location, response.getheader('location'))
+                logger.debug('Following redirect to {}'.format(location))
+                continue
+            break
+
+        if response.status == 304:
+            self.read(location, connection, response)
+            raise NotModified(url)
+
+        if response.status >= 300:
+            raise urllib2.HTTPError(
+                url,
+                response.status,
+                response.reason,
+                response.msg,
+                StringIO(self.read(location, connection, response))
+            )
+
+        decoder = None
+        if response.getheader('content-encoding') == 'gzip':
+            decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        complete = False
+        try:
+            while True:
+                try:
+                    chunk = response.read(chunk_size)
+                except STALE_CONNECTION_ERRORS as error:
+                    raise urllib2.URLError(error)
+                if not chunk:
+                    break
+                if decoder:
+                    chunk = decoder.decompress(chunk)
+                if chunk:
+                    yield chunk
+
+            if decoder:
+                chunk = decoder.flush()
+                if chunk:
+                    yield chunk
+            complete = True
+        finally:
+            # A connection abandoned part way through a body can't be
+            # reused.
+            if complete:
+                self.release(location, connection, response)
+                self.validators.update(url, response)
+            else:
+                connection.close()
+
+    def get(self, url, conditional=False):
+        """
+        Retrieve url, returning the decoded body as a single byte string.
+        """
+        return ''.join(self.stream(url, conditional=conditional))
+
+
+# The process wide pool used by every collector.
+pool = ConnectionPool()
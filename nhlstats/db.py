@@ -1,10 +1,12 @@
 import logging
 import os
 
+from peewee import DatabaseError, SqliteDatabase
 from playhouse.db_url import connect
+from playhouse.migrate import SchemaMigrator, migrate
 
 from nhlstats import models
-from nhlstats.models import db_proxy
+from nhlstats.models import db_proxy, invalidate_identity_maps
 from nhlstats.version import __version__
 
 
@@ -22,6 +24,7 @@ DEFAULT_SQLITE_DB = 'sqlite:///nhlstats.db'
 def connect_db():
     db_url = os.environ.get('DATABASE_URL') or DEFAULT_SQLITE_DB
     db_proxy.initialize(connect(db_url))
+    invalidate_identity_maps()
 
     if db_url == DEFAULT_SQLITE_DB:
         logger.warn('Using default SQLite database.')
@@ -47,3 +50,130 @@ def drop_tables():
             continue
         logger.info('Dropping {} table...'.format(model))
         m.drop_table()
+
+
+def model_indexes(model):
+    """
+    The (columns, unique) of every index create_table would give model.
+    """
+    indexes = [
+        ((field.db_column,), field.unique)
+        for field in model._fields_to_index()
+    ]
+    for fields, unique in model._meta.indexes or ():
+        indexes.append((
+            tuple(model._meta.fields[name].db_column for name in fields),
+            unique
+        ))
+    return indexes
+
+
+def table_indexes(database, table):
+    """
+    Returns {columns: unique} for each of table's indexes. Peewee can't
+    read the index list of newer SQLite versions, so we ask SQLite
+    ourselves.
+    """
+    if not isinstance(database, SqliteDatabase):
+        return dict(
+            (tuple(index.columns), index.unique)
+            for index in database.get_indexes(table)
+        )
+
+    indexes = {}
+    cursor = database.execute_sql('PRAGMA index_list("{}")'.format(table))
+    for row in cursor.fetchall():
+        name, unique = row[1], row[2]
+        cursor = database.execute_sql('PRAGMA index_info("{}")'.format(name))
+        indexes[tuple(info[2] for info in cursor.fetchall())] = bool(unique)
+    return indexes
+
+
+def migrate_model(model):
+    """
+    Add any of model's columns and indexes missing from its table, and
+    allow null in columns whose fields do. Returns a description of each
+    change made.
+    """
+    database = db_proxy.obj
+    table = model._meta.db_table
+    changes = []
+
+    if not model.table_exists():
+        model.create_table()
+        return ['created table {}'.format(table)]
+
+    columns = dict(
+        (column.name, column) for column in database.get_columns(table)
+    )
+    # Each change is made in a savepoint of its own, as on Postgres one
+    # that fails would otherwise abort the transaction, taking the changes
+    # already made with it.
+    migrator = SchemaMigrator.from_database(database)
+    for field in model._meta.get_fields():
+        if field.db_column in columns:
+            continue
+        try:
+            with db_proxy.atomic():
+                migrate(migrator.add_column(table, field.db_column, field))
+        except (DatabaseError, ValueError) as error:
+            logger.error('Unable to add {}.{}: {}'.format(
+                table, field.db_column, error
+            ))
+            continue
+        changes.append('added column {}.{}'.format(table, field.db_column))
+
+    # Fields that have since been allowed to be null. SQLite can't alter
+    # a column, so there the table is rebuilt.
+    for field in model._meta.get_fields():
+        column = columns.get(field.db_column)
+        if not field.null or column is None or column.null or \
+                column.primary_key:
+            continue
+        try:
+            with db_proxy.atomic():
+                migrate(migrator.drop_not_null(table, field.db_column))
+        except (DatabaseError, ValueError) as error:
+            logger.error('Unable to allow null {}.{}: {}'.format(
+                table, field.db_column, error
+            ))
+            continue
+        changes.append('allowed null {}.{}'.format(table, field.db_column))
+
+    existing = table_indexes(database, table)
+    for columns, unique in model_indexes(model):
+        if columns in existing:
+            continue
+        fields = [model._meta.fields[model._meta.columns[column].name]
+                  for column in columns]
+        try:
+            with db_proxy.atomic():
+                database.create_index(model, fields, unique)
+        except DatabaseError as error:
+            # Most likely a unique index over rows that aren't, which
+            # needs sorting out by hand rather than by dropping data.
+            logger.error('Unable to index {}({}): {}'.format(
+                table, ', '.join(columns), error
+            ))
+            continue
+        changes.append('added {}index on {}({})'.format(
+            'unique ' if unique else '', table, ', '.join(columns)
+        ))
+
+    return changes
+
+
+def migrate_tables():
+    """
+    Bring an existing database up to date with the models, creating
+    missing tables, adding missing columns and indexes, and dropping NOT
+    NULL from columns whose fields may now be null. No data is dropped.
+    """
+    connect_db()
+    for model in models.MODELS:
+        with db_proxy.atomic():
+            changes = migrate_model(getattr(models, model))
+        for change in changes:
+            logger.info('Migrated: {}'.format(change))
+        if not changes:
+            logger.debug('{} is up to date'.format(model))
@@ -0,0 +1,152 @@
+"""
+Engine runs many collectors at once.
+
+Pages are fetched on a pool of I/O threads and handed to a separate,
+smaller pool to be parsed, so waiting on the network and parsing overlap
+rather than taking turns. A semaphore bounds how many collectors are in
+flight, and so how many fetched pages can be waiting to be parsed.
+
+Parsing is CPU bound, so when pages are coming from a warm cache it can
+instead be spread over a pool of worker processes. Only the page goes
+to a worker and only the parsed result comes back, the cache and the
+database are left to the parent.
+
+Collectors themselves are unchanged, and scrape still works for callers
+that only want the one page.
+"""
+
+import logging
+import threading
+from functools import partial
+from concurrent.futures import Future, ThreadPoolExecutor, \
+    ProcessPoolExecutor, wait
+
+from .version import __version__
+
+logger = logging.getLogger(__name__)
+logger.debug('Loading {} ver {}'.format(__name__, __version__))
+
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_PARSERS = 2
+
+
+def parse_page(collector, chunks):
+    """
+    Parse a collector's page, in whichever pool the engine parses in.
+    """
+    return collector.parse_page(chunks)
+
+
+def parse_pool(parse_workers=None, parsers=DEFAULT_PARSERS):
+    """
+    The pool pages are parsed in: parse_workers processes if given,
+    otherwise parsers threads.
+    """
+    if parse_workers:
+        return ProcessPoolExecutor(max_workers=parse_workers)
+    return ThreadPoolExecutor(max_workers=parsers)
+
+
+class Engine(object):
+
+    """
+    Fetches and parses collectors concurrently, with at most concurrency
+    of them in flight at once. Given parse_workers, pages are parsed in
+    that many processes rather than in threads.
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY,
+                 parsers=DEFAULT_PARSERS, parse_workers=None):
+        self.fetchers = ThreadPoolExecutor(max_workers=concurrency)
+        self.parsers = parse_pool(parse_workers, parsers)
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self.parse_workers = parse_workers
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def submit(self, collector, profile=None):
+        """
+        Start collector, returning a Future for the result of its parse.
+        Blocks while too many collectors are already in flight. Given a
+        game's profile, the fetch and any parse done in a thread are
+        profiled as part of it.
+        """
+        self.semaphore.acquire()
+
+        result = Future()
+        try:
+            if profile is None:
+                fetched = self.fetchers.submit(collector.fetch)
+            else:
+                fetched = self.fetchers.submit(profile.call, collector.fetch)
+        except Exception:
+            self.semaphore.release()
+            raise
+
+        fetched.add_done_callback(
+            partial(self.fetched, collector, result, profile)
+        )
+        return result
+
+    def fetched(self, collector, result, profile, fetched):
+        try:
+            if profile is None or self.parse_workers:
+                parsed = self.parsers.submit(
+                    parse_page, collector, fetched.result()
+                )
+            else:
+                parsed = self.parsers.submit(
+                    profile.call, parse_page, collector, fetched.result()
+                )
+        except Exception as error:
+            self.finish(collector, result, error=error)
+        else:
+            parsed.add_done_callback(partial(self.parsed, collector, result))
+
+    def parsed(self, collector, result, parsed):
+        # Parsing may have happened elsewhere, but the cache is ours.
+        try:
+            value = parsed.result()
+            collector.commit_cache(final=collector.is_final(value))
+        except Exception as error:
+            self.finish(collector, result, error=error)
+        else:
+            self.finish(collector, result, value=value)
+
+    def finish(self, collector, result, value=None, error=None):
+        # Anything process didn't commit to the cache isn't wanted.
+        collector.abort_cache()
+        self.semaphore.release()
+
+        if not result.set_running_or_notify_cancel():
+            return
+
+        if error is not None:
+            logger.debug('Failed to collect {}: {}'.format(
+                collector.url, error
+            ))
+            result.set_exception(error)
+        else:
+            result.set_result(value)
+
+    def gather(self, collectors):
+        """
+        Run every collector, returning their results in the same order.
+        The first error, in that order, is raised once they've all
+        finished.
+        """
+        futures = [self.submit(collector) for collector in collectors]
+        wait(futures)
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        """
+        Wait for everything in flight to finish, then stop the pools.
+        """
+        self.fetchers.shutdown()
+        self.parsers.shutdown()
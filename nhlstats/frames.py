@@ -0,0 +1,218 @@
+"""
+Frames hold a season's events as NumPy column arrays for analysis.
+
+Loading Event rows as models costs a dict of field values and a handful
+of lazy foreign keys per event, which adds up to hundreds of bytes an
+event before anything is done with them. A frame reads the columns
+analysis wants in a single query and keeps each as a packed array, a
+few dozen bytes an event, so a whole season can be filtered and counted
+with vectorized operations:
+
+    frame = EventFrame.for_season(season)
+    goals = frame[(frame['type'] == frame.code('type', 'goal')) &
+                  (frame['period'] <= 3)]
+    goals.count_by('team', 'strength')
+
+String columns are stored as small integer codes, which code() and
+decode() translate. Foreign keys that are null are stored as 0.
+
+NumPy is an optional dependency, installed with the analytics extra.
+"""
+
+import array
+import logging
+
+from .version import __version__
+from .models import Event, Game
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger(__name__)
+logger.debug('Loading {} ver {}'.format(__name__, __version__))
+
+
+# How many rows are read from the cursor at once while loading.
+FETCH_SIZE = 10000
+
+# Every column, with the Event field it's read from and the dtype it's
+# kept as.
+COLUMNS = [
+    ('id', Event.id, 'int32'),
+    ('game', Event.game, 'int32'),
+    ('number', Event.number, 'int16'),
+    ('period', Event.period, 'int8'),
+    ('elapsed', Event.elapsed, 'int16'),
+    ('type', Event.type, 'uint8'),
+    ('strength', Event.strength, 'uint8'),
+    ('team', Event.team, 'int32'),
+    ('player1', Event.player1, 'int32'),
+    ('player2', Event.player2, 'int32'),
+    ('player3', Event.player3, 'int32'),
+]
+
+# Columns whose values are stored as codes.
+CATEGORICAL = ('type', 'strength')
+
+
+def require_numpy():
+    if numpy is None:
+        raise ImportError(
+            'EventFrame needs numpy, install nhlstats[analytics]'
+        )
+
+
+def to_column(buffer, dtype):
+    if not len(buffer):
+        return numpy.zeros(0, dtype)
+    return numpy.frombuffer(buffer, dtype='l').astype(dtype)
+
+
+class EventFrame(object):
+
+    """
+    Events as a set of equal length column arrays.
+
+    :param columns: column name to array.
+    :type columns: dict
+    :param categories: for each categorical column, the values its codes
+        stand for, in code order.
+    :type categories: dict
+    """
+
+    def __init__(self, columns, categories):
+        require_numpy()
+        self.columns = columns
+        self.categories = categories
+
+    @classmethod
+    def for_season(cls, season):
+        """
+        Load every event of the games in season, in game and event order.
+        """
+        return cls.from_query(
+            Event.select().join(Game).where(Game.season == season)
+            .order_by(Event.game, Event.number)
+        )
+
+    @classmethod
+    def from_query(cls, query):
+        """
+        Load the events an Event query selects, reading only the columns
+        a frame keeps.
+        """
+        require_numpy()
+        query = query.select(*[field for _, field, _ in COLUMNS])
+        sql, params = query.sql()
+        cursor = query.database.execute_sql(sql, params)
+
+        # Rows are gathered into arrays of C longs as they're read, so
+        # we never hold more than a batch of them as Python objects.
+        names = [name for name, _, _ in COLUMNS]
+        buffers = [array.array('l') for _ in COLUMNS]
+        codes = dict((name, {}) for name in CATEGORICAL)
+        coders = [codes.get(name) for name in names]
+
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            for index, values in enumerate(zip(*rows)):
+                coder = coders[index]
+                if coder is not None:
+                    values = [coder.setdefault(value, len(coder))
+                              for value in values]
+                else:
+                    values = [value or 0 for value in values]
+                buffers[index].extend(values)
+
+        columns = dict(
+            (name, to_column(buffer, dtype))
+            for name, buffer, (_, _, dtype) in zip(names, buffers, COLUMNS)
+        )
+        categories = dict(
+            (name, tuple(sorted(coder, key=coder.get)))
+            for name, coder in codes.items()
+        )
+        return cls(columns, categories)
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def __repr__(self):
+        return '<EventFrame: {} events, {} bytes>'.format(
+            len(self), self.nbytes
+        )
+
+    def __getitem__(self, key):
+        """
+        A column given its name, or a frame of the rows a boolean mask
+        or array of indexes selects.
+        """
+        if isinstance(key, basestring):
+            return self.columns[key]
+        return EventFrame(
+            dict((name, column[key]) for name, column in self.columns.items()),
+            self.categories
+        )
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values())
+
+    def code(self, column, value):
+        """
+        The code value is stored as in a categorical column, or -1 if
+        there are no such events, so comparisons against it match none.
+        """
+        try:
+            return self.categories[column].index(value)
+        except ValueError:
+            return -1
+
+    def decode(self, column, values):
+        """
+        The values a categorical column's codes stand for. Other columns
+        are returned as they are.
+        """
+        if column not in self.categories:
+            return values
+        return numpy.array(self.categories[column], dtype=object)[values]
+
+    def where(self, **conditions):
+        """
+        The rows where each column equals the value given, categorical
+        columns being given their values rather than their codes.
+        """
+        mask = numpy.ones(len(self), dtype=bool)
+        for column, value in conditions.items():
+            if column in self.categories:
+                value = self.code(column, value)
+            mask &= self.columns[column] == value
+        return self[mask]
+
+    def count_by(self, *columns):
+        """
+        How many rows there are for each distinct combination of columns,
+        as {key: count} where key is a value for a single column and a
+        tuple of values otherwise.
+        """
+        if not columns:
+            raise ValueError('count_by needs at least one column')
+        if not len(self):
+            return {}
+
+        stacked = numpy.column_stack([
+            self.columns[column].astype(numpy.int64) for column in columns
+        ])
+        keys, counts = numpy.unique(stacked, axis=0, return_counts=True)
+        decoded = [
+            self.decode(column, keys[:, index]).tolist()
+            for index, column in enumerate(columns)
+        ]
+
+        if len(columns) == 1:
+            return dict(zip(decoded[0], counts.tolist()))
+        return dict(zip(zip(*decoded), counts.tolist()))
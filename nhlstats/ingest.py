@@ -0,0 +1,338 @@
+"""
+Ingest turns scraped schedules into Game rows, and the events scraped
+from a game report into Event and EventPlayer rows.
+
+Schedules are compared against the games already stored for the season,
+so only new and changed games are written.
+
+Each game is written in a single transaction using batched inserts, as
+a game report runs to some 300 events with up to a dozen players on the
+ice for each. Games keep a high water mark of the last event stored, so
+while a game is live only the events added since the last look need to
+be handled. The players' season totals are brought up to date in the
+same transaction, see aggregates.
+"""
+
+import re
+import logging
+
+from .version import __version__
+from .collect import to_seconds
+from .metrics import metrics
+from .aggregates import game_totals, update_stats, append_stats
+from .models import db_proxy, batches, insert_rows, Event, EventPlayer, \
+    Player, Roster, Team, Game
+
+logger = logging.getLogger(__name__)
+logger.debug('Loading {} ver {}'.format(__name__, __version__))
+
+
+# Maps game report event codes to Event.EVENT_TYPES, anything not listed
+# is stored as its lowercased code.
+EVENT_TYPES = {
+    'BLOCK': 'block',
+    'PEND': 'end',
+    'FAC': 'face',
+    'GIVE': 'give',
+    'GOAL': 'goal',
+    'HIT': 'hit',
+    'MISS': 'miss',
+    'PENL': 'penalty',
+    'SHOT': 'shot',
+    'PSTR': 'start',
+    'STOP': 'stop',
+    'TAKE': 'take',
+}
+
+STRENGTHS = {
+    'EV': 'ev',
+    'PP': 'pp',
+    'SH': 'sh',
+}
+
+SHOT_TYPES = {
+    'Slap': 'slap',
+    'Snap': 'snap',
+    'Wrist': 'wrist',
+}
+
+TEAM_REGEX = re.compile(r'^(?P<team>[A-Z]{2,3}) ')
+ZONE_REGEX = re.compile(r'(?P<zone>Off|Def|Neu)\. Zone')
+SHOT_REGEX = re.compile(
+    r', (?P<shot_type>Wrist|Slap|Snap|Backhand|Tip-In|Wrap-around|'
+    r'Deflected)[,]'
+)
+DISTANCE_REGEX = re.compile(r'(?P<distance>[0-9]+) ft\.')
+# Sweater numbers, along with the team if given. Those without a team
+# are the event's team's, as with the shooter on a shot or a goal's
+# assists.
+PLAYER_REGEX = re.compile(r'(?:\b(?P<team>[A-Z]{2,3}) )?#(?P<number>[0-9]+)')
+# Player names are in capitals, while penalties are not.
+PENALTY_REGEX = re.compile(
+    r'(?P<penalty>[A-Z][a-z][^(]*?)\s*\((?P<minutes>[0-9]+) min\)'
+)
+
+
+def store_schedule(season, games):
+    """
+    Store the games scraped from season's schedule in a single
+    transaction, matching them to stored games by report id. Games
+    between teams we don't have, such as those since relocated, are
+    skipped. Returns the number of games inserted, updated and left
+    unchanged.
+    """
+    with metrics.timer('nhlstats_db_seconds', operation='store_schedule'), \
+            db_proxy.atomic():
+        stored = dict(
+            (report_id, (game_id, (start, home, road)))
+            for game_id, report_id, start, home, road in Game.select(
+                Game.id, Game.report_id, Game.start, Game.home, Game.road
+            ).where(Game.season == season).tuples()
+        )
+
+        new = []
+        changes = {}
+        unchanged = 0
+        skipped = 0
+        for game in games:
+            try:
+                values = (game['start'], Team.cached(code=game['home']).id,
+                          Team.cached(code=game['road']).id)
+            except Team.DoesNotExist:
+                logger.warning('Skipping game {}, {} at {}, as we have no '
+                               'such team'.format(game['report_id'],
+                                                  game['road'], game['home']))
+                skipped += 1
+                continue
+
+            if game['report_id'] not in stored:
+                new.append({
+                    'season': season.id,
+                    'report_id': game['report_id'],
+                    'start': values[0],
+                    'home': values[1],
+                    'road': values[2],
+                })
+                # Guard against a game being listed twice.
+                stored[game['report_id']] = (None, values)
+            elif stored[game['report_id']][1] != values:
+                game_id = stored[game['report_id']][0]
+                changes.setdefault(values, []).append(game_id)
+            else:
+                unchanged += 1
+
+        insert_rows(Game, new)
+
+        # Rescheduled games tend to move together, so games sharing their
+        # new values are updated at once.
+        for (start, home, road), game_ids in changes.items():
+            for batch in batches(game_ids, 1):
+                Game.update(start=start, home=home, road=road).where(
+                    Game.id << batch
+                ).execute()
+
+    updated = sum(len(game_ids) for game_ids in changes.values())
+    logger.info(
+        '{} {} games: {} inserted, {} updated, {} unchanged, {} '
+        'skipped'.format(
+            season.year, season.type.name, len(new), updated, unchanged,
+            skipped
+        )
+    )
+
+    return len(new), updated, unchanged
+
+
+class PlayerDirectory(object):
+
+    """
+    Resolves the sweater numbers found in a game report to players,
+    by way of each team's roster for the season. Players we haven't
+    seen before are added to the roster as we go.
+    """
+
+    def __init__(self, season, teams):
+        self.season = season
+        self.players = dict(
+            ((team, no), player) for team, no, player in Roster.select(
+                Roster.team, Roster.no, Roster.player
+            ).where(
+                (Roster.season == season) & (Roster.team << list(teams))
+            ).tuples()
+        )
+
+    def get(self, team, number, position):
+        key = (team.id, int(number))
+        if key not in self.players:
+            player = Player.create(
+                name='{} #{}'.format(team.code, number),
+                no=number,
+                pos=position
+            )
+            Roster.create(
+                season=self.season,
+                team=team,
+                player=player,
+                no=number
+            )
+            logger.debug('Added {} to the {} roster'.format(
+                player.name, team.code
+            ))
+            self.players[key] = player.id
+        return self.players[key]
+
+    def find(self, team, number):
+        """
+        The player wearing number for team, or None if we've not seen
+        them.
+        """
+        return self.players.get((team.id, int(number)))
+
+
+def event_row(game, event, players):
+    """
+    Maps a scraped event to the columns of an Event row, crediting the
+    players its description names, in order, as player1 to player3: the
+    scorer and assists of a goal, the shooter and blocker of a blocked
+    shot, the player penalized and the player who drew the penalty.
+    """
+    description = event.get('description')
+    teams = {game.home.code: game.home, game.road.code: game.road}
+
+    team = None
+    zone = None
+    match = TEAM_REGEX.match(description or '')
+    if match and match.group('team') in teams:
+        team = teams[match.group('team')]
+
+        # Zones are reported relative to the team responsible for the
+        # event, we store them in terms of whose end of the ice it was.
+        match = ZONE_REGEX.search(description)
+        if match:
+            if match.group('zone') == 'Neu':
+                zone = 'neutral'
+            elif (match.group('zone') == 'Def') == (team == game.home):
+                zone = 'home'
+            else:
+                zone = 'road'
+
+    row = {
+        'game': game.id,
+        'team': team.id if team else None,
+        'number': int(event['number']),
+        'period': int(event['period']),
+        'strength': STRENGTHS.get(event.get('strength'), 'ev'),
+        'elapsed': to_seconds(event['time']),
+        'remaining': to_seconds(event.get('remaining')),
+        'type': EVENT_TYPES.get(event['event'], event['event'].lower()),
+        'zone': zone,
+        'description': description,
+        'shot_type': None,
+        'distance': None,
+        'penalty': None,
+        'penalty_minutes': None,
+        'player1': None,
+        'player2': None,
+        'player3': None,
+    }
+
+    credited = []
+    for match in PLAYER_REGEX.finditer(description or ''):
+        side = teams.get(match.group('team')) if match.group('team') \
+            else team
+        if side is not None:
+            credited.append(players.find(side, match.group('number')))
+    for field, player in zip(('player1', 'player2', 'player3'), credited):
+        row[field] = player
+
+    if event['event'] in ('SHOT', 'MISS', 'GOAL', 'BLOCK'):
+        match = SHOT_REGEX.search(description or '')
+        if match:
+            shot_type = match.group('shot_type')
+            row['shot_type'] = SHOT_TYPES.get(shot_type, shot_type.lower())
+        match = DISTANCE_REGEX.search(description or '')
+        if match:
+            row['distance'] = int(match.group('distance'))
+    elif event['event'] == 'PENL':
+        match = PENALTY_REGEX.search(description or '')
+        if match:
+            row['penalty'] = match.group('penalty')
+            row['penalty_minutes'] = int(match.group('minutes'))
+
+    return row
+
+
+def ingest_game_events(game, events):
+    """
+    Store the events scraped from game's report, in a single transaction.
+
+    Events are normally those past the game's high water mark, and are
+    added to what we've already stored. If they go back over ground
+    we've covered (the report was revised, or we've never seen the game)
+    the game's stored events are replaced instead.
+    """
+    if not events:
+        return
+
+    sides = {'away': game.road, 'home': game.home}
+    first = int(events[0]['number'])
+    append = game.last_event is not None and first > game.last_event
+
+    with metrics.timer('nhlstats_db_seconds', operation='ingest_events'), \
+            db_proxy.atomic():
+        players = PlayerDirectory(game.season, sides.values())
+        if not append:
+            # What the game had earned the players so far, so the season
+            # totals can be moved on by the difference once we're done.
+            before = game_totals(game) if game.last_event is not None \
+                else {}
+            EventPlayer.delete().where(EventPlayer.event << Event.select(
+                Event.id
+            ).where(Event.game == game)).execute()
+            Event.delete().where(Event.game == game).execute()
+
+        # Meet everyone on the ice first, so players named in the
+        # descriptions are already known along with their positions.
+        for event in events:
+            for side, team in sides.items():
+                for player in event[side]:
+                    players.get(team, player['player'], player['position'])
+
+        insert_rows(Event, [event_row(game, event, players)
+                            for event in events])
+
+        event_ids = dict(Event.select(Event.number, Event.id).where(
+            (Event.game == game) & (Event.number >= first)
+        ).tuples())
+
+        on_ice = []
+        for event in events:
+            event_id = event_ids[int(event['number'])]
+            for side, team in sides.items():
+                for player in event[side]:
+                    on_ice.append({
+                        'event': event_id,
+                        'team': team.id,
+                        'player': players.get(
+                            team,
+                            player['player'],
+                            player['position']
+                        ),
+                    })
+
+        insert_rows(EventPlayer, on_ice)
+        if append:
+            append_stats(game, first)
+        else:
+            update_stats(game, before)
+
+        last = events[-1]
+        game.last_event = int(last['number'])
+        game.last_event_period = int(last['period'])
+        game.last_event_elapsed = to_seconds(last['time'])
+        game.save()
+
+    metrics.inc('nhlstats_events_stored_total', len(events))
+    logger.debug('Stored {} events and {} on ice players for {}'.format(
+        len(events), len(on_ice), game
+    ))
@@ -0,0 +1,296 @@
+"""
+Metrics keeps count of where the time goes while we collect.
+
+Collectors record how long pages take to fetch and parse, how many bytes
+they were and whether they came from the cache, and ingest records how
+long it spends writing to the database. Everything is kept in a process
+wide registry, which can be written out in the Prometheus text format,
+either to a file (for node_exporter's textfile collector, say) or served
+over HTTP.
+
+Pages parsed in worker processes have their parse times recorded there,
+so those don't show up in the parent's registry.
+"""
+
+import os
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from monotonic import monotonic
+
+from .version import __version__
+
+logger = logging.getLogger(__name__)
+logger.debug('Loading {} ver {}'.format(__name__, __version__))
+
+
+# How often, in seconds, the metrics file is rewritten.
+DEFAULT_WRITE_INTERVAL = 15
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+COUNTER = 'counter'
+SUMMARY = 'summary'
+
+# Every metric we record, with its type and help text.
+METRICS = {
+    'nhlstats_cache_requests_total': (
+        COUNTER, 'Pages looked for in the cache, by whether they were found.'
+    ),
+    'nhlstats_fetch_seconds': (
+        SUMMARY, 'Time spent reading pages, from the cache or the web.'
+    ),
+    'nhlstats_fetch_bytes_total': (
+        COUNTER, 'Bytes of pages read, from the cache or the web.'
+    ),
+    'nhlstats_parse_seconds': (
+        SUMMARY, 'Time spent building, verifying and parsing pages.'
+    ),
+    'nhlstats_scrape_seconds': (
+        SUMMARY, 'Time spent scraping a page from start to finish.'
+    ),
+    'nhlstats_db_seconds': (
+        SUMMARY, 'Time spent writing what we collected to the database.'
+    ),
+    'nhlstats_events_stored_total': (
+        COUNTER, 'Game events written to the database.'
+    ),
+    'nhlstats_identity_map_lookups_total': (
+        COUNTER, 'Reference model lookups, by whether they were cached.'
+    ),
+    'nhlstats_throttle_requests_total': (
+        COUNTER, 'Requests made through the throttle, by host.'
+    ),
+    'nhlstats_throttle_waits_total': (
+        COUNTER, 'Requests the throttle made wait, by host.'
+    ),
+    'nhlstats_throttle_wait_seconds_total': (
+        COUNTER, 'Time requests spent waiting on the throttle, by host.'
+    ),
+}
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(key, unicode(value).replace('\\', r'\\')
+                         .replace('"', r'\"').replace('\n', r'\n'))
+        for key, value in labels
+    ))
+
+
+class MetricsRegistry(object):
+
+    """
+    Counters and summaries (a count and total of observations), each
+    kept per distinct set of labels. Callbacks registered with the
+    registry are asked for further samples whenever it is rendered, so
+    stats kept elsewhere needn't be duplicated here.
+
+    clock may be replaced, which is mostly useful for testing.
+    """
+
+    def __init__(self, clock=monotonic):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.summaries = {}
+        self.callbacks = []
+
+    def key(self, name, labels):
+        if name not in METRICS:
+            raise ValueError('Unknown metric "{}"'.format(name))
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        """
+        Add value to a counter.
+        """
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        Record an observation, usually a duration in seconds, against a
+        summary.
+        """
+        key = self.key(name, labels)
+        with self.lock:
+            count, total = self.summaries.get(key, (0, 0.0))
+            self.summaries[key] = (count + 1, total + value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Observe how long the with block took.
+        """
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.observe(name, self.clock() - start, **labels)
+
+    def timed(self, chunks, name, bytes_name, **labels):
+        """
+        Pass chunks through, observing the time spent producing them and
+        counting their bytes once they're exhausted, or abandoned. Time
+        the consumer spends between chunks isn't counted.
+        """
+        elapsed = 0.0
+        size = 0
+        chunks = iter(chunks)
+        try:
+            while True:
+                start = self.clock()
+                try:
+                    chunk = next(chunks)
+                finally:
+                    elapsed += self.clock() - start
+                size += len(chunk)
+                yield chunk
+        except StopIteration:
+            pass
+        finally:
+            self.observe(name, elapsed, **labels)
+            self.inc(bytes_name, size, **labels)
+
+    def register(self, callback):
+        """
+        Add a callback returning (name, labels, value) samples to be
+        rendered along with our own.
+        """
+        self.callbacks.append(callback)
+
+    def reset(self):
+        """
+        Forget everything recorded so far.
+        """
+        with self.lock:
+            self.counters = {}
+            self.summaries = {}
+
+    def samples(self):
+        """
+        Returns {name: [(suffix, labels, value), ...]}, summaries being
+        rendered as their _count and _sum.
+        """
+        samples = {}
+        with self.lock:
+            for (name, labels), value in self.counters.items():
+                samples.setdefault(name, []).append(('', labels, value))
+            for (name, labels), (count, total) in self.summaries.items():
+                samples.setdefault(name, []).extend([
+                    ('_count', labels, count),
+                    ('_sum', labels, total),
+                ])
+
+        for callback in self.callbacks:
+            for name, labels, value in callback():
+                samples.setdefault(name, []).append(
+                    ('', self.key(name, labels)[1], value)
+                )
+        return samples
+
+    def render(self):
+        """
+        Everything recorded, in the Prometheus text exposition format.
+        """
+        lines = []
+        for name, samples in sorted(self.samples().items()):
+            kind, description = METRICS[name]
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} {}'.format(name, kind))
+
+            for suffix, labels, value in sorted(samples):
+                lines.append('{}{}{} {}'.format(
+                    name, suffix, format_labels(labels), repr(float(value))
+                ))
+        return ''.join(line + '\n' for line in lines)
+
+    def write(self, path):
+        """
+        Write everything recorded to path, replacing it in one go so
+        readers never see half a file.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp = tempfile.mkstemp(dir=directory, prefix='.metrics-')
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                fp.write(self.render().encode('utf-8'))
+            os.rename(temp, path)
+        except:
+            os.unlink(temp)
+            raise
+
+
+class MetricsWriter(threading.Thread):
+
+    """
+    Rewrites a registry's metrics file every interval seconds, and once
+    more when stopped.
+    """
+
+    def __init__(self, registry, path, interval=DEFAULT_WRITE_INTERVAL):
+        super(MetricsWriter, self).__init__(name='metrics-writer')
+        self.daemon = True
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def write(self):
+        try:
+            self.registry.write(self.path)
+        except (IOError, OSError) as error:
+            logger.warning('Unable to write metrics to {}: {}'.format(
+                self.path, error
+            ))
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.write()
+
+
+def serve_metrics(registry, port, host=''):
+    """
+    Serve registry's metrics over HTTP on port from a background thread,
+    returning the server.
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug('Metrics request: ' + format % args)
+
+    server = HTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever,
+                              name='metrics-server')
+    thread.daemon = True
+    thread.start()
+    logger.info('Serving metrics on port {}'.format(server.server_port))
+    return server
+
+
+# The process wide registry everything is recorded in.
+metrics = MetricsRegistry()
@@ -11,12 +11,13 @@ http://www.nhl.com/scores/htmlreports/20132014/PL021195.HTM
 """
 
 import logging
+import threading
 from datetime import datetime, timedelta
 
 from .version import __version__
 
 from peewee import BooleanField, CharField, DateField, DateTimeField, \
-    ForeignKeyField, IntegerField, TextField, Model, Proxy
+    ForeignKeyField, IntegerField, TextField, Model, Param, Proxy, fn
 
 logger = logging.getLogger(__name__)
 logger.debug('Loading {} ver {}'.format(__name__, __version__))
@@ -40,17 +41,210 @@ MODELS = [
     'Game',
     'Lineup',
     'Event',
-    'EventPlayer'
+    'EventPlayer',
+    'BackfillJournal',
+    'Shift'
 ]
 
 db_proxy = Proxy()
 
+# SQLite allows at most 999 variables in a statement, so insert batches
+# are sized to stay under that regardless of how many columns a row has.
+MAX_VARIABLES = 900
+
+
+class IdentityMap(object):
+
+    """
+    Holds every row of a small, rarely changing table in memory so it can
+    be looked up without a trip to the database. Rows are indexed by id
+    and by each of the model's identity_keys, string keys ignoring case.
+
+    A lookup that misses goes to the database for just that row, in case
+    it has been added since, and is remembered if it isn't there so it
+    costs nothing the next time. Only invalidating the map reloads it.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.lock = threading.Lock()
+        self.indexes = None
+        self.missing = set()
+        self.hits = 0
+        self.misses = 0
+
+    def normalize(self, value):
+        if isinstance(value, basestring):
+            return value.lower()
+        return value
+
+    def load(self):
+        rows = list(self.model.select())
+        indexes = {'id': {}}
+        for key in self.model.identity_keys:
+            indexes[key] = {}
+        for row in rows:
+            self.add(indexes, row)
+        logger.debug('Loaded {} {} rows into the identity map'.format(
+            len(rows), self.model.__name__
+        ))
+        return indexes
+
+    def add(self, indexes, row):
+        indexes['id'][row.id] = row
+        for key in self.model.identity_keys:
+            indexes[key][self.normalize(getattr(row, key))] = row
+
+    def fetch(self, **kwargs):
+        """
+        Look for the one row matching kwargs in the database, remembering
+        if it isn't there.
+        """
+        missing = tuple(sorted(
+            (key, self.normalize(value)) for key, value in kwargs.items()
+        ))
+        if missing in self.missing:
+            return None
+
+        query = self.model.select()
+        for key, value in kwargs.items():
+            field = getattr(self.model, key)
+            if isinstance(value, basestring):
+                query = query.where(fn.Lower(field) == value.lower())
+            else:
+                query = query.where(field == value)
+
+        row = query.first()
+        if row is None:
+            self.missing.add(missing)
+        else:
+            self.add(self.indexes, row)
+        return row
+
+    def find(self, indexes, **kwargs):
+        if len(kwargs) == 1 and kwargs.keys()[0] in indexes:
+            key, value = kwargs.items()[0]
+            return indexes[key].get(self.normalize(value))
+
+        # Anything else is a scan, but there are only a handful of rows.
+        # Foreign keys are compared by id, as held in the row's _data.
+        for row in indexes['id'].values():
+            if all(self.normalize(row._data.get(key)) ==
+                   self.normalize(value) for key, value in kwargs.items()):
+                return row
+        return None
+
+    def get(self, **kwargs):
+        kwargs = dict(
+            (key, value.id if isinstance(value, Model) else value)
+            for key, value in kwargs.items()
+        )
+
+        with self.lock:
+            indexes = self.indexes
+            row = self.find(indexes, **kwargs) if indexes else None
+            if row is not None:
+                self.hits += 1
+                return row
+
+            self.misses += 1
+            if indexes is None:
+                self.indexes = self.load()
+                row = self.find(self.indexes, **kwargs)
+            else:
+                # The row may have been added since we loaded, by another
+                # process, so look for it before giving up.
+                row = self.fetch(**kwargs)
+
+        if row is None:
+            raise self.model.DoesNotExist(
+                'No {} matching {}'.format(self.model.__name__, kwargs)
+            )
+        return row
+
+    def invalidate(self):
+        with self.lock:
+            self.indexes = None
+            self.missing = set()
+
 
 class BaseModel(Model):
 
+    # Reference models set identity_keys to the fields they're looked up
+    # by, which keeps them in an identity map.
+    identity_keys = None
+
     class Meta:
         database = db_proxy
 
+    @classmethod
+    def identity_map(cls):
+        if cls.identity_keys is None:
+            raise TypeError('{} is not a reference model'.format(
+                cls.__name__
+            ))
+        with identity_maps_lock:
+            if cls not in identity_maps:
+                identity_maps[cls] = IdentityMap(cls)
+            return identity_maps[cls]
+
+    @classmethod
+    def cached(cls, **kwargs):
+        """
+        Like get, but served from the model's identity map, eg
+        Team.cached(code='WSH').
+        """
+        return cls.identity_map().get(**kwargs)
+
+    def save(self, *args, **kwargs):
+        result = super(BaseModel, self).save(*args, **kwargs)
+        if self.identity_keys is not None:
+            self.identity_map().invalidate()
+        return result
+
+    def delete_instance(self, *args, **kwargs):
+        result = super(BaseModel, self).delete_instance(*args, **kwargs)
+        if self.identity_keys is not None:
+            self.identity_map().invalidate()
+        return result
+
+
+identity_maps = {}
+identity_maps_lock = threading.Lock()
+
+
+def invalidate_identity_maps():
+    """
+    Forget every identity map, for when rows have been changed by bulk
+    queries or the database has been switched.
+    """
+    with identity_maps_lock:
+        for identity_map in identity_maps.values():
+            identity_map.invalidate()
+
+
+def identity_map_stats():
+    """
+    Returns {model name: (hits, misses)} for each identity map in use.
+    """
+    with identity_maps_lock:
+        return dict(
+            (model.__name__, (identity_map.hits, identity_map.misses))
+            for model, identity_map in identity_maps.items()
+        )
+
+
+def batches(rows, columns):
+    size = max(1, MAX_VARIABLES // max(1, columns))
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def insert_rows(model, rows):
+    if rows:
+        for batch in batches(rows, len(rows[0])):
+            model.insert_many(batch).execute()
+
 
 class Arena(BaseModel):
 
@@ -99,6 +293,8 @@ class SeasonType(BaseModel):
     name = CharField()
     external_id = CharField(null=True)
 
+    identity_keys = ('name', 'external_id')
+
     class Meta:
         db_table = 'season_types'
 
@@ -112,6 +308,8 @@ class Season(BaseModel):
     year = CharField()
     type = ForeignKeyField(SeasonType, related_name='seasons')
 
+    identity_keys = ()
+
     class Meta:
         db_table = 'seasons'
         order_by = ('league', 'year')
@@ -142,6 +340,8 @@ class Division(BaseModel):
                                  on_delete='CASCADE', on_update='CASCADE')
     name = CharField(unique=True)
 
+    identity_keys = ('name',)
+
     class Meta:
         db_table = 'divisions'
         order_by = ('name',)
@@ -157,6 +357,8 @@ class Team(BaseModel):
     code = CharField()
     url = CharField()
 
+    identity_keys = ('code', 'name')
+
     class Meta:
         db_table = 'teams'
         order_by = ('city', 'name')
@@ -196,11 +398,14 @@ class Player(BaseModel):
     name = CharField()
     no = IntegerField()
     pos = CharField()
-    shoots = CharField(choices=SHOOTS, verbose_name='Shoots/Catches')
-    dob = DateField(verbose_name='Date of Birth')
-    pob = CharField(verbose_name='Place of Birth')
-    height = IntegerField()
-    weight = IntegerField()
+    # Players first seen on the ice in a game report won't have the
+    # following details until we get them from elsewhere.
+    shoots = CharField(choices=SHOOTS, null=True,
+                       verbose_name='Shoots/Catches')
+    dob = DateField(null=True, verbose_name='Date of Birth')
+    pob = CharField(null=True, verbose_name='Place of Birth')
+    height = IntegerField(null=True)
+    weight = IntegerField(null=True)
     salary = IntegerField(null=True)
     seasons = IntegerField(default=0)
     drafted = CharField(null=True)
@@ -208,7 +413,7 @@ class Player(BaseModel):
     assets = TextField(null=True)
     flaws = TextField(null=True)
     potential = CharField(null=True)
-    status = CharField()
+    status = CharField(null=True)
 
     class Meta:
         db_table = 'players'
@@ -242,7 +447,63 @@ class Player(BaseModel):
         return 'N/A'
 
 
-class PlayerSkaterStat(BaseModel):
+def ratio(numerator, denominator, scale=1):
+    """
+    numerator * scale / denominator as an SQL expression, which is NULL
+    where either is NULL or the denominator is 0.
+    """
+    # The scale goes first, as peewee would pass it through the numerator
+    # field's db_value, making it an integer, were it on the right.
+    return Param(float(scale)) * numerator / fn.NULLIF(denominator, 0)
+
+
+class PlayerStat(BaseModel):
+
+    """
+    A player's totals for a season with a team. Rates derived from the
+    totals are available both as properties of a single row and as SQL
+    expressions, so they can be computed and ordered on by the database
+    for a whole season at once.
+    """
+
+    @classmethod
+    def rates(cls):
+        """
+        {name: (expression, whether higher is better)} for each rate.
+        """
+        return {}
+
+    @classmethod
+    def with_rates(cls, season=None, team=None):
+        """
+        A query of dicts of every stat along with its rates, for season
+        and team if given. Rates that can't be worked out are None.
+        """
+        query = cls.select(cls, *[
+            expression.alias(name)
+            for name, (expression, _) in sorted(cls.rates().items())
+        ])
+        if season is not None:
+            query = query.where(cls.season == season)
+        if team is not None:
+            query = query.where(cls.team == team)
+        return query.order_by(cls.id).dicts()
+
+    @classmethod
+    def leaders(cls, rate, season=None, team=None, limit=None):
+        """
+        with_rates ordered from best to worst rate, leaving out those
+        without one.
+        """
+        expression, higher = cls.rates()[rate]
+        return cls.with_rates(season, team).where(
+            expression.is_null(False)
+        ).order_by(
+            expression.desc() if higher else expression.asc(), cls.id
+        ).limit(limit)
+
+
+class PlayerSkaterStat(PlayerStat):
     player = ForeignKeyField(Player, related_name='skater_stats')
     season = ForeignKeyField(Season, related_name='skater_stats')
     team = ForeignKeyField(Team, related_name='skater_stats')
@@ -260,23 +521,34 @@ class PlayerSkaterStat(BaseModel):
     class Meta:
         db_table = 'player_skater_stats'
         order_by = ('season', 'team', 'pts')
+        indexes = (
+            # a player has one set of totals per team a season
+            (('player', 'season', 'team'), True),
+        )
+
+    @classmethod
+    def rates(cls):
+        return {
+            'ptspgp': (ratio(cls.pts, cls.gp), True),
+            'shotpct': (ratio(cls.g, cls.shots, 100), True),
+        }
 
     @property
     def ptspgp(self):
         """Points per game played"""
-        if self.gp and self.pts:
+        if self.gp and self.pts is not None:
             return '{:.2f}'.format(float(self.pts) / self.gp)
         return None
 
     @property
     def shotpct(self):
         """Shooting percentage"""
-        if self.shots and self.g:
+        if self.shots and self.g is not None:
             return '{:.1f}'.format((float(self.g) / self.shots) * 100)
         return None
 
 
-class PlayerGoalieStat(BaseModel):
+class PlayerGoalieStat(PlayerStat):
     player = ForeignKeyField(Player, related_name='goalie_stats')
     season = ForeignKeyField(Season, related_name='goalie_stats')
     team = ForeignKeyField(Team, related_name='goalie_stats')
@@ -293,20 +565,31 @@ class PlayerGoalieStat(BaseModel):
     class Meta:
         db_table = 'player_goalie_stats'
         order_by = ('-season', 'team', 'gpi')
+        indexes = (
+            # a player has one set of totals per team a season
+            (('player', 'season', 'team'), True),
+        )
+
+    @classmethod
+    def rates(cls):
+        return {
+            'gaa': (ratio(cls.ga, cls.min, 60), False),
+            'svpct': (ratio(cls.sha - cls.ga, cls.sha), True),
+        }
 
     @property
     def gaa(self):
         """Goals against average"""
-        if self.ga and self.min:
+        if self.min and self.ga is not None:
             return '{:.2f}'.format(self.ga / (self.min / 60.0))
         return None
 
     @property
     def svpct(self):
         """save percentage"""
-        if self.ga and self.sha:
+        if self.sha and self.ga is not None:
             return '{:.3f}'.format(1 - self.ga / float(self.sha))
-        return None.format
+        return None
 
 
 class Roster(BaseModel):
@@ -343,8 +626,14 @@ class Game(BaseModel):
     home = ForeignKeyField(Team, related_name='home_games')
     road = ForeignKeyField(Team, related_name='road_games')
     report_id = CharField(null=True)
-    start = DateTimeField()
-    end = DateTimeField(null=True)
+    # Collection looks for games by when they started and whether they've
+    # ended, every minute.
+    start = DateTimeField(index=True)
+    end = DateTimeField(null=True, index=True)
+    # The high water mark of events we've stored from the game report.
+    last_event = IntegerField(null=True)
+    last_event_period = IntegerField(null=True)
+    last_event_elapsed = IntegerField(null=True)
 
     class Meta:
         db_table = 'games'
@@ -360,6 +649,17 @@ class Game(BaseModel):
         )
         # pylint: enable=no-member
 
+    @property
+    def watermark(self):
+        """
+        The (number, period, elapsed) of the last event we've stored, or
+        None if we haven't stored any.
+        """
+        if self.last_event is None:
+            return None
+        return (self.last_event, self.last_event_period,
+                self.last_event_elapsed)
+
     @classmethod
     def get_active_games(cls):
         """
@@ -497,6 +797,10 @@ class Event(BaseModel):
     class Meta:
         db_table = 'events'
         order_by = ('game', 'number')
+        indexes = (
+            # event numbers are unique within a game
+            (('game', 'number'), True),
+        )
 
 
 class EventPlayer(BaseModel):
@@ -518,3 +822,131 @@ class EventPlayer(BaseModel):
 
     class Meta:
         db_table = 'event_players'
+        indexes = (
+            # a player is only on the ice once for an event
+            (('event', 'player'), True),
+        )
+
+
+class BackfillJournal(BaseModel):
+
+    """
+    Records progress through a backfill, one row per unit of work: the
+    schedule for a season (and so season type) when game is None,
+    otherwise a game's events.
+
+    :param season: Season the work was for.
+    :type season: Season
+    :param game: Game the work was for, if any.
+    :type game: Game or None
+    :param status: Whether the work is done or failed.
+    :type status: string
+    :param attempts: How many times the work has been tried.
+    :type attempts: integer
+    :param error: Why the last attempt failed, if it did.
+    :type error: string or None
+    :param updated: When the work was last tried.
+    :type updated: datetime
+    """
+
+    STATUSES = [('done', 'Done'),
+                ('failed', 'Failed')]
+
+    season = ForeignKeyField(Season, related_name='backfill_journal',
+                             on_delete='CASCADE', on_update='CASCADE')
+    game = ForeignKeyField(Game, null=True, related_name='backfill_journal',
+                           on_delete='CASCADE', on_update='CASCADE')
+    status = CharField(choices=STATUSES)
+    attempts = IntegerField(default=0)
+    error = TextField(null=True)
+    updated = DateTimeField()
+
+    class Meta:
+        db_table = 'backfill_journal'
+        indexes = (
+            # one entry per unit of work
+            (('season', 'game'), True),
+        )
+
+    @classmethod
+    def entry(cls, season, game=None):
+        query = cls.select().where(cls.season == season)
+        if game is None:
+            query = query.where(cls.game.is_null(True))
+        else:
+            query = query.where(cls.game == game)
+        return query.first()
+
+    @classmethod
+    def is_done(cls, season, game=None):
+        entry = cls.entry(season, game)
+        return entry is not None and entry.status == 'done'
+
+    @classmethod
+    def completed_games(cls, season):
+        """
+        Returns the ids of the games in season that are done.
+        """
+        return set(game_id for (game_id,) in cls.select(cls.game).where(
+            (cls.season == season) &
+            cls.game.is_null(False) &
+            (cls.status == 'done')
+        ).tuples())
+
+    @classmethod
+    def record(cls, season, game=None, error=None):
+        """
+        Record an attempt at the work for season (and game), which failed
+        if there's an error.
+        """
+        entry = cls.entry(season, game) or cls(season=season, game=game)
+        entry.status = 'failed' if error is not None else 'done'
+        entry.attempts += 1
+        entry.error = None if error is None else repr(error)
+        entry.updated = datetime.now()
+        entry.save()
+        return entry
+
+
+class Shift(BaseModel):
+
+    """
+    A stretch of a period a player spent on the ice at one strength, as
+    worked out from who was on the ice for each event. A shift over which
+    the strength changed is stored as one row per strength.
+
+    :param game: Game in which the shift was played.
+    :type game: Game
+    :param team: The team the player was playing for.
+    :type team: Team
+    :param player: The player on the ice.
+    :type player: Player
+    :param period: Period in which the shift was played.
+    :type period: integer
+    :param start: Time elapsed in the period when the shift began (in
+        seconds).
+    :type start: integer
+    :param end: Time elapsed in the period when the shift ended (in
+        seconds).
+    :type end: integer
+    :param strength: Whether the player's team had more skaters on the
+        ice than the other, fewer or the same.
+    :type strength: string
+    """
+
+    game = ForeignKeyField(Game, related_name='shifts',
+                           on_delete='CASCADE', on_update='CASCADE')
+    team = ForeignKeyField(Team)
+    player = ForeignKeyField(Player, related_name='shifts')
+    period = IntegerField()
+    start = IntegerField()
+    end = IntegerField()
+    strength = CharField(choices=Event.STRENGTHS)
+
+    class Meta:
+        db_table = 'shifts'
+        order_by = ('game', 'period', 'start')
+        indexes = (
+            # a player starts one shift at a time
+            (('game', 'player', 'period', 'start'), True),
+        )
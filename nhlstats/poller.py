@@ -0,0 +1,320 @@
+"""
+Poller follows games as they're played, each on its own schedule.
+
+Rather than polling every active game on one global frequency, games
+are kept in a heap ordered by when each is next due. How soon a game is
+due again depends on where it's at: games in play are polled often,
+intermissions and the time before puck drop much less so, and games are
+dropped altogether once their report says they've ended.
+"""
+
+import time
+import heapq
+import urllib2
+import logging
+import itertools
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from monotonic import monotonic
+
+from .version import __version__
+from .models import Game, Event
+from .collect import NotModified
+from .ingest import EVENT_TYPES
+from .engine import DEFAULT_CONCURRENCY
+from .profiling import profiler
+
+logger = logging.getLogger(__name__)
+logger.debug('Loading {} ver {}'.format(__name__, __version__))
+
+
+# How often, in seconds, games are polled in each phase.
+PREGAME_INTERVAL = 120
+LIVE_INTERVAL = 20
+INTERMISSION_INTERVAL = 240
+
+# Games are first polled this long before they're due to start.
+PREGAME_WINDOW = timedelta(minutes=15)
+
+# A game that still hasn't ended this long after it started is left for
+# the update action to sort out.
+ABANDON_AFTER = timedelta(hours=12)
+
+# Failed polls back off from the phase's interval up to this many seconds.
+MAX_BACKOFF = 900
+
+# What a game's report gives until it's published, shortly before the
+# game starts.
+NOT_PUBLISHED = 404
+
+# How often to look for newly scheduled games, and how far ahead.
+REFRESH_INTERVAL = 3600
+HORIZON = timedelta(days=1)
+
+PREGAME = 'pregame'
+LIVE = 'live'
+INTERMISSION = 'intermission'
+
+INTERVALS = {
+    PREGAME: PREGAME_INTERVAL,
+    LIVE: LIVE_INTERVAL,
+    INTERMISSION: INTERMISSION_INTERVAL,
+}
+
+
+def phase_after(event_type):
+    """
+    The phase a game is in once an Event of event_type is the last thing
+    to happen.
+    """
+    if event_type == 'end':
+        return INTERMISSION
+    return LIVE
+
+
+class PolledGame(object):
+
+    """
+    A game being followed, along with what phase we last saw it in.
+    """
+
+    def __init__(self, game, phase=PREGAME):
+        self.game = game
+        self.phase = phase
+        self.failures = 0
+
+    def __repr__(self):
+        return '<PolledGame {} {}>'.format(self.game.report_id, self.phase)
+
+    @classmethod
+    def for_game(cls, game):
+        """
+        Pick up following game from the last of its events we've stored.
+        """
+        if game.last_event is None:
+            return cls(game)
+
+        last = Event.select(Event.type).where(
+            (Event.game == game) & (Event.number == game.last_event)
+        ).first()
+        return cls(game, phase_after(last.type if last else None))
+
+    def update(self, events):
+        """
+        Note new events, returning whether the game is over.
+        """
+        self.failures = 0
+        if events:
+            code = events[-1]['event']
+            self.phase = phase_after(EVENT_TYPES.get(code, code.lower()))
+        return self.game.end is not None or any(
+            event['event'] == 'GEND' for event in events
+        )
+
+    def until_window(self, now):
+        """
+        Seconds until we start polling ahead of puck drop, negative once
+        we have.
+        """
+        return (self.game.start - PREGAME_WINDOW - now).total_seconds()
+
+    def interval(self, now):
+        """
+        How many seconds until the game should next be polled.
+        """
+        if self.phase == PREGAME and not self.failures:
+            until_window = self.until_window(now)
+            if until_window > 0:
+                return until_window
+
+        interval = INTERVALS[self.phase]
+        if self.failures:
+            interval = min(interval * 2 ** self.failures, MAX_BACKOFF)
+        return interval
+
+
+class GamePoller(object):
+
+    """
+    Polls every game that's on, or about to be, as often as its phase
+    calls for.
+
+    fetch(season, report_id, since) returns a game's new events and is
+    run on a pool of concurrency threads, while process(game, events)
+    stores them and is run on the calling thread. If given, forget(game)
+    is called whenever polling a game fails, so the next fetch doesn't
+    skip a report that was retrieved but never stored.
+
+    now is the wall clock game start times are compared against, they're
+    stored in UTC. Scheduling itself uses the monotonic clock. All three
+    may be replaced, which is mostly useful for testing.
+    """
+
+    def __init__(self, fetch, process, concurrency=DEFAULT_CONCURRENCY,
+                 clock=monotonic, sleep=time.sleep, now=datetime.utcnow,
+                 forget=None):
+        self.fetch = fetch
+        self.process = process
+        self.forget = forget
+        self.concurrency = concurrency
+        self.clock = clock
+        self.sleep = sleep
+        self.now = now
+
+        self.heap = []
+        self.sequence = itertools.count()
+        self.games = {}
+        self.retired = set()
+        self.next_refresh = clock()
+
+    def schedule(self, polled, delay):
+        heapq.heappush(
+            self.heap,
+            (self.clock() + delay, next(self.sequence), polled)
+        )
+
+    def retire(self, polled, reason):
+        logger.info('No longer polling {}: {}'.format(polled.game, reason))
+        del self.games[polled.game.id]
+        self.retired.add(polled.game.id)
+
+    def refresh(self):
+        """
+        Start following any games that have started, or are about to,
+        that we aren't already.
+        """
+        now = self.now()
+        games = Game.select().where(
+            Game.end.is_null(True) &
+            Game.report_id.is_null(False) &
+            (Game.start >= now - ABANDON_AFTER) &
+            (Game.start <= now + HORIZON)
+        )
+
+        for game in games:
+            if game.id in self.games or game.id in self.retired:
+                continue
+            # Games already underway are polled straight away.
+            polled = PolledGame.for_game(game)
+            delay = max(polled.until_window(now), 0)
+            self.games[game.id] = polled
+            self.schedule(polled, delay)
+            logger.debug('Following {}, due in {:.0f}s'.format(game, delay))
+
+        phases = [polled.phase for polled in self.games.values()]
+        logger.info(
+            'Polling {} games: {} live, {} in intermission, {} yet to '
+            'start'.format(
+                len(phases), phases.count(LIVE), phases.count(INTERMISSION),
+                phases.count(PREGAME)
+            )
+        )
+        self.next_refresh = self.clock() + REFRESH_INTERVAL
+
+    def due(self):
+        """
+        Pop every game that's due to be polled.
+        """
+        now = self.clock()
+        games = []
+        while self.heap and self.heap[0][0] <= now:
+            games.append(heapq.heappop(self.heap)[2])
+        return games
+
+    def poll(self, games):
+        """
+        Poll games all at once, then reschedule or retire each of them.
+        Each poll is profiled as its game, if we're profiling each game.
+        """
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            pending = {}
+            for polled in games:
+                profile = profiler.game(polled.game)
+                pending[pool.submit(
+                    profile.call, self.fetch, polled.game.season.year,
+                    polled.game.report_id, polled.game.watermark
+                )] = polled, profile
+
+            for future in as_completed(pending):
+                polled, profile = pending[future]
+                with profile:
+                    self.polled(polled, future)
+
+    def polled(self, polled, future):
+        """
+        Store what polling a game turned up, then reschedule or retire it.
+        """
+        try:
+            events = future.result()
+        except NotModified:
+            events = []
+        except urllib2.HTTPError as error:
+            if error.code == NOT_PUBLISHED and polled.phase == PREGAME:
+                logger.debug('No report for {} yet'.format(polled.game))
+                self.reschedule(polled)
+            else:
+                self.failed(polled, 'Error polling {}')
+            return
+        except Exception:
+            self.failed(polled, 'Error polling {}')
+            return
+
+        try:
+            self.process(polled.game, events)
+        except Exception:
+            self.failed(polled, 'Error storing events for {}')
+            return
+
+        if polled.update(events):
+            self.retire(polled, 'game over')
+        else:
+            self.reschedule(polled)
+
+    def failed(self, polled, message):
+        """
+        Log the error being handled and back off before polling again.
+        """
+        logger.exception(message.format(polled.game))
+        if self.forget:
+            self.forget(polled.game)
+        polled.failures += 1
+        self.reschedule(polled)
+
+    def reschedule(self, polled):
+        now = self.now()
+        if now - polled.game.start > ABANDON_AFTER:
+            self.retire(polled, 'still not over {} after it started'.format(
+                ABANDON_AFTER
+            ))
+        else:
+            self.schedule(polled, polled.interval(now))
+
+    def step(self):
+        """
+        Wait for the next game to be due and poll it, along with any
+        others due by then. Returns False once there's nothing left to
+        poll.
+        """
+        if self.clock() >= self.next_refresh:
+            self.refresh()
+            if not self.heap:
+                return False
+
+        wait = self.next_refresh - self.clock()
+        if self.heap:
+            wait = min(wait, self.heap[0][0] - self.clock())
+        if wait > 0:
+            self.sleep(wait)
+
+        games = self.due()
+        if games:
+            self.poll(games)
+        return True
+
+    def run(self, forever=True):
+        """
+        Poll games until killed, or unless forever until none are left.
+        """
+        while self.step() or forever:
+            pass
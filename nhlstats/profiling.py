@@ -0,0 +1,395 @@
+"""
+Profiling writes out where the time went in each action we run.
+
+Each action, and optionally each game, gets a dump of its own in the
+profile directory. Two kinds are available:
+
+- cprofile: a deterministic cProfile dump (.prof) for pstats, snakeviz
+  and the like. It only sees the thread it was started on, and slows
+  that thread down considerably.
+- sample: a background thread looks at every thread's stack every
+  interval seconds and writes the stacks it saw as collapsed stacks
+  (.folded), as taken by flamegraph.pl and speedscope. The overhead is
+  small and fixed, so it's fine to leave running in production.
+
+A game is usually fetched and parsed on a worker thread and stored on
+the main one, so its profile is gathered from each thread in turn, and
+only covers those threads while they're handling the game.
+
+The functions with the most cumulative time are logged as each dump is
+written.
+"""
+
+import os
+import sys
+import time
+import errno
+import pstats
+import cProfile
+import logging
+import itertools
+import threading
+from StringIO import StringIO
+from contextlib import contextmanager
+
+from .version import __version__
+
+logger = logging.getLogger(__name__)
+logger.debug('Loading {} ver {}'.format(__name__, __version__))
+
+
+CPROFILE = 'cprofile'
+SAMPLE = 'sample'
+MODES = (CPROFILE, SAMPLE)
+
+DEFAULT_SAMPLE_INTERVAL = 0.01
+
+# How many functions to log when a profile is written.
+SUMMARY_LENGTH = 15
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return '{} ({}:{})'.format(
+        code.co_name, os.path.basename(code.co_filename), code.co_firstlineno
+    )
+
+
+def collapse(frame):
+    """
+    A frame's stack, outermost call first, joined with semicolons.
+    """
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Sampler(threading.Thread):
+
+    """
+    Counts the stacks of every other thread every interval seconds, for
+    each of the profiles open at the time that's watching that thread.
+    """
+
+    def __init__(self, interval):
+        super(Sampler, self).__init__(name='profile-sampler')
+        self.daemon = True
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.profiles = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            stacks = dict(
+                (thread_id, collapse(frame))
+                for thread_id, frame in sys._current_frames().items()
+                if thread_id != self.ident
+            )
+            with self.lock:
+                for profile in self.profiles:
+                    profile.samples += 1
+                    if profile.thread is None:
+                        seen = stacks.values()
+                    elif profile.thread in stacks:
+                        seen = [stacks[profile.thread]]
+                    else:
+                        continue
+                    for stack in seen:
+                        profile.stacks[stack] = (
+                            profile.stacks.get(stack, 0) + 1
+                        )
+
+    def add(self, profile):
+        with self.lock:
+            self.profiles.append(profile)
+
+    def remove(self, profile):
+        with self.lock:
+            self.profiles.remove(profile)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class SampledProfile(object):
+
+    """
+    The stacks seen while a sampled profile was open, of the thread with
+    ident thread, or of every thread if it's None.
+    """
+
+    extension = 'folded'
+
+    def __init__(self, sampler, thread=None):
+        self.sampler = sampler
+        self.thread = thread
+        self.samples = 0
+        self.stacks = {}
+
+    def start(self):
+        self.sampler.add(self)
+
+    def stop(self):
+        self.sampler.remove(self)
+
+    def dump(self, path):
+        with open(path, 'w') as fp:
+            for stack, count in sorted(self.stacks.items()):
+                fp.write('{} {}\n'.format(stack, count))
+
+    def add(self, other):
+        self.samples += other.samples
+        for stack, count in other.stacks.items():
+            self.stacks[stack] = self.stacks.get(stack, 0) + count
+
+    def summary(self, length):
+        # A function counts once per sample it was anywhere on the stack.
+        cumulative = {}
+        for stack, count in self.stacks.items():
+            for name in set(stack.split(';')):
+                cumulative[name] = cumulative.get(name, 0) + count
+
+        top = sorted(cumulative.items(), key=lambda item: -item[1])[:length]
+        lines = ['{} samples'.format(self.samples)]
+        lines.extend(
+            '{:>7.1%}  {}'.format(float(count) / (self.samples or 1), name)
+            for name, count in top
+        )
+        return '\n'.join(lines)
+
+
+class CProfile(object):
+
+    """
+    A cProfile profile of the thread it's started on. Only one can be
+    collecting on a thread at once, so a profile opened within another
+    pauses it, and is included in its stats.
+    """
+
+    extension = 'prof'
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.thread = threading.current_thread().ident
+        self.profile = cProfile.Profile()
+        self.children = []
+
+    def start(self):
+        if self.parent:
+            self.parent.profile.disable()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        if self.parent:
+            self.parent.children.append(self)
+            self.parent.profile.enable()
+
+    def add(self, other):
+        self.children.append(other)
+
+    def stats(self):
+        stats = pstats.Stats(self.profile)
+        for child in self.children:
+            stats.add(child.stats())
+        return stats
+
+    def dump(self, path):
+        self.stats().dump_stats(path)
+
+    def summary(self, length):
+        output = StringIO()
+        stats = self.stats()
+        stats.stream = output
+        stats.sort_stats('cumulative').print_stats(length)
+        return output.getvalue().strip()
+
+
+class Profiler(object):
+
+    """
+    Opens a profile around each action, and each game if per_game is
+    set, writing each out to directory once it's done. Does nothing
+    unless a directory has been configured.
+    """
+
+    def __init__(self):
+        self.directory = None
+        self.mode = CPROFILE
+        self.per_game = False
+        self.interval = DEFAULT_SAMPLE_INTERVAL
+        self.sampler = None
+        self.lock = threading.Lock()
+        self.open = []
+        self.sequence = itertools.count(1)
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def configure(self, directory=None, mode=None, per_game=None,
+                  interval=None):
+        """
+        Adjust the profiler settings. A directory of None turns it off.
+        """
+        if mode is not None and mode not in MODES:
+            raise ValueError('Unknown profile mode "{}"'.format(mode))
+
+        self.stop_sampler()
+        self.directory = directory
+        if mode is not None:
+            self.mode = mode
+        if per_game is not None:
+            self.per_game = per_game
+        if interval:
+            self.interval = interval
+
+    def stop_sampler(self):
+        with self.lock:
+            if self.sampler:
+                self.sampler.stop()
+                self.sampler = None
+
+    def create(self, all_threads):
+        thread = threading.current_thread().ident
+        if self.mode == SAMPLE:
+            with self.lock:
+                if self.sampler is None:
+                    self.sampler = Sampler(self.interval)
+                    self.sampler.start()
+            return SampledProfile(self.sampler,
+                                  None if all_threads else thread)
+
+        # Profiles opened on other threads carry on regardless.
+        parents = [profile for profile in self.open
+                   if profile.thread == thread]
+        return CProfile(parents[-1] if parents else None)
+
+    def path(self, name, extension):
+        try:
+            os.makedirs(self.directory)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+
+        return os.path.join(self.directory, '{}-{}-{:04d}-{}.{}'.format(
+            time.strftime('%Y%m%d-%H%M%S'), os.getpid(),
+            next(self.sequence), name, extension
+        ))
+
+    @contextmanager
+    def profile(self, name, all_threads=True):
+        """
+        Profile the with block, writing it out as name. Sampled profiles
+        see every thread unless all_threads is False, when they see only
+        the one they were opened on.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        profile = self.create(all_threads)
+        self.open.append(profile)
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            self.open.pop()
+            self.write(name, profile)
+
+    def game(self, game):
+        """
+        The profile of game, if we're profiling each game. Used as a
+        with block it profiles the block, but the work on the game done
+        on other threads beforehand can be added to it by running that
+        work with its call method.
+        """
+        if self.enabled and self.per_game:
+            return GameProfile(self, 'game-{}'.format(game.report_id))
+        return NullGameProfile()
+
+    def write(self, name, profile):
+        try:
+            path = self.path(name, profile.extension)
+            profile.dump(path)
+        except (IOError, OSError) as error:
+            logger.warning('Unable to write profile of {}: {}'.format(
+                name, error
+            ))
+            return
+
+        logger.info('Wrote profile of {} to {}\n{}'.format(
+            name, path, profile.summary(SUMMARY_LENGTH)
+        ))
+
+
+class GameProfile(object):
+
+    """
+    A game's profile, gathered from whichever threads handle the game.
+    Each part only profiles the thread it runs on, as the others are
+    likely busy with other games. It's written out as the with block
+    around it ends.
+    """
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.lock = threading.Lock()
+        self.parts = []
+        self.running = []
+
+    def call(self, function, *args, **kwargs):
+        """
+        Call function, profiling it as part of the game.
+        """
+        profile = self.profiler.create(all_threads=False)
+        profile.start()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profile.stop()
+            with self.lock:
+                self.parts.append(profile)
+
+    def __enter__(self):
+        profile = self.profiler.create(all_threads=False)
+        self.running.append(profile)
+        profile.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        profile = self.running.pop()
+        profile.stop()
+        # Parts from other threads are added to rather than the other way
+        # round, as this one may already be included in its action's.
+        with self.lock:
+            parts = self.parts + [profile]
+        for part in parts[1:]:
+            parts[0].add(part)
+        self.profiler.write(self.name, parts[0])
+
+
+class NullGameProfile(object):
+
+    """
+    Stands in for a GameProfile when we aren't profiling each game.
+    """
+
+    def call(self, function, *args, **kwargs):
+        return function(*args, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+# The process wide profiler actions and games are run under.
+profiler = Profiler()
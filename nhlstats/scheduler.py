@@ -0,0 +1,128 @@
+"""
+Scheduler runs an action over and over on a fixed cadence.
+
+Runs are due every period seconds from when the scheduler started,
+measured on the monotonic clock, so the time a run takes doesn't push
+back every run after it. A run that overruns its period never overlaps
+the next one, the ticks it ran over are skipped and counted instead.
+"""
+
+import math
+import time
+import logging
+
+from monotonic import monotonic
+
+from .version import __version__
+
+logger = logging.getLogger(__name__)
+logger.debug('Loading {} ver {}'.format(__name__, __version__))
+
+
+class SchedulerStats(object):
+
+    """
+    How closely runs have kept to their schedule. Lag is how late a run
+    started after its tick, and jitter is how much that lag changed from
+    one run to the next.
+    """
+
+    def __init__(self):
+        self.runs = 0
+        self.skipped = 0
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.jitter = 0.0
+        self.max_jitter = 0.0
+        self.last_lag = None
+
+    def record(self, lag):
+        self.runs += 1
+        self.lag += lag
+        self.max_lag = max(self.max_lag, lag)
+
+        if self.last_lag is not None:
+            jitter = abs(lag - self.last_lag)
+            self.jitter += jitter
+            self.max_jitter = max(self.max_jitter, jitter)
+        self.last_lag = lag
+
+    @property
+    def mean_lag(self):
+        return self.lag / self.runs if self.runs else 0.0
+
+    @property
+    def mean_jitter(self):
+        return self.jitter / (self.runs - 1) if self.runs > 1 else 0.0
+
+
+class FixedRateScheduler(object):
+
+    """
+    Calls a function every period seconds, skipping ticks rather than
+    running late when a call takes longer than that.
+
+    clock and sleep may be replaced, which is mostly useful for testing.
+    """
+
+    def __init__(self, period, clock=monotonic, sleep=time.sleep):
+        if period <= 0:
+            raise ValueError('period must be positive, not {}'.format(period))
+        self.period = float(period)
+        self.clock = clock
+        self.sleep = sleep
+        self.stats = SchedulerStats()
+
+    def next_tick(self, tick):
+        """
+        The first tick, on the schedule starting at tick, that hasn't
+        passed yet. Any passed over are counted as skipped.
+        """
+        now = self.clock()
+        if now <= tick:
+            return tick
+
+        missed = int(math.ceil((now - tick) / self.period))
+        self.stats.skipped += missed
+        logger.warning(
+            'Run overran its period by {:.2f}s, skipping {} run{}'.format(
+                now - tick, missed, 's' if missed > 1 else ''
+            )
+        )
+        return tick + missed * self.period
+
+    def run(self, function, runs=None):
+        """
+        Call function on schedule, forever or until it has been called
+        runs times. Errors from function are not caught.
+        """
+        tick = self.clock()
+        try:
+            while runs is None or self.stats.runs < runs:
+                wait = tick - self.clock()
+                if wait > 0:
+                    self.sleep(wait)
+
+                lag = max(self.clock() - tick, 0.0)
+                self.stats.record(lag)
+                logger.debug('Run {} started {:.3f}s late'.format(
+                    self.stats.runs, lag
+                ))
+
+                function()
+                tick = self.next_tick(tick + self.period)
+        finally:
+            self.log_stats()
+
+    def log_stats(self):
+        """
+        Report how closely runs kept to the schedule.
+        """
+        stats = self.stats
+        logger.info(
+            '{} runs every {:.0f}s, {} skipped, lag {:.3f}s mean {:.3f}s '
+            'max, jitter {:.3f}s mean {:.3f}s max'.format(
+                stats.runs, self.period, stats.skipped, stats.mean_lag,
+                stats.max_lag, stats.mean_jitter, stats.max_jitter
+            )
+        )
@@ -0,0 +1,216 @@
+"""
+Shifts works out each player's shifts, and so their time on ice, from
+who the game reports have on the ice for each event.
+
+The players listed for an event are taken to have been on the ice from
+that event until the next, so a game's events are swept once in order,
+opening a shift for each player who appears and closing it when they
+don't. Shifts are split wherever the player's team's strength changes,
+so time on ice by strength is a sum over rows. Events listing no one
+on the ice are skipped over, and every shift is closed at the end of
+each period.
+
+Shifts are built for a game once it has finished, and for whole seasons
+at a time by the shifts action. Seasons are worked through a batch of
+games at a time, so memory use stays flat however many there are.
+"""
+
+import logging
+
+from peewee import fn
+
+from .version import __version__
+from .models import db_proxy, insert_rows, Event, EventPlayer, Game, \
+    Player, Shift
+
+logger = logging.getLogger(__name__)
+logger.debug('Loading {} ver {}'.format(__name__, __version__))
+
+
+# How many games' events are read at once when building a season.
+GAMES_PER_BATCH = 50
+
+# Events after which nobody is on the ice until the next period.
+PERIOD_ENDS = ('end', 'gend')
+
+GOALIE = 'G'
+
+
+def strengths(on_ice):
+    """
+    {player: (team, strength)} for the players on the ice, given
+    {player: (team, whether they're a goalie)}. A skater on for a pulled
+    goalie is an extra attacker, so doesn't change the strength.
+    """
+    skaters = {}
+    for team, goalie in on_ice.values():
+        skaters[team] = skaters.get(team, 0) + (0 if goalie else 1)
+    goalies = set(team for team, goalie in on_ice.values() if goalie)
+    for team in skaters:
+        if team not in goalies and skaters[team]:
+            skaters[team] -= 1
+    total = sum(skaters.values())
+
+    result = {}
+    for player, (team, _) in on_ice.items():
+        theirs = total - skaters[team]
+        if skaters[team] > theirs:
+            result[player] = (team, 'pp')
+        elif skaters[team] < theirs:
+            result[player] = (team, 'sh')
+        else:
+            result[player] = (team, 'ev')
+    return result
+
+
+def sweep(events):
+    """
+    Works out shifts from a game's events, each (period, elapsed, type,
+    on_ice) in order where on_ice is {player: (team, whether they're a
+    goalie)}. Returns (player, team, period, start, end, strength) for
+    each shift.
+    """
+    shifts = []
+    # player: (team, strength, period, start) for those on the ice
+    current = {}
+    # player: index into shifts of the last shift they ended
+    ended = {}
+    period = elapsed = None
+
+    def end_shift(player, end):
+        team, strength, shift_period, start = current.pop(player)
+        if end > start:
+            ended[player] = len(shifts)
+            shifts.append((player, team, shift_period, start, end, strength))
+
+    def start_shift(player, team, strength):
+        # Events at the same time can list a player as off then on again,
+        # which carries on the shift they were on.
+        index = ended.get(player)
+        if index is not None and shifts[index] is not None:
+            _, last_team, last_period, start, end, last_strength = \
+                shifts[index]
+            if (last_team, last_period, end, last_strength) == \
+                    (team, period, elapsed, strength):
+                shifts[index] = None
+                current[player] = (team, strength, period, start)
+                return
+        current[player] = (team, strength, period, elapsed)
+
+    for event_period, event_elapsed, kind, on_ice in events:
+        if event_period != period:
+            for player in list(current):
+                end_shift(player, elapsed)
+            period = event_period
+        elapsed = event_elapsed
+
+        if kind in PERIOD_ENDS:
+            for player in list(current):
+                end_shift(player, elapsed)
+            continue
+        if not on_ice:
+            continue
+
+        now = strengths(on_ice)
+        for player in list(current):
+            if now.get(player) != current[player][:2]:
+                end_shift(player, elapsed)
+        for player, (team, strength) in now.items():
+            if player not in current:
+                start_shift(player, team, strength)
+
+    for player in list(current):
+        end_shift(player, elapsed)
+
+    return [shift for shift in shifts if shift is not None]
+
+
+def game_events(game_ids):
+    """
+    {game: [(period, elapsed, type, on_ice), ...]} for the games, as
+    sweep takes them.
+    """
+    on_ice = {}
+    for event, team, player, position in EventPlayer.select(
+        EventPlayer.event, EventPlayer.team, EventPlayer.player, Player.pos
+    ).join(Event).switch(EventPlayer).join(Player).where(
+        Event.game << game_ids
+    ).tuples():
+        on_ice.setdefault(event, {})[player] = (team, position == GOALIE)
+
+    events = dict((game_id, []) for game_id in game_ids)
+    for event, game_id, period, elapsed, kind in Event.select(
+        Event.id, Event.game, Event.period, Event.elapsed, Event.type
+    ).where(Event.game << game_ids).order_by(
+        Event.game, Event.number
+    ).tuples():
+        events[game_id].append((period, elapsed, kind, on_ice.get(event, {})))
+    return events
+
+
+def build_shifts(game_ids):
+    """
+    Replace the stored shifts of the games. Returns how many shifts were
+    stored.
+    """
+    rows = []
+    for game_id, events in game_events(game_ids).items():
+        for player, team, period, start, end, strength in sweep(events):
+            rows.append({
+                'game': game_id,
+                'team': team,
+                'player': player,
+                'period': period,
+                'start': start,
+                'end': end,
+                'strength': strength,
+            })
+
+    with db_proxy.atomic():
+        Shift.delete().where(Shift.game << game_ids).execute()
+        insert_rows(Shift, rows)
+    return len(rows)
+
+
+def build_game_shifts(game):
+    """
+    Work out the shifts of a game, usually once it has finished.
+    """
+    count = build_shifts([game.id])
+    logger.debug('Stored {} shifts for {}'.format(count, game))
+    return count
+
+
+def build_season_shifts(season):
+    """
+    Work out the shifts of every finished game in season, a batch of
+    games at a time. Returns how many shifts were stored.
+    """
+    game_ids = [game_id for game_id, in Game.select(Game.id).where(
+        (Game.season == season) & Game.end.is_null(False)
+    ).order_by(Game.id).tuples()]
+
+    count = 0
+    for start in range(0, len(game_ids), GAMES_PER_BATCH):
+        count += build_shifts(game_ids[start:start + GAMES_PER_BATCH])
+
+    logger.info('Stored {} shifts for {} finished games in {} {}'.format(
+        count, len(game_ids), season.year, season.type.name
+    ))
+    return count
+
+
+def time_on_ice(condition):
+    """
+    Seconds on the ice by player and strength over the shifts matching
+    condition, which may refer to Shift and Game, as
+    {(player, strength): seconds}.
+    """
+    return dict(
+        ((player, strength), seconds)
+        for player, strength, seconds in Shift.select(
+            Shift.player, Shift.strength, fn.SUM(Shift.end - Shift.start)
+        ).join(Game).where(condition).group_by(
+            Shift.player, Shift.strength
+        ).tuples()
+    )
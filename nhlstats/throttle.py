@@ -0,0 +1,205 @@
+"""
+Throttle keeps us polite when talking to the NHL's servers.
+"""
+
+import os
+import time
+import logging
+import threading
+from urlparse import urlparse
+from contextlib import contextmanager
+
+from monotonic import monotonic
+
+from .version import __version__
+
+logger = logging.getLogger(__name__)
+logger.debug('Loading {} ver {}'.format(__name__, __version__))
+
+
+# How many requests we allow in flight against any single host at once.
+DEFAULT_HOST_CONCURRENCY = 2
+
+# The sustained number of requests per second allowed against a single
+# host, and how many requests may be made back to back before that rate
+# kicks in. A rate of 0 disables rate limiting.
+DEFAULT_RATE = float(os.environ.get('NHLSTATS_RATE') or 1.0)
+DEFAULT_BURST = int(os.environ.get('NHLSTATS_BURST') or 4)
+
+
+class TokenBucket(object):
+
+    """
+    A classic token bucket. Tokens accrue at rate per second up to burst,
+    and every request spends one. When the bucket is empty callers are
+    put to sleep until their token arrives.
+
+    clock and sleep may be replaced, which is mostly useful for testing.
+    """
+
+    def __init__(self, rate, burst, clock=monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = float(burst)
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Spend a token, returning how long the caller must wait before
+        using it. Tokens may go negative, which queues callers up in the
+        order they arrived.
+        """
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(
+                self.burst,
+                self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= 1
+
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        """
+        Block until a token is available, returning the seconds waited.
+        """
+        wait = self.reserve()
+        if wait:
+            self.sleep(wait)
+        return wait
+
+
+class HostStats(object):
+
+    """
+    What a host's callers have experienced at the hands of the throttle.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.waits = 0
+        self.waited = 0.0
+
+    def record(self, waited):
+        self.requests += 1
+        if waited:
+            self.waits += 1
+            self.waited += waited
+
+
+class HostThrottle(object):
+
+    """
+    Limits how quickly requests may be made against a single host and
+    how many may be outstanding at any one time. Hosts are tracked
+    separately, so www.nhl.com and live.nhl.com (or any of the team
+    subdomains) don't hold each other up.
+    """
+
+    def __init__(self, concurrency=DEFAULT_HOST_CONCURRENCY,
+                 rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 clock=monotonic, sleep=time.sleep):
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.semaphores = {}
+        self.buckets = {}
+        self.stats = {}
+
+    def configure(self, concurrency=None, rate=None, burst=None):
+        """
+        Adjust the throttle settings. Hosts already seen are reset so
+        the new settings take effect immediately.
+        """
+        with self.lock:
+            if concurrency:
+                self.concurrency = concurrency
+            if rate is not None:
+                self.rate = rate
+            if burst:
+                self.burst = burst
+            self.semaphores = {}
+            self.buckets = {}
+
+    def get_limits(self, host):
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(
+                    self.concurrency
+                )
+                if self.rate:
+                    self.buckets[host] = TokenBucket(
+                        self.rate,
+                        self.burst,
+                        clock=self.clock,
+                        sleep=self.sleep
+                    )
+                self.stats.setdefault(host, HostStats())
+            return (
+                self.semaphores[host],
+                self.buckets.get(host),
+                self.stats[host]
+            )
+
+    @contextmanager
+    def request(self, url):
+        """
+        Wait for url's host to allow another request, then hold a slot
+        for it for the duration of the with block. The time waited counts
+        both waiting on the rate and for a slot to come free.
+        """
+        host = urlparse(url).netloc
+        semaphore, bucket, stats = self.get_limits(host)
+
+        start = self.clock()
+        delayed = bucket.acquire() if bucket else 0.0
+        blocked = not semaphore.acquire(False)
+        if blocked:
+            semaphore.acquire()
+
+        waited = self.clock() - start if delayed or blocked else 0.0
+        if waited:
+            logger.debug('Waited {:.2f}s to request {}'.format(waited, url))
+
+        try:
+            with self.lock:
+                stats.record(waited)
+            yield
+        finally:
+            semaphore.release()
+
+    def get_stats(self):
+        """
+        Returns {host: (requests, throttled, seconds waiting)}.
+        """
+        with self.lock:
+            return dict(
+                (host, (stats.requests, stats.waits, stats.waited))
+                for host, stats in self.stats.items()
+            )
+
+    def log_stats(self):
+        """
+        Report how long callers have spent waiting on each host.
+        """
+        with self.lock:
+            for host in sorted(self.stats):
+                stats = self.stats[host]
+                logger.info(
+                    '{}: {} requests, {} throttled, {:.2f}s waiting'.format(
+                        host, stats.requests, stats.waits, stats.waited
+                    )
+                )
+
+
+# The process wide throttle consulted by every collector.
+throttle = HostThrottle()
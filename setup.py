@@ -23,4 +23,5 @@ setup(name='nhlstats',
       scripts=['bin/nhlstats'],
       keywords='python tools utils nhl stats fancystats',
       license='MIT',
-      install_requires=REQUIREMENTS,)
+      install_requires=REQUIREMENTS,
+      extras_require={'analytics': ['numpy']},)
@@ -0,0 +1,145 @@
+"""
+These tests look at keeping player season totals as games are ingested.
+"""
+
+from peewee import fn
+
+from nhlstats.aggregates import rebuild_stats
+from nhlstats.ingest import ingest_game_events
+from nhlstats.models import Event, Player, PlayerSkaterStat, \
+    PlayerGoalieStat, Roster, SeasonType
+
+from .gamedata import GameTestCase, load_events
+
+
+class TestSeasonStats(GameTestCase):
+
+    def setUp(self):
+        super(TestSeasonStats, self).setUp()
+        self.events = load_events()
+
+    def player(self, team, number):
+        return Player.get(Player.id == Roster.get(
+            (Roster.team == team) & (Roster.no == number)
+        ).player)
+
+    def skater(self, team, number):
+        return PlayerSkaterStat.get(
+            (PlayerSkaterStat.player == self.player(team, number)) &
+            (PlayerSkaterStat.season == self.season)
+        )
+
+    def goalie(self, team, number):
+        return PlayerGoalieStat.get(
+            (PlayerGoalieStat.player == self.player(team, number)) &
+            (PlayerGoalieStat.season == self.season)
+        )
+
+    def test_credited_players(self):
+        ingest_game_events(self.game, self.events)
+
+        goal = Event.get(Event.number == 43)
+        self.assertEqual(
+            [(player.no, player.pos) for player in
+             (goal.player1, goal.player2, goal.player3)],
+            [(26, 'L'), (81, 'D'), (16, 'R')]
+        )
+
+        penalty = Event.get(Event.number == 38)
+        self.assertEqual(penalty.player1, self.player(self.road, 21))
+        self.assertEqual(penalty.player2, self.player(self.home, 55))
+
+    def test_totals(self):
+        ingest_game_events(self.game, self.events)
+
+        ward = self.skater(self.home, 26)
+        self.assertEqual(
+            (ward.gp, ward.g, ward.a, ward.pts, ward.ppg, ward.shg),
+            (1, 1, 0, 1, 1, 0)
+        )
+        green = self.skater(self.home, 52)
+        self.assertEqual((green.g, green.a, green.pts), (0, 1, 1))
+        gunnarsson = self.skater(self.road, 36)
+        self.assertEqual((gunnarsson.g, gunnarsson.a, gunnarsson.pts),
+                         (1, 1, 2))
+        gardiner = self.skater(self.road, 51)
+        self.assertEqual((gardiner.g, gardiner.a, gardiner.pts), (0, 2, 2))
+        self.assertEqual(
+            [PlayerSkaterStat.select(fn.Sum(getattr(PlayerSkaterStat, field)))
+             .scalar() for field in ('g', 'a', 'pts')],
+            [6, 12, 18]
+        )
+        self.assertEqual(self.skater(self.road, 21).pim, 2)
+        self.assertEqual(self.skater(self.home, 8).shots, 2)
+
+        holtby = self.goalie(self.home, 41)
+        self.assertEqual((holtby.gpi, holtby.ga, holtby.sha), (1, 3, 37))
+        # Goalies aren't skaters
+        self.assertFalse(PlayerSkaterStat.select().where(
+            PlayerSkaterStat.player == self.player(self.home, 41)
+        ).exists())
+
+    def shootout(self):
+        # Ward scores in a shootout after the game in the report.
+        attempt = dict(self.events[42], number='305', period='5',
+                       time='0:00', remaining='0:00', strength=None)
+        attempt['description'] = 'WSH #26 WARD(12), Wrist, Off. Zone, 11 ft.'
+        attempt['home'] = [self.events[42]['home'][0],
+                           self.events[42]['home'][-1]]
+        attempt['away'] = [self.events[42]['away'][-1]]
+        ingest_game_events(self.game, self.events[:-1] + [attempt])
+
+    def test_shootout(self):
+        self.shootout()
+
+        ward = self.skater(self.home, 26)
+        self.assertEqual((ward.g, ward.pts, ward.shots), (1, 1, 1))
+        reimer = self.goalie(self.road, 45)
+        self.assertEqual((reimer.ga, reimer.sha), (3, 29))
+        self.assertEqual(rebuild_stats(self.season, fix=False), 0)
+
+    def test_preseason_shootout(self):
+        SeasonType.update(name='Preseason', external_id='1').execute()
+        self.shootout()
+
+        self.assertEqual(self.skater(self.home, 26).g, 1)
+        reimer = self.goalie(self.road, 45)
+        self.assertEqual((reimer.ga, reimer.sha), (3, 29))
+
+    def test_playoff_overtime(self):
+        # Period 5 of a playoff game is overtime, and counts.
+        SeasonType.update(name='Playoffs', external_id='3').execute()
+        self.shootout()
+
+        self.assertEqual(self.skater(self.home, 26).g, 2)
+        reimer = self.goalie(self.road, 45)
+        self.assertEqual((reimer.ga, reimer.sha), (4, 30))
+
+    def test_incremental(self):
+        ingest_game_events(self.game, self.events[:100])
+        self.assertEqual(self.goalie(self.home, 41).ga, 0)
+        ingest_game_events(self.game, self.events[100:])
+        self.assertEqual(rebuild_stats(self.season, fix=False), 0)
+        # On the ice both before and after, but only the one game.
+        self.assertEqual(self.goalie(self.home, 41).gpi, 1)
+
+        # A revised report replaces the game's events, and its totals
+        ingest_game_events(self.game, self.events)
+        self.assertEqual(rebuild_stats(self.season, fix=False), 0)
+        self.assertEqual(self.goalie(self.home, 41).ga, 3)
+        self.assertEqual(self.skater(self.home, 26).gp, 1)
+
+    def test_rebuild(self):
+        ingest_game_events(self.game, self.events)
+        PlayerSkaterStat.update(g=5).where(
+            PlayerSkaterStat.player == self.player(self.home, 26)
+        ).execute()
+        PlayerGoalieStat.delete().execute()
+
+        self.assertEqual(rebuild_stats(self.season, fix=False), 3)
+        self.assertEqual(self.skater(self.home, 26).g, 5)
+
+        self.assertEqual(rebuild_stats(self.season), 3)
+        self.assertEqual(rebuild_stats(self.season), 0)
+        self.assertEqual(self.skater(self.home, 26).g, 1)
+        self.assertEqual(self.goalie(self.road, 45).ga, 3)
@@ -0,0 +1,98 @@
+"""
+These tests backfill a season from synthetic pages put in the cache.
+"""
+
+import os
+import shutil
+import tempfile
+
+import nhlstats
+from nhlstats.cache import page_cache
+from nhlstats.collect import SCHEDULE_URL, EVENT_URL
+from nhlstats.models import Event, Game, Season, SeasonType, BackfillJournal
+
+from .gamedata import GameTestCase, PAGES
+
+
+class TestBackfill(GameTestCase):
+
+    def setUp(self):
+        super(TestBackfill, self).setUp()
+        # The schedule will tell us about the game
+        self.game.delete_instance()
+
+        self.directory = tempfile.mkdtemp()
+        self.cache_directory = page_cache.directory
+        page_cache.configure(directory=self.directory)
+
+        for url, page in [(SCHEDULE_URL.format('20132014', 2), 'schedule.htm'),
+                          (EVENT_URL.format('20132014', '021014'),
+                           'PL021014.HTM')]:
+            with open(os.path.join(PAGES, page), 'rb') as fp:
+                page_cache.store(url, fp.read())
+
+    def tearDown(self):
+        page_cache.configure(directory=self.cache_directory)
+        shutil.rmtree(self.directory, ignore_errors=True)
+        super(TestBackfill, self).tearDown()
+
+    def test_season_range(self):
+        self.assertEqual(
+            nhlstats.season_range('20122013', '20142015'),
+            ['20122013', '20132014', '20142015']
+        )
+        self.assertEqual(nhlstats.season_range('20132014'), ['20132014'])
+        with self.assertRaises(ValueError):
+            nhlstats.season_range('2013-2014')
+
+    def test_backfill(self):
+        self.assertEqual(nhlstats.backfill('20132014', use_cache=True), 0)
+
+        game = Game.get(Game.report_id == '021014')
+        self.assertIsNotNone(game.end)
+        self.assertEqual(Event.select().where(Event.game == game).count(),
+                         304)
+
+        self.assertTrue(BackfillJournal.is_done(self.season))
+        self.assertTrue(BackfillJournal.is_done(self.season, game))
+
+    def test_resume(self):
+        nhlstats.backfill('20132014', use_cache=True)
+
+        # Everything is done, so nothing is fetched the second time round
+        shutil.rmtree(self.directory)
+        self.assertEqual(nhlstats.backfill('20132014', use_cache=True), 0)
+        self.assertEqual(
+            [entry.attempts for entry in BackfillJournal.select()], [1, 1]
+        )
+
+    def test_failures_retried(self):
+        playoffs = SeasonType.create(league=self.season.league,
+                                     name='Playoffs', external_id='3')
+        page_cache.store(SCHEDULE_URL.format('20132014', 3),
+                         '<html><body></body></html>')
+
+        self.assertEqual(nhlstats.backfill('20132014', use_cache=True), 1)
+        self.assertEqual(nhlstats.backfill('20132014', use_cache=True), 1)
+
+        entry = BackfillJournal.entry(Season.get(Season.type == playoffs))
+        self.assertEqual(entry.status, 'failed')
+        self.assertEqual(entry.attempts, 2)
+        self.assertIn('UnexpectedPageContents', entry.error)
+
+    def test_failures_returned(self):
+        SeasonType.create(league=self.season.league, name='Playoffs',
+                          external_id='3')
+        page_cache.store(SCHEDULE_URL.format('20132014', 3),
+                         '<html><body></body></html>')
+
+        # Our tables are already there, in memory
+        create_tables = nhlstats.create_tables
+        nhlstats.create_tables = lambda: None
+        try:
+            self.assertEqual(
+                nhlstats.run_action('backfill', True, 1, ['20132014'], None),
+                1
+            )
+        finally:
+            nhlstats.create_tables = create_tables
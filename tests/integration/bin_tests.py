@@ -2,9 +2,15 @@
 These tests look at the bin script for the project
 """
 
+import os
+import shutil
+import sqlite3
+import tempfile
 import subprocess
 
 import nhlstats
+from nhlstats.cache import FileCache
+from nhlstats.collect import SCHEDULE_URL
 
 
 def test_version():
@@ -41,3 +47,46 @@ def test_incorrect_action():
     assert(caughtError and caughtError.returncode == 1)
     assert(caughtError and caughtError.output.startswith(
         'ERROR: unknown action "foo"'))
+
+
+def test_backfill_failures():
+    """
+    Ensure that a backfill that fails to store something exits with 1.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        environment = dict(
+            os.environ,
+            DATABASE_URL='sqlite:///{}/nhlstats.db'.format(directory)
+        )
+        subprocess.check_call(['bin/nhlstats', 'syncdb'], env=environment)
+
+        database = sqlite3.connect(os.path.join(directory, 'nhlstats.db'))
+        with database:
+            database.execute(
+                "INSERT INTO leagues (name, abbreviation) "
+                "VALUES ('National Hockey League', 'NHL')"
+            )
+            database.execute(
+                "INSERT INTO season_types (league_id, name, external_id) "
+                "VALUES (1, 'Regular', '2')"
+            )
+        database.close()
+
+        # A schedule page without a schedule fails to store.
+        cache_directory = os.path.join(directory, 'cache')
+        FileCache(cache_directory).store(
+            SCHEDULE_URL.format('20132014', 2), '<html><body></body></html>'
+        )
+
+        process = subprocess.Popen(
+            ['bin/nhlstats', '-c', '--cache-dir', cache_directory,
+             'backfill', '20132014'],
+            env=environment, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+        )
+        output = process.communicate()[0]
+
+        assert(process.returncode == 1)
+        assert('finished with 1 failures' in output)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,179 @@
+"""
+These tests exercise the HTTP layer against a local stand-in server.
+"""
+
+import os
+import shutil
+import urllib2
+import tempfile
+import unittest
+
+from nhlstats import collect
+from nhlstats.cache import FileCache
+from nhlstats.connection import ConnectionPool, NotModified, pool
+
+from .standin import StandInServer
+
+PAGES = os.path.join(os.path.dirname(__file__), '..', 'pages')
+
+
+PAGE = '<html><body><p class="greeting">Hello, Montr\xc3\xa9al</p></body></html>'
+
+
+class GreetingCollector(collect.HTMLCollector):
+
+    def parse(self, data):
+        return data.xpath('//p[@class="greeting"]')[0].text
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandInServer({'/page.htm': PAGE}).start()
+        self.pool = ConnectionPool()
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def test_gzip(self):
+        body = self.pool.get(self.server.url('/page.htm'))
+        self.assertEqual(body, PAGE)
+        self.assertEqual(
+            self.server.requests[0]['headers']['accept-encoding'], 'gzip'
+        )
+
+    def test_keep_alive(self):
+        for _ in range(3):
+            self.pool.get(self.server.url('/page.htm'))
+
+        # Every request should have come in over the same connection
+        clients = set(request['client'] for request in self.server.requests)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(len(clients), 1)
+
+    def test_conditional(self):
+        url = self.server.url('/page.htm')
+        self.assertEqual(self.pool.get(url, conditional=True), PAGE)
+
+        with self.assertRaises(NotModified):
+            self.pool.get(url, conditional=True)
+
+        headers = self.server.requests[1]['headers']
+        self.assertIn('if-none-match', headers)
+        self.assertIn('if-modified-since', headers)
+
+        # Once the page changes we get the new copy
+        self.server.pages['/page.htm'] = PAGE.replace('Hello', 'Goodbye')
+        self.assertIn('Goodbye', self.pool.get(url, conditional=True))
+
+    def test_forget(self):
+        url = self.server.url('/page.htm')
+        self.pool.get(url, conditional=True)
+
+        # What we last retrieved wasn't kept, so we need it again
+        self.pool.validators.forget(url)
+        self.assertEqual(self.pool.get(url, conditional=True), PAGE)
+        self.assertNotIn('if-none-match', self.server.requests[1]['headers'])
+
+    def test_unconditional(self):
+        url = self.server.url('/page.htm')
+        self.pool.get(url)
+        self.assertEqual(self.pool.get(url), PAGE)
+        self.assertNotIn('if-none-match', self.server.requests[1]['headers'])
+
+    def test_http_error(self):
+        with self.assertRaises(urllib2.HTTPError) as context:
+            self.pool.get(self.server.url('/missing.htm'))
+        self.assertEqual(context.exception.code, 404)
+
+
+class TestCollectorConnection(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandInServer({'/page.htm': PAGE}).start()
+
+    def tearDown(self):
+        pool.close()
+        self.server.stop()
+
+    def test_scrape(self):
+        collector = GreetingCollector(self.server.url('/page.htm'))
+        self.assertEqual(collector.scrape(), u'Hello, Montr\xe9al')
+
+    def test_conditional_scrape(self):
+        url = self.server.url('/page.htm')
+        GreetingCollector(url, conditional=True).scrape()
+
+        with self.assertRaises(collect.NotModified):
+            GreetingCollector(url, conditional=True).scrape()
+
+    def test_use_cache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = FileCache(directory)
+            url = self.server.url('/page.htm')
+
+            collector = GreetingCollector(url, use_cache=True, cache=cache)
+            self.assertEqual(collector.scrape(), u'Hello, Montr\xe9al')
+            self.assertFalse(collector.loaded_from_cache)
+
+            collector = GreetingCollector(url, use_cache=True, cache=cache)
+            self.assertEqual(collector.scrape(), u'Hello, Montr\xe9al')
+            self.assertTrue(collector.loaded_from_cache)
+            self.assertEqual(len(self.server.requests), 1)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_truncated_cache_entry(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = FileCache(directory)
+            url = self.server.url('/page.htm')
+            GreetingCollector(url, use_cache=True, cache=cache).scrape()
+
+            local_path = cache.url_to_filename(url)
+            with open(local_path, 'rb') as fp:
+                entry = fp.read()
+            with open(local_path, 'wb') as fp:
+                fp.write(entry[:-5])
+
+            # The entry is taken as a miss, and downloaded afresh.
+            collector = GreetingCollector(url, use_cache=True, cache=cache)
+            self.assertEqual(collector.scrape(), u'Hello, Montr\xe9al')
+            self.assertFalse(collector.loaded_from_cache)
+            self.assertEqual(len(self.server.requests), 2)
+            self.assertEqual(cache.load(url), PAGE)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_final_pages_cached_for_good(self):
+        with open(os.path.join(PAGES, 'PL021014.HTM'), 'rb') as fp:
+            self.server.pages['/PL021014.HTM'] = fp.read()
+
+        directory = tempfile.mkdtemp()
+        try:
+            cache = FileCache(directory)
+            url = self.server.url('/PL021014.HTM')
+            events = collect.NHLEvents(
+                '20132014', '021014', url=url, use_cache=True, cache=cache
+            ).scrape()
+            self.assertEqual(events[-1]['event'], 'GEND')
+
+            with open(cache.url_to_filename(url), 'rb') as fp:
+                self.assertEqual(cache.read_header(fp)[0], 0)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_unparseable_pages_not_cached(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = FileCache(directory)
+            url = self.server.url('/page.htm')
+
+            with self.assertRaises(collect.UnexpectedPageContents):
+                collect.NHLSchedule('20132014', url=url + '?{}{}',
+                                    use_cache=True, cache=cache).scrape()
+            self.assertEqual(list(cache.entries()), [])
+        finally:
+            shutil.rmtree(directory)
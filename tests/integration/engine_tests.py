@@ -0,0 +1,165 @@
+"""
+These tests run collectors through the engine against a local stand-in
+server.
+"""
+
+import os
+import time
+import shutil
+import urllib2
+import tempfile
+import threading
+import unittest
+
+from nhlstats import collect
+from nhlstats.cache import FileCache
+from nhlstats.connection import pool
+from nhlstats.engine import Engine
+from nhlstats.throttle import throttle
+
+from .standin import StandInServer
+
+
+PAGES = os.path.join(os.path.dirname(__file__), '..', 'pages')
+
+PAGE = '<html><body><p class="greeting">Hello, {}</p></body></html>'
+
+
+class GreetingCollector(collect.HTMLCollector):
+
+    def parse(self, data):
+        return data.xpath('//p[@class="greeting"]')[0].text
+
+
+class CountingCollector(GreetingCollector):
+
+    """
+    Keeps track of how many collectors are fetching at once.
+    """
+    lock = threading.Lock()
+    fetching = 0
+    most = 0
+
+    def fetch(self):
+        with self.lock:
+            CountingCollector.fetching += 1
+            CountingCollector.most = max(self.most, self.fetching)
+        try:
+            time.sleep(0.05)
+            return super(CountingCollector, self).fetch()
+        finally:
+            with self.lock:
+                CountingCollector.fetching -= 1
+
+
+class TestEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.names = ['Team {}'.format(i) for i in range(12)]
+        self.server = StandInServer(dict(
+            ('/{}.htm'.format(i), PAGE.format(name))
+            for i, name in enumerate(self.names)
+        )).start()
+        self.greetings = ['Hello, {}'.format(name) for name in self.names]
+
+        # There's no need to be polite to ourselves.
+        self.limits = (throttle.concurrency, throttle.rate, throttle.burst)
+        throttle.configure(concurrency=len(self.names), rate=0)
+
+    def tearDown(self):
+        concurrency, rate, burst = self.limits
+        throttle.configure(concurrency=concurrency, rate=rate, burst=burst)
+        pool.close()
+        self.server.stop()
+
+    def collectors(self, collector_class=GreetingCollector, **kwargs):
+        return [
+            collector_class(self.server.url('/{}.htm'.format(i)), **kwargs)
+            for i in range(len(self.names))
+        ]
+
+    def test_gather(self):
+        with Engine(4) as engine:
+            self.assertEqual(engine.gather(self.collectors()), self.greetings)
+
+        # The same as scraping them one by one
+        self.assertEqual(
+            [collector.scrape() for collector in self.collectors()],
+            self.greetings
+        )
+
+    def test_concurrency(self):
+        CountingCollector.most = 0
+        with Engine(3) as engine:
+            engine.gather(self.collectors(CountingCollector))
+        self.assertEqual(CountingCollector.most, 3)
+
+    def test_errors(self):
+        collectors = self.collectors()
+        collectors[3] = GreetingCollector(self.server.url('/missing.htm'))
+
+        with Engine(4) as engine:
+            futures = [engine.submit(collector) for collector in collectors]
+            with self.assertRaises(urllib2.HTTPError):
+                engine.gather(collectors)
+
+        self.assertEqual(futures[0].result(), self.greetings[0])
+        self.assertIsInstance(futures[3].exception(), urllib2.HTTPError)
+
+    def test_cache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = FileCache(directory)
+            with Engine(4) as engine:
+                engine.gather(self.collectors(use_cache=True, cache=cache))
+                self.assertEqual(
+                    engine.gather(self.collectors(use_cache=True,
+                                                  cache=cache)),
+                    self.greetings
+                )
+
+            self.assertEqual(len(self.server.requests), len(self.names))
+            self.assertEqual(len(list(cache.entries())), len(self.names))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_parse_workers(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = FileCache(directory)
+            with Engine(4, parse_workers=2) as engine:
+                self.assertEqual(
+                    engine.gather(self.collectors(use_cache=True,
+                                                  cache=cache)),
+                    self.greetings
+                )
+
+            # Pages parsed elsewhere are still cached here
+            self.assertEqual(len(list(cache.entries())), len(self.names))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_parse_workers_events(self):
+        with open(os.path.join(PAGES, 'PL021014.HTM'), 'rb') as fp:
+            self.server.pages['/PL021014.HTM'] = fp.read()
+        url = self.server.url('/PL021014.HTM')
+
+        directory = tempfile.mkdtemp()
+        try:
+            cache = FileCache(directory)
+            collectors = [
+                collect.NHLEvents('20132014', '021014', url=url,
+                                  use_cache=True, cache=cache, since=since)
+                for since in (None, (100, 2, 35))
+            ]
+            with Engine(2, parse_workers=2) as engine:
+                events, since = engine.gather(collectors)
+
+            self.assertEqual(events, collectors[0].scrape())
+            self.assertEqual(since, events[100:])
+
+            # The game is over, so the report is cached for good
+            with open(cache.url_to_filename(url), 'rb') as fp:
+                self.assertEqual(cache.read_header(fp)[0], 0)
+        finally:
+            shutil.rmtree(directory)
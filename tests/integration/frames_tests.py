@@ -0,0 +1,71 @@
+"""
+These tests load stored game events into an EventFrame.
+"""
+
+import unittest
+from collections import Counter
+
+from nhlstats.frames import EventFrame, numpy
+from nhlstats.ingest import ingest_game_events
+from nhlstats.models import Event, Season
+
+from .gamedata import GameTestCase, load_events
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class TestEventFrame(GameTestCase):
+
+    def setUp(self):
+        super(TestEventFrame, self).setUp()
+        ingest_game_events(self.game, load_events())
+        self.frame = EventFrame.for_season(self.season)
+
+    def test_columns(self):
+        events = list(Event.select().order_by(Event.number))
+        self.assertEqual(len(self.frame), len(events))
+
+        self.assertEqual(self.frame['number'].tolist(),
+                         [event.number for event in events])
+        self.assertEqual(self.frame['elapsed'].tolist(),
+                         [event.elapsed for event in events])
+        self.assertEqual(
+            self.frame.decode('type', self.frame['type']).tolist(),
+            [event.type for event in events]
+        )
+        self.assertEqual(self.frame['team'].tolist(),
+                         [event._data['team'] or 0 for event in events])
+
+        # Far smaller than the events as models
+        self.assertLess(self.frame.nbytes, 32 * len(events))
+
+    def test_filter(self):
+        goals = self.frame.where(type='goal', team=self.home.id)
+        self.assertEqual(
+            goals['number'].tolist(),
+            [event.number for event in Event.select().where(
+                (Event.type == 'goal') & (Event.team == self.home)
+            ).order_by(Event.number)]
+        )
+
+        first = self.frame[self.frame['period'] == 1]
+        self.assertTrue((first['period'] == 1).all())
+        self.assertEqual(len(self.frame.where(type='nonsense')), 0)
+
+    def test_count_by(self):
+        events = list(Event.select())
+        self.assertEqual(self.frame.count_by('type'),
+                         Counter(event.type for event in events))
+        self.assertEqual(
+            self.frame.count_by('team', 'strength'),
+            Counter((team or 0, strength) for team, strength in
+                    Event.select(Event.team, Event.strength).tuples())
+        )
+        self.assertEqual(self.frame.where(type='nonsense').count_by('type'),
+                         {})
+
+    def test_other_season(self):
+        season = Season.create(league=self.season.league, year='20142015',
+                               type=self.season.type)
+        frame = EventFrame.for_season(season)
+        self.assertEqual(len(frame), 0)
+        self.assertEqual(frame.count_by('type'), {})
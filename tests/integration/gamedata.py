@@ -0,0 +1,63 @@
+"""
+Helpers for tests that need a game in the database and its events.
+"""
+
+import os
+import datetime
+import unittest
+
+from peewee import SqliteDatabase
+
+from nhlstats import models
+from nhlstats.collect import NHLEvents
+from nhlstats.models import db_proxy, League, SeasonType, Season, \
+    Conference, Division, Team, Game, invalidate_identity_maps
+
+PAGES = os.path.join(os.path.dirname(__file__), '..', 'pages')
+
+db_proxy.initialize(SqliteDatabase(':memory:'))
+
+
+def load_events(report='PL021014.HTM', since=None):
+    """
+    Parse one of the synthetic game reports in tests/pages.
+    """
+    collector = NHLEvents('20132014', '021014', since=since)
+    with open(os.path.join(PAGES, report), 'rb') as fp:
+        return collector.parse(collector.build_document([fp.read()]))
+
+
+class GameTestCase(unittest.TestCase):
+
+    """
+    Creates every table, along with the Leafs at the Capitals on
+    March 16th, 2014.
+    """
+
+    def setUp(self):
+        for model in models.MODELS:
+            getattr(models, model).create_table()
+
+        league = League.create(name='National Hockey League',
+                               abbreviation='NHL')
+        season_type = SeasonType.create(league=league, name='Regular',
+                                        external_id='2')
+        self.season = Season.create(league=league, year='20132014',
+                                    type=season_type)
+        conference = Conference.create(league=league, name='Eastern')
+        division = Division.create(conference=conference,
+                                   name='Metropolitan')
+        self.home = Team.create(division=division, city='Washington',
+                                name='Capitals', code='WSH',
+                                url='http://capitals.nhl.com')
+        self.road = Team.create(division=division, city='Toronto',
+                                name='Maple Leafs', code='TOR',
+                                url='http://mapleleafs.nhl.com')
+        self.game = Game.create(season=self.season, home=self.home,
+                                road=self.road, report_id='021014',
+                                start=datetime.datetime(2014, 3, 16, 19, 0))
+
+    def tearDown(self):
+        for model in reversed(models.MODELS):
+            getattr(models, model).drop_table()
+        invalidate_identity_maps()
@@ -0,0 +1,188 @@
+"""
+These tests look at storing scraped schedules and game events.
+"""
+
+import datetime
+
+import nhlstats
+from nhlstats.ingest import ingest_game_events, store_schedule
+from nhlstats.models import Event, EventPlayer, Player, Roster, Game
+
+from .gamedata import GameTestCase, load_events
+
+
+class TestStoreSchedule(GameTestCase):
+
+    def schedule(self, start=datetime.datetime(2014, 3, 16, 19, 0)):
+        return [
+            {'report_id': '021014', 'home': 'WSH', 'road': 'TOR',
+             'start': start},
+            {'report_id': '021030', 'home': 'TOR', 'road': 'WSH',
+             'start': datetime.datetime(2014, 3, 19, 23, 0)},
+            {'report_id': '021045', 'home': 'WSH', 'road': 'TOR',
+             'start': datetime.datetime(2014, 3, 21, 23, 0)},
+        ]
+
+    def test_inserts(self):
+        self.assertEqual(store_schedule(self.season, self.schedule()),
+                         (2, 0, 1))
+        self.assertEqual(Game.select().count(), 3)
+
+        game = Game.get(Game.report_id == '021030')
+        self.assertEqual(game.home, self.road)
+        self.assertEqual(game.start, datetime.datetime(2014, 3, 19, 23, 0))
+
+    def test_unchanged(self):
+        store_schedule(self.season, self.schedule())
+        self.assertEqual(store_schedule(self.season, self.schedule()),
+                         (0, 0, 3))
+
+    def test_rescheduled(self):
+        store_schedule(self.season, self.schedule())
+
+        start = datetime.datetime(2014, 3, 17, 0, 30)
+        self.assertEqual(
+            store_schedule(self.season, self.schedule(start)), (0, 1, 2)
+        )
+        self.assertEqual(Game.select().count(), 3)
+        self.assertEqual(Game.get(Game.id == self.game.id).start, start)
+
+    def test_unknown_team(self):
+        schedule = self.schedule()
+        schedule[1]['road'] = 'HFD'
+
+        # The rest of the schedule is stored all the same
+        self.assertEqual(store_schedule(self.season, schedule), (1, 0, 1))
+        self.assertEqual(Game.select().count(), 2)
+        self.assertFalse(
+            Game.select().where(Game.report_id == '021030').exists()
+        )
+
+
+class TestIngestGameEvents(GameTestCase):
+
+    def setUp(self):
+        super(TestIngestGameEvents, self).setUp()
+        self.events = load_events()
+
+    def test_events(self):
+        ingest_game_events(self.game, self.events)
+
+        self.assertEqual(
+            Event.select().where(Event.game == self.game).count(),
+            len(self.events)
+        )
+
+        start = Event.get(Event.number == 1)
+        self.assertEqual(start.type, 'start')
+        self.assertEqual(start.period, 1)
+        self.assertEqual(start.elapsed, 0)
+        self.assertEqual(start.remaining, 1200)
+
+        # The Capitals' power play goal
+        goal = Event.get(Event.number == 43)
+        self.assertEqual(goal.type, 'goal')
+        self.assertEqual(goal.strength, 'pp')
+        self.assertEqual(goal.team, self.home)
+        self.assertEqual(goal.zone, 'road')
+        self.assertEqual(goal.elapsed, 9 * 60)
+        self.assertEqual(goal.shot_type, 'wrist')
+        self.assertEqual(goal.distance, 11)
+        self.assertEqual(
+            goal.description,
+            'WSH #26 WARD(11), Wrist, Off. Zone, 11 ft. '
+            'Assists: #81 ORLOV(8); #16 FEHR(2)'
+        )
+        self.assertEqual(
+            [(player.no, player.pos) for player in
+             (goal.player1, goal.player2, goal.player3)],
+            [(26, 'L'), (81, 'D'), (16, 'R')]
+        )
+
+        penalty = Event.get(Event.number == 38)
+        self.assertEqual(penalty.team, self.road)
+        self.assertEqual(penalty.penalty, 'Slashing')
+        self.assertEqual(penalty.penalty_minutes, 2)
+
+        end = Event.select().order_by(Event.number.desc()).get()
+        self.assertEqual(end.type, 'gend')
+
+    def test_players(self):
+        ingest_game_events(self.game, self.events)
+
+        self.assertEqual(
+            EventPlayer.select().count(),
+            sum(len(event['away']) + len(event['home'])
+                for event in self.events)
+        )
+
+        goal = Event.get(Event.number == 43)
+        on_ice = sorted(
+            (player.team.code, player.player.no, player.player.pos)
+            for player in goal.players
+        )
+        self.assertEqual(len(on_ice), 11)
+        self.assertIn(('WSH', 92, 'C'), on_ice)
+        self.assertIn(('WSH', 41, 'G'), on_ice)
+        self.assertIn(('TOR', 41, 'L'), on_ice)
+        self.assertIn(('TOR', 15, 'D'), on_ice)
+
+        # Each player is only created once, and is added to their roster
+        self.assertEqual(Player.select().count(), 38)
+        self.assertEqual(
+            Roster.select().where(Roster.team == self.road).count(), 19
+        )
+
+    def test_reingest(self):
+        ingest_game_events(self.game, self.events)
+        ingest_game_events(self.game, self.events)
+
+        self.assertEqual(Event.select().count(), len(self.events))
+        self.assertEqual(Player.select().count(), 38)
+
+    def test_watermark(self):
+        ingest_game_events(self.game, self.events[:100])
+
+        game = Game.get(Game.id == self.game.id)
+        self.assertEqual(game.watermark, (100, 2, 35))
+
+    def test_since(self):
+        ingest_game_events(self.game, self.events[:100])
+        game = Game.get(Game.id == self.game.id)
+
+        events = load_events(since=game.watermark)
+        self.assertEqual(events, self.events[100:])
+
+        ingest_game_events(game, events)
+        self.assertEqual(Event.select().count(), len(self.events))
+        self.assertEqual(
+            EventPlayer.select().count(),
+            sum(len(event['away']) + len(event['home'])
+                for event in self.events)
+        )
+        self.assertEqual(game.last_event, len(self.events))
+
+    def test_revised(self):
+        ingest_game_events(self.game, self.events[:100])
+
+        # Event 100 has moved since we saw it, so everything is parsed and
+        # stored again
+        events = load_events(since=(100, 2, 36))
+        self.assertEqual(events, self.events)
+
+        ingest_game_events(self.game, events)
+        self.assertEqual(Event.select().count(), len(self.events))
+
+    def test_end_stored_with_events(self):
+        # An event we can't store, in the report that ends the game
+        self.events[150]['period'] = 'OT'
+        with self.assertRaises(ValueError):
+            nhlstats.process_game_events(self.game, self.events)
+
+        game = Game.get(Game.id == self.game.id)
+        self.assertIsNone(game.end)
+        self.assertFalse(Event.select().exists())
+
+        self.events[150]['period'] = '2'
+        nhlstats.process_game_events(game, self.events)
+        self.assertIsNotNone(Game.get(Game.id == self.game.id).end)
@@ -1,3 +1,89 @@
 """
 This seeks to test functionality in the main (__init__) nhlstats app
 """
+
+import urllib2
+import unittest
+import threading
+
+import nhlstats
+
+
+class FakeSeason(object):
+    year = '20142015'
+
+
+class FakeGame(object):
+    season = FakeSeason()
+    watermark = None
+
+    def __init__(self, report_id):
+        self.report_id = report_id
+
+
+class TestGetDataForGames(unittest.TestCase):
+
+    def setUp(self):
+        self.fetch_game_events = nhlstats.fetch_game_events
+        self.process_game_events = nhlstats.process_game_events
+        self.processed = []
+
+        self.released = threading.Event()
+
+        def fetch_game_events(season, report_id, use_cache=False,
+                              since=None):
+            if report_id == 'slow':
+                self.released.wait(5)
+            if report_id == 'missing':
+                raise urllib2.HTTPError(None, 404, 'Not Found', None, None)
+            if report_id == 'broken':
+                raise RuntimeError('Broken report')
+            return [{'event': 'PSTR', 'report_id': report_id}]
+
+        def process_game_events(game, events):
+            self.processed.append((game.report_id, events))
+            if len(self.processed) == 10:
+                self.released.set()
+
+        nhlstats.fetch_game_events = fetch_game_events
+        nhlstats.process_game_events = process_game_events
+
+    def tearDown(self):
+        nhlstats.fetch_game_events = self.fetch_game_events
+        nhlstats.process_game_events = self.process_game_events
+
+    def test_processes_every_game(self):
+        games = [FakeGame('0201{:02d}'.format(i)) for i in range(20)]
+        nhlstats.get_data_for_games(games, concurrency=4)
+
+        self.assertEqual(
+            sorted(report_id for report_id, _ in self.processed),
+            sorted(game.report_id for game in games)
+        )
+        for report_id, events in self.processed:
+            self.assertEqual(events[0]['report_id'], report_id)
+
+    def test_slow_game_doesnt_hold_up_others(self):
+        games = [FakeGame('slow')] + [
+            FakeGame('0201{:02d}'.format(i)) for i in range(10)
+        ]
+        nhlstats.get_data_for_games(games, concurrency=2)
+
+        # Every other game was stored while the slow one was in flight
+        self.assertTrue(self.released.is_set())
+        self.assertEqual(self.processed[-1][0], 'slow')
+
+    def test_http_errors_are_skipped(self):
+        games = [FakeGame('020101'), FakeGame('missing'), FakeGame('020102')]
+        nhlstats.get_data_for_games(games, concurrency=2)
+        self.assertEqual(len(self.processed), 2)
+
+    def test_unexpected_errors_exit(self):
+        games = [FakeGame('020101'), FakeGame('broken')]
+        with self.assertRaises(SystemExit) as context:
+            nhlstats.get_data_for_games(games, concurrency=2)
+        self.assertEqual(context.exception.code, 1)
+
+    def test_no_games(self):
+        nhlstats.get_data_for_games(None)
+        self.assertEqual(self.processed, [])
@@ -0,0 +1,101 @@
+"""
+These tests look at bringing an existing database up to date.
+"""
+
+import datetime
+
+from nhlstats import models
+from nhlstats.db import migrate_model, table_indexes
+from nhlstats.ingest import ingest_game_events
+from nhlstats.models import db_proxy, Game, Event, EventPlayer, Player
+
+from .gamedata import GameTestCase, load_events
+
+
+class TestMigrateModel(GameTestCase):
+
+    def setUp(self):
+        super(TestMigrateModel, self).setUp()
+        database = db_proxy.obj
+
+        # Put games back how they were before we kept a watermark or
+        # indexed them.
+        database.execute_sql('ALTER TABLE games RENAME TO games_new')
+        database.execute_sql(
+            'CREATE TABLE games (id INTEGER NOT NULL PRIMARY KEY, '
+            'season_id INTEGER NOT NULL, arena_id INTEGER, '
+            'attendence INTEGER, home_id INTEGER NOT NULL, '
+            'road_id INTEGER NOT NULL, report_id VARCHAR(255), '
+            'start DATETIME NOT NULL, end DATETIME)'
+        )
+        database.execute_sql(
+            'INSERT INTO games SELECT id, season_id, arena_id, attendence, '
+            'home_id, road_id, report_id, start, end FROM games_new'
+        )
+        database.execute_sql('DROP TABLE games_new')
+        database.execute_sql('DROP INDEX events_game_id_number')
+        database.execute_sql('DROP INDEX event_players_event_id_player_id')
+
+    def indexes(self, model):
+        return table_indexes(db_proxy.obj, model._meta.db_table)
+
+    def test_migrate(self):
+        changes = migrate_model(Game)
+        self.assertIn('added column games.last_event', changes)
+        self.assertIn('added index on games(start)', changes)
+
+        game = Game.get(Game.id == self.game.id)
+        self.assertEqual(game.report_id, '021014')
+        self.assertEqual(game.start, datetime.datetime(2014, 3, 16, 19, 0))
+        self.assertEqual(game.watermark, None)
+
+        migrate_model(Event)
+        migrate_model(EventPlayer)
+        self.assertTrue(self.indexes(Event)[('game_id', 'number')])
+        self.assertTrue(
+            self.indexes(EventPlayer)[('event_id', 'player_id')]
+        )
+
+    def test_up_to_date(self):
+        for model in models.MODELS:
+            migrate_model(getattr(models, model))
+
+        for model in models.MODELS:
+            self.assertEqual(migrate_model(getattr(models, model)), [])
+
+    def test_duplicates_left_alone(self):
+        for number in (1, 1):
+            Event.create(game=self.game, number=number, period=1,
+                         elapsed=0, remaining=1200, type='start')
+
+        self.assertEqual(migrate_model(Event), [])
+        self.assertEqual(Event.select().count(), 2)
+
+    def test_allow_null(self):
+        database = db_proxy.obj
+
+        # Put players back how they were before we created them from game
+        # reports, which don't give these.
+        database.execute_sql('ALTER TABLE players RENAME TO players_new')
+        database.execute_sql(
+            'CREATE TABLE players (id INTEGER NOT NULL PRIMARY KEY, '
+            'name VARCHAR(255) NOT NULL, no INTEGER NOT NULL, '
+            'pos VARCHAR(255) NOT NULL, shoots VARCHAR(255) NOT NULL, '
+            'dob DATE NOT NULL, pob VARCHAR(255) NOT NULL, '
+            'height INTEGER NOT NULL, weight INTEGER NOT NULL, '
+            'salary INTEGER, seasons INTEGER NOT NULL, '
+            'drafted VARCHAR(255), signed VARCHAR(255), assets TEXT, '
+            'flaws TEXT, potential VARCHAR(255), '
+            'status VARCHAR(255) NOT NULL)'
+        )
+        database.execute_sql('DROP TABLE players_new')
+
+        changes = migrate_model(Player)
+        for column in ('shoots', 'dob', 'pob', 'height', 'weight', 'status'):
+            self.assertIn('allowed null players.{}'.format(column), changes)
+        self.assertEqual(migrate_model(Player), [])
+
+        for model in models.MODELS:
+            migrate_model(getattr(models, model))
+        ingest_game_events(self.game, load_events())
+        self.assertTrue(Player.select().count())
@@ -11,7 +11,9 @@ import unittest
 
 from peewee import SqliteDatabase
 
-from nhlstats.models import db_proxy, League, Season, SeasonType
+from nhlstats.models import db_proxy, League, Season, SeasonType, \
+    Conference, Division, Team, Player, PlayerSkaterStat, PlayerGoalieStat, \
+    invalidate_identity_maps
 
 db_proxy.initialize(SqliteDatabase(':memory:'))
 
@@ -26,6 +28,7 @@ class ModelTestCase(unittest.TestCase):
     def tearDown(self):
         for model in reversed(self.MODELS):
             model.drop_table()
+        invalidate_identity_maps()
 
     def create_league(self, **kwargs):
         defaults = {'name': 'National Hockey League', 'abbreviation': 'NHL'}
@@ -74,3 +77,167 @@ class TestModelSeason(ModelTestCase):
         season = self.create_season(league=league, type=season_type)
         self.assertEqual(league.seasons.count(), 1)
         self.assertIn(season, league.seasons)
+
+
+class TestIdentityMap(ModelTestCase):
+    MODELS = [League, SeasonType, Season, Conference, Division, Team]
+
+    def setUp(self):
+        super(TestIdentityMap, self).setUp()
+        league = self.create_league()
+        conference = Conference.create(league=league, name='Eastern')
+        self.division = Division.create(conference=conference,
+                                        name='Metropolitan')
+        self.team = Team.create(division=self.division, city='Washington',
+                                name='Capitals', code='WSH',
+                                url='http://capitals.nhl.com')
+        self.season_type = self.create_season_type(league=league)
+        self.season = self.create_season(league=league,
+                                         type=self.season_type)
+
+    def test_lookups(self):
+        self.assertEqual(Team.cached(code='WSH'), self.team)
+        self.assertEqual(Team.cached(name='Capitals'), self.team)
+        self.assertEqual(Team.cached(id=self.team.id), self.team)
+        self.assertEqual(Division.cached(name='metropolitan'), self.division)
+        self.assertEqual(
+            Season.cached(year='2014-15', type=self.season_type), self.season
+        )
+
+        with self.assertRaises(Team.DoesNotExist):
+            Team.cached(code='HFD')
+
+    def test_hits_and_misses(self):
+        identity_map = Team.identity_map()
+        hits, misses = identity_map.hits, identity_map.misses
+
+        for _ in range(3):
+            self.assertEqual(Team.cached(code='WSH').city, 'Washington')
+
+        self.assertEqual(identity_map.misses - misses, 1)
+        self.assertEqual(identity_map.hits - hits, 2)
+
+    def test_misses(self):
+        identity_map = Team.identity_map()
+        self.assertEqual(Team.cached(code='WSH'), self.team)
+        indexes = identity_map.indexes
+
+        # A row added since we loaded is looked up on its own.
+        Team.insert(division=self.division, city='Toronto',
+                    name='Maple Leafs', code='TOR',
+                    url='http://mapleleafs.nhl.com').execute()
+        self.assertEqual(Team.cached(code='tor').name, 'Maple Leafs')
+        self.assertEqual(Team.cached(name='Maple Leafs').code, 'TOR')
+
+        # A row that isn't there is remembered as such, until the map is
+        # invalidated.
+        with self.assertRaises(Team.DoesNotExist):
+            Team.cached(code='HFD')
+        Team.insert(division=self.division, city='Hartford',
+                    name='Whalers', code='HFD',
+                    url='http://whalers.nhl.com').execute()
+        with self.assertRaises(Team.DoesNotExist):
+            Team.cached(code='HFD')
+        self.assertIs(identity_map.indexes, indexes)
+
+        invalidate_identity_maps()
+        self.assertEqual(Team.cached(code='HFD').name, 'Whalers')
+
+    def test_invalidated_on_save(self):
+        self.assertEqual(Team.cached(code='WSH').city, 'Washington')
+
+        self.team.city = 'Landover'
+        self.team.save()
+        self.assertEqual(Team.cached(code='WSH').city, 'Landover')
+
+        Team.create(division=self.division, city='Toronto',
+                    name='Maple Leafs', code='TOR',
+                    url='http://mapleleafs.nhl.com')
+        self.assertEqual(Team.cached(code='TOR').name, 'Maple Leafs')
+
+    def test_not_a_reference_model(self):
+        with self.assertRaises(TypeError):
+            League.cached(name='National Hockey League')
+
+
+class TestPlayerStatRates(ModelTestCase):
+    MODELS = [League, SeasonType, Season, Conference, Division, Team, Player,
+              PlayerSkaterStat, PlayerGoalieStat]
+
+    def setUp(self):
+        super(TestPlayerStatRates, self).setUp()
+        league = self.create_league()
+        conference = Conference.create(league=league, name='Eastern')
+        division = Division.create(conference=conference,
+                                   name='Metropolitan')
+        self.team = Team.create(division=division, city='Washington',
+                                name='Capitals', code='WSH',
+                                url='http://capitals.nhl.com')
+        self.other = Team.create(division=division, city='Toronto',
+                                 name='Maple Leafs', code='TOR',
+                                 url='http://mapleleafs.nhl.com')
+        season_type = self.create_season_type(league=league)
+        self.season = self.create_season(league=league, type=season_type)
+        self.last = self.create_season(league=league, type=season_type,
+                                       year='2013-14')
+
+    def skater(self, name, team=None, season=None, **stats):
+        return PlayerSkaterStat.create(
+            player=Player.create(name=name, no=8, pos='L'),
+            season=season or self.season, team=team or self.team, **stats
+        )
+
+    def goalie(self, name, **stats):
+        return PlayerGoalieStat.create(
+            player=Player.create(name=name, no=70, pos='G'),
+            season=self.season, team=self.team, **stats
+        )
+
+    def test_skater_rates(self):
+        self.skater('Ovechkin', gp=78, pts=79, g=51, shots=386)
+        self.skater('Backstrom', gp=82, pts=79, g=18, shots=153)
+        self.skater('Rookie', gp=2, pts=0, g=0, shots=0)
+        self.skater('Scratch', gp=0, pts=None, g=None, shots=None)
+        self.skater('Kessel', team=self.other, gp=82, pts=80, g=37,
+                    shots=305)
+        self.skater('Ribeiro', season=self.last, gp=48, pts=49, g=13,
+                    shots=80)
+
+        rates = [
+            (row['gp'], row['ptspgp'], row['shotpct'])
+            for row in PlayerSkaterStat.with_rates(self.season, self.team)
+        ]
+        self.assertEqual(len(rates), 4)
+        self.assertAlmostEqual(rates[0][1], 79 / 78.0)
+        self.assertAlmostEqual(rates[0][2], 5100 / 386.0)
+        self.assertEqual(rates[2], (2, 0.0, None))
+        self.assertEqual(rates[3], (0, None, None))
+
+        self.assertEqual(
+            [row['gp'] for row in PlayerSkaterStat.leaders('ptspgp',
+                                                           self.season)],
+            [78, 82, 82, 2]
+        )
+        leaders = PlayerSkaterStat.leaders('shotpct', limit=2)
+        self.assertEqual([row['shots'] for row in leaders], [80, 386])
+
+    def test_goalie_rates(self):
+        self.goalie('Holtby', gpi=48, min=2800, ga=120, sha=1400)
+        self.goalie('Neuvirth', gpi=13, min=700, ga=35, sha=380)
+        self.goalie('Grubauer', gpi=17, min=900, ga=0, sha=0)
+
+        rows = list(PlayerGoalieStat.with_rates(self.season))
+        self.assertAlmostEqual(rows[0]['gaa'], 120 * 60 / 2800.0)
+        self.assertAlmostEqual(rows[0]['svpct'], 1 - 120 / 1400.0)
+        self.assertEqual(rows[2]['gaa'], 0.0)
+        self.assertIsNone(rows[2]['svpct'])
+
+        # Lower goals against averages are better
+        self.assertEqual(
+            [row['gpi'] for row in PlayerGoalieStat.leaders('gaa')],
+            [17, 48, 13]
+        )
+        self.assertEqual(
+            [row['gpi'] for row in PlayerGoalieStat.leaders('svpct')],
+            [48, 13]
+        )
@@ -0,0 +1,170 @@
+"""
+These tests parse the synthetic pages in tests/pages, written to the shape
+of nhl.com's, without going anywhere near nhl.com.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from nhlstats import collect
+from nhlstats.cache import FileCache
+
+PAGES = os.path.join(os.path.dirname(__file__), '..', 'pages')
+
+
+def load_page(collector, page):
+    with open(os.path.join(PAGES, page), 'rb') as fp:
+        data = collector.build_document([fp.read()])
+    collector.verify(data)
+    return collector.parse(data)
+
+
+class TestNHLDivisions(unittest.TestCase):
+
+    def test_standings(self):
+        divisions = load_page(
+            collect.NHLDivisions('20132014'), 'standings.htm'
+        )
+
+        self.assertEqual(sorted(divisions), [u'Eastern', u'Western'])
+        self.assertEqual(
+            sorted(divisions[u'Western']), [u'Central', u'Pacific']
+        )
+        self.assertEqual(divisions[u'Eastern'][u'Atlantic'], [
+            u'Boston', u'Tampa Bay', u'Montr\xe9al', u'Detroit', u'Ottawa',
+            u'Toronto', u'Florida', u'Buffalo'
+        ])
+        self.assertEqual(len(divisions[u'Western'][u'Pacific']), 7)
+
+    def test_defunct_and_quoted_teams(self):
+        row = (
+            '<tr><td style="text-align:left;"><a href="#">logo</a>'
+            '<a href="#">{}</a></td></tr>'
+        )
+        page = ''.join([
+            '<html><body>',
+            '<div class="conferenceHeaderWales"></div>',
+            '<table><thead><tr><th abbr="DIV">Adams</th></tr></thead><tbody>',
+            row.format('Boston'),
+            '<tr><td><span class="team">Hartford</span></td></tr>',
+            row.format('Qu&#233;bec "Nordiques"'),
+            '</tbody></table>',
+            '</body></html>',
+        ])
+
+        collector = collect.NHLDivisions()
+        divisions = collector.parse(collector.build_document([page]))
+
+        self.assertEqual(divisions, {
+            u'Wales': {
+                u'Adams': [u'Boston', u'Hartford', u'Qu\xe9bec "Nordiques"'],
+            },
+        })
+
+
+class TestNHLEventsStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = FileCache(self.directory)
+        self.url = 'http://www.nhl.com/scores/htmlreports/20132014/PL021014.HTM'
+
+        with open(os.path.join(PAGES, 'PL021014.HTM'), 'rb') as fp:
+            self.page = fp.read()
+        self.cache.store(self.url, self.page)
+
+        collector = collect.NHLEvents('20132014', '021014')
+        self.events = collector.parse(collector.build_document([self.page]))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def collector(self, **kwargs):
+        return collect.NHLEvents('20132014', '021014', url=self.url,
+                                 use_cache=True, cache=self.cache, **kwargs)
+
+    def test_iter_events(self):
+        self.assertEqual(list(self.collector().iter_events()), self.events)
+
+    def test_rows_thrown_away(self):
+        chunks = [self.page[i:i + 4096]
+                  for i in range(0, len(self.page), 4096)]
+
+        sizes = []
+        for row in self.collector().stream_rows(iter(chunks)):
+            root = row.getroottree().getroot()
+            sizes.append(sum(1 for _ in root.iter()))
+
+        self.assertEqual(len(sizes), len(self.events))
+        # The whole report is some 32,000 elements.
+        self.assertLess(max(sizes), 1000)
+
+    def test_since(self):
+        events = self.collector(since=(100, 2, 35)).iter_events()
+        self.assertEqual(list(events), self.events[100:])
+
+    def test_revised(self):
+        events = self.collector(since=(100, 2, 36)).iter_events()
+        with self.assertRaises(collect.ReportRevised):
+            list(events)
+
+    def test_not_a_report(self):
+        self.cache.store(self.url, '<html><body><table><tr><td>Page not '
+                                   'found</td></tr></table></body></html>')
+        with self.assertRaises(collect.UnexpectedPageContents):
+            list(self.collector().iter_events())
+
+    def test_no_teams(self):
+        page = self.page.replace('id="Visitor"', 'id="Away"')
+        self.cache.store(self.url, page)
+        events = self.collector().iter_events()
+        with self.assertRaises(collect.UnexpectedPageContents):
+            next(events)
+
+
+class TestCorpus(unittest.TestCase):
+
+    """
+    The pages benchmarks/parsers.py runs over should keep parsing.
+    """
+
+    def test_teams(self):
+        teams = load_page(collect.NHLTeams(), 'teams.htm')
+        self.assertEqual(len(teams), 30)
+        self.assertIn({
+            'division': 'pacific',
+            'url': 'http://ducks.nhl.com',
+            'city': 'Anaheim',
+            'code': 'ANA',
+            'name': 'Ducks'
+        }, teams)
+
+    def test_roster(self):
+        players = load_page(collect.NHLRoster('capitals'), 'roster.htm')
+        self.assertEqual(len(players), 25)
+        self.assertEqual(players[0]['name'], 'Alex Ovechkin')
+        self.assertEqual(players[0]['number'], '8')
+
+    def test_arena(self):
+        arena = load_page(collect.NHLArena('wsh'), 'arena.htm')
+        self.assertEqual(arena['name'], 'Verizon Center')
+        self.assertEqual(arena['postal_code'], '20004')
+
+    def test_schedule(self):
+        games = load_page(collect.NHLGameReports('20132014'),
+                          'schedule_season.htm')
+        self.assertEqual(len(games), 1230)
+        self.assertEqual(len(set(game['report_id'] for game in games)), 1230)
+        self.assertEqual(
+            len([game for game in games if game['home'] == 'WSH']), 41
+        )
+
+    def test_event_locations(self):
+        locations = load_page(
+            collect.NHLEventLocations('20132014', '021014'),
+            'PlayByPlay.json'
+        )
+        self.assertEqual(locations['home'], 'Washington Capitals')
+        self.assertEqual(len(locations['plays']), 304)
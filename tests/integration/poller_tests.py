@@ -0,0 +1,132 @@
+"""
+These tests follow a game through the poller on a fake clock.
+"""
+
+import urllib2
+import datetime
+
+import nhlstats
+from nhlstats.models import Event, Game
+from nhlstats.poller import GamePoller, PolledGame, INTERMISSION, LIVE
+
+from .gamedata import GameTestCase, load_events
+
+
+class FakeClock(object):
+
+    def __init__(self, start):
+        self.start = start
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def wall(self):
+        return self.start + datetime.timedelta(seconds=self.now)
+
+
+class TestGamePoller(GameTestCase):
+
+    def poller(self, start, responses):
+        self.clock = FakeClock(start)
+        self.polls = []
+        responses = iter(responses)
+
+        def fetch(season, report_id, since):
+            self.polls.append((self.clock.now, since))
+            response = next(responses)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        return GamePoller(fetch, nhlstats.process_game_events,
+                          clock=self.clock, sleep=self.clock.sleep,
+                          now=self.clock.wall)
+
+    def test_follow_game(self):
+        events = load_events()
+        intermission = [event['event'] for event in events].index('PEND') + 1
+
+        not_published = urllib2.HTTPError(
+            'http://www.nhl.com/scores/htmlreports/20132014/PL021014.HTM',
+            404, 'Not Found', None, None
+        )
+
+        # An hour before puck drop
+        poller = self.poller(datetime.datetime(2014, 3, 16, 18, 0), [
+            not_published,
+            not_published,
+            events[:intermission - 1],
+            events[intermission - 1:intermission],
+            events[intermission:],
+        ])
+        poller.run(forever=False)
+
+        # Polling starts 15 minutes out, carries on as usual while the
+        # report isn't up yet, then backs off for intermission
+        self.assertEqual([when for when, _ in self.polls],
+                         [2700, 2820, 2940, 2960, 3200])
+        self.assertEqual(
+            [since[0] if since else None for _, since in self.polls],
+            [None, None, None, intermission - 1, intermission]
+        )
+
+        game = Game.get(Game.id == self.game.id)
+        self.assertIsNotNone(game.end)
+        self.assertEqual(Event.select().where(Event.game == game).count(),
+                         len(events))
+        self.assertEqual(poller.games, {})
+
+    def test_failures_back_off_then_abandon(self):
+        poller = self.poller(
+            datetime.datetime(2014, 3, 17, 6, 50),
+            [IOError('unreachable')] * 3
+        )
+        poller.run(forever=False)
+
+        self.assertEqual([when for when, _ in self.polls], [0, 240, 720])
+        self.assertEqual(poller.retired, set([self.game.id]))
+
+        # Abandoned games aren't picked up again
+        poller.refresh()
+        self.assertEqual(poller.heap, [])
+
+    def test_failed_store_forgotten(self):
+        events = load_events()
+        # Shortly after puck drop
+        poller = self.poller(datetime.datetime(2014, 3, 16, 19, 5),
+                             [events, events])
+        forgotten = []
+        poller.forget = lambda game: forgotten.append(game.id)
+
+        stores = []
+
+        def process(game, events):
+            stores.append(len(events))
+            if len(stores) == 1:
+                raise IOError('database went away')
+            nhlstats.process_game_events(game, events)
+
+        poller.process = process
+        poller.run(forever=False)
+
+        # The report is fetched in full again after failing to store it
+        self.assertEqual(forgotten, [self.game.id])
+        self.assertEqual(stores, [len(events), len(events)])
+        self.assertEqual([since for _, since in self.polls], [None, None])
+        self.assertIsNotNone(Game.get(Game.id == self.game.id).end)
+
+    def test_resume_phase(self):
+        events = load_events()
+        intermission = [event['event'] for event in events].index('PEND') + 1
+
+        nhlstats.process_game_events(self.game, events[:intermission])
+        self.assertEqual(PolledGame.for_game(self.game).phase, INTERMISSION)
+
+        nhlstats.process_game_events(
+            self.game, events[intermission:intermission + 5]
+        )
+        self.assertEqual(PolledGame.for_game(self.game).phase, LIVE)
@@ -0,0 +1,68 @@
+"""
+These tests look at working out shifts from stored game events.
+"""
+
+from nhlstats import process_game_events
+from nhlstats.models import Game, Player, Roster, Shift
+from nhlstats.shifts import build_game_shifts, build_season_shifts, \
+    time_on_ice
+
+from .gamedata import GameTestCase, load_events
+
+
+class TestShifts(GameTestCase):
+
+    def setUp(self):
+        super(TestShifts, self).setUp()
+        self.events = load_events()
+
+    def player(self, team, number):
+        return Roster.get(
+            (Roster.team == team) & (Roster.no == number)
+        ).player.id
+
+    def test_finished_game(self):
+        process_game_events(self.game, self.events[:100])
+        self.assertEqual(Shift.select().count(), 0)
+
+        process_game_events(self.game, self.events[100:])
+        count = Shift.select().count()
+        self.assertGreater(count, 0)
+
+        # Building again replaces them
+        self.assertEqual(build_game_shifts(self.game), count)
+        self.assertEqual(Shift.select().count(), count)
+
+    def test_shifts(self):
+        process_game_events(self.game, self.events)
+
+        for player in Player.select():
+            shifts = list(Shift.select().where(
+                Shift.player == player
+            ).order_by(Shift.period, Shift.start))
+            for shift, following in zip(shifts, shifts[1:]):
+                self.assertTrue(0 <= shift.start < shift.end <= 1200)
+                if shift.period == following.period:
+                    self.assertLessEqual(shift.end, following.start)
+
+        toi = time_on_ice(Game.id == self.game.id)
+        home_goalie = self.player(self.home, 41)
+        road_goalie = self.player(self.road, 45)
+        self.assertEqual(
+            sum(seconds for (player, _), seconds in toi.items()
+                if player == home_goalie),
+            3600
+        )
+        # One side's power play is the other's short handed time.
+        self.assertGreater(toi[(home_goalie, 'pp')], 0)
+        self.assertEqual(toi[(home_goalie, 'pp')], toi[(road_goalie, 'sh')])
+        self.assertEqual(toi[(home_goalie, 'sh')], toi[(road_goalie, 'pp')])
+
+    def test_season(self):
+        process_game_events(self.game, self.events)
+        count = Shift.select().count()
+        Shift.delete().execute()
+
+        self.assertEqual(build_season_shifts(self.season), count)
+        Game.update(end=None).execute()
+        self.assertEqual(build_season_shifts(self.season), 0)
@@ -0,0 +1,103 @@
+"""
+A local stand-in for nhl.com, so collection can be tested without
+touching the real thing.
+"""
+
+import gzip
+import hashlib
+import threading
+from StringIO import StringIO
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append({
+                'path': self.path,
+                'client': self.client_address,
+                'headers': dict(self.headers.items()),
+            })
+
+        path = self.path.split('?')[0]
+        if path not in server.pages:
+            return self.send_body(404, 'Not Found')
+
+        body = server.pages[path]
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+
+        if self.headers.get('if-none-match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        headers = {
+            'ETag': etag,
+            'Last-Modified': 'Sun, 16 Mar 2014 21:42:00 GMT',
+            'Content-Type': 'text/html; charset=utf-8',
+        }
+
+        if 'gzip' in self.headers.get('accept-encoding', ''):
+            buf = StringIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as fp:
+                fp.write(body)
+            body = buf.getvalue()
+            headers['Content-Encoding'] = 'gzip'
+
+        self.send_body(200, body, headers)
+
+    def send_body(self, status, body, headers=None):
+        self.send_response(status)
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+
+    """
+    Serves pages (a dict of path to body) from a background thread.
+    Requests are recorded so tests can make assertions about them.
+    """
+    daemon_threads = True
+
+    def __init__(self, pages=None):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.pages = pages or {}
+        self.requests = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(
+            target=self.serve_forever,
+            kwargs={'poll_interval': 0.05}
+        )
+        self.thread.daemon = True
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up on kept alive connections are expected.
+        pass
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def url(self, path):
+        return self.base_url + path
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,172 @@
+import os
+import shutil
+import tempfile
+import unittest
+from hashlib import sha1
+
+from nhlstats.cache import FileCache, DAY, HOUR, MINUTE
+
+EVENT_URL = 'http://www.nhl.com/scores/htmlreports/20132014/PL021014.HTM'
+SCHEDULE_URL = 'http://www.nhl.com/ice/schedulebyseason.htm?season=20132014'
+TEAMS_URL = 'http://www.nhl.com/ice/teams.htm'
+
+
+class FakeClock(object):
+
+    def __init__(self, now=1000000000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestFileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.clock = FakeClock()
+        self.cache = FileCache(self.directory, clock=self.clock)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        content = '<html>' + 'Montr\xc3\xa9al ' * 1000 + '</html>'
+        self.assertEqual(self.cache.load(TEAMS_URL), None)
+        self.cache.store(TEAMS_URL, content)
+        self.assertEqual(self.cache.load(TEAMS_URL), content)
+
+        # Entries are compressed and sharded
+        local_path = self.cache.url_to_filename(TEAMS_URL)
+        self.assertTrue(os.path.exists(local_path))
+        self.assertEqual(
+            os.path.relpath(local_path, self.directory).count(os.sep), 2
+        )
+        self.assertLess(os.path.getsize(local_path), len(content) / 10)
+
+    def test_ttls(self):
+        self.cache.store(SCHEDULE_URL, 'schedule')
+        self.cache.store(TEAMS_URL, 'teams')
+
+        self.clock.now += HOUR + 1
+        self.assertEqual(self.cache.load(SCHEDULE_URL), None)
+        self.assertEqual(self.cache.load(TEAMS_URL), 'teams')
+
+        self.clock.now += DAY
+        self.assertEqual(self.cache.load(TEAMS_URL), None)
+
+    def test_game_reports(self):
+        live = '<td class=" + bborder">GOAL</td>'
+        self.cache.store(EVENT_URL, live)
+        self.clock.now += MINUTE + 1
+        self.assertEqual(self.cache.load(EVENT_URL), None)
+
+        # Once the game is over the report will never change
+        final = live + '<td class=" + bborder">GEND</td>'
+        self.cache.store(EVENT_URL, final, final=True)
+        self.clock.now += 365 * DAY
+        self.assertEqual(self.cache.load(EVENT_URL), final)
+
+    def test_streaming(self):
+        chunks = [os.urandom(100 * 1024) for _ in range(5)]
+        writer = self.cache.writer(TEAMS_URL)
+        for chunk in chunks:
+            writer.write(chunk)
+
+        # Nothing is visible until the writer commits
+        self.assertEqual(self.cache.open(TEAMS_URL), None)
+        writer.commit()
+
+        self.assertEqual(''.join(self.cache.open(TEAMS_URL)), ''.join(chunks))
+
+    def test_abort(self):
+        self.cache.store(TEAMS_URL, 'teams')
+        writer = self.cache.writer(TEAMS_URL)
+        writer.write('half a page')
+        writer.abort()
+
+        self.assertEqual(self.cache.load(TEAMS_URL), 'teams')
+        self.assertEqual(
+            [path for path in self.cache.entries()
+             if not path.endswith('.z')],
+            []
+        )
+
+    def test_gc_expired(self):
+        self.cache.store(SCHEDULE_URL, 'schedule')
+        self.cache.store(TEAMS_URL, 'teams')
+
+        # Old style flat entries get cleared out too
+        legacy_path = os.path.join(self.directory,
+                                   sha1(TEAMS_URL).hexdigest() + '.html')
+        with open(legacy_path, 'wb') as fp:
+            fp.write('<html></html>')
+
+        self.clock.now += HOUR + 1
+        self.assertEqual(self.cache.gc(), (2, 0))
+        self.assertFalse(os.path.exists(legacy_path))
+        self.assertFalse(
+            os.path.exists(self.cache.url_to_filename(SCHEDULE_URL))
+        )
+        self.assertEqual(self.cache.load(TEAMS_URL), 'teams')
+
+    def test_gc_leaves_other_files(self):
+        self.cache.store(TEAMS_URL, 'teams')
+        local_path = self.cache.url_to_filename(TEAMS_URL)
+
+        # The cache directory may be shared with files that aren't ours,
+        # even ones that look like entries.
+        others = [
+            os.path.join(self.directory, 'notes.txt'),
+            os.path.join(self.directory, 'deadbeef.html'),
+            os.path.join(self.directory, 'src', 'module.py'),
+            os.path.join(os.path.dirname(local_path), 'readme'),
+            os.path.join(os.path.dirname(local_path), '0' * 40 + '.z'),
+        ]
+        os.makedirs(os.path.join(self.directory, 'src'))
+        for path in others:
+            with open(path, 'wb') as fp:
+                fp.write('not a cache entry')
+
+        self.clock.now += 2 * DAY
+        self.assertEqual(self.cache.gc(), (1, 0))
+        for path in others:
+            self.assertTrue(os.path.exists(path))
+
+    def test_gc_evicts_least_recently_used(self):
+        content = os.urandom(1024)
+        urls = ['http://www.nhl.com/ice/{}.htm'.format(i) for i in range(4)]
+
+        for url in urls:
+            self.clock.now += 1
+            self.cache.store(url, content)
+
+        # Touch the oldest entry so it's the most recently used
+        self.clock.now += 1
+        self.cache.load(urls[0])
+
+        size = os.path.getsize(self.cache.url_to_filename(urls[0]))
+        self.cache.max_bytes = size * 2
+        self.assertEqual(self.cache.gc(), (0, 2))
+
+        self.assertEqual(self.cache.load(urls[0]), content)
+        self.assertEqual(self.cache.load(urls[1]), None)
+        self.assertEqual(self.cache.load(urls[2]), None)
+        self.assertEqual(self.cache.load(urls[3]), content)
+
+    def test_corrupt_entry(self):
+        self.cache.store(TEAMS_URL, 'teams')
+        with open(self.cache.url_to_filename(TEAMS_URL), 'wb') as fp:
+            fp.write('garbage')
+        self.assertEqual(self.cache.load(TEAMS_URL), None)
+
+    def test_truncated_entry(self):
+        self.cache.store(TEAMS_URL, os.urandom(100 * 1024))
+        local_path = self.cache.url_to_filename(TEAMS_URL)
+        with open(local_path, 'rb') as fp:
+            entry = fp.read()
+        with open(local_path, 'wb') as fp:
+            fp.write(entry[:-10])
+
+        self.assertEqual(self.cache.open(TEAMS_URL), None)
+        self.assertFalse(os.path.exists(local_path))
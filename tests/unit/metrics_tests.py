@@ -0,0 +1,144 @@
+import os
+import shutil
+import urllib2
+import tempfile
+import unittest
+
+from nhlstats import collect
+from nhlstats.cache import FileCache
+from nhlstats.metrics import MetricsRegistry, MetricsWriter, metrics, \
+    serve_metrics
+
+PAGES = os.path.join(os.path.dirname(__file__), '..', 'pages')
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.registry = MetricsRegistry(clock=self.clock)
+
+    def test_render(self):
+        self.registry.inc('nhlstats_cache_requests_total',
+                          collector='NHLEvents', result='hit')
+        self.registry.inc('nhlstats_cache_requests_total', 2,
+                          collector='NHLEvents', result='hit')
+        self.registry.observe('nhlstats_db_seconds', 0.25,
+                              operation='store_schedule')
+        self.registry.observe('nhlstats_db_seconds', 0.5,
+                              operation='store_schedule')
+
+        self.assertEqual(self.registry.render(), '\n'.join([
+            '# HELP nhlstats_cache_requests_total Pages looked for in the '
+            'cache, by whether they were found.',
+            '# TYPE nhlstats_cache_requests_total counter',
+            'nhlstats_cache_requests_total{collector="NHLEvents",'
+            'result="hit"} 3.0',
+            '# HELP nhlstats_db_seconds Time spent writing what we '
+            'collected to the database.',
+            '# TYPE nhlstats_db_seconds summary',
+            'nhlstats_db_seconds_count{operation="store_schedule"} 2.0',
+            'nhlstats_db_seconds_sum{operation="store_schedule"} 0.75',
+        ]) + '\n')
+
+    def test_unknown_metric(self):
+        with self.assertRaises(ValueError):
+            self.registry.inc('nhlstats_nonsense_total')
+
+    def test_timed(self):
+        def chunks():
+            for chunk in ('ab', 'cde'):
+                self.clock.now += 1
+                yield chunk
+
+        timed = self.registry.timed(chunks(), 'nhlstats_fetch_seconds',
+                                    'nhlstats_fetch_bytes_total',
+                                    source='web')
+        for chunk in timed:
+            # Time spent by the consumer isn't counted
+            self.clock.now += 10
+
+        self.assertEqual(self.registry.summaries, {
+            ('nhlstats_fetch_seconds', (('source', 'web'),)): (1, 2.0),
+        })
+        self.assertEqual(self.registry.counters, {
+            ('nhlstats_fetch_bytes_total', (('source', 'web'),)): 5,
+        })
+
+    def test_callbacks(self):
+        self.registry.register(lambda: [
+            ('nhlstats_throttle_requests_total', {'host': 'a"b'}, 4),
+        ])
+        self.assertIn(
+            'nhlstats_throttle_requests_total{host="a\\"b"} 4.0\n',
+            self.registry.render()
+        )
+
+    def test_write_and_serve(self):
+        self.registry.inc('nhlstats_events_stored_total', 300)
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'nhlstats.prom')
+            writer = MetricsWriter(self.registry, path, interval=60)
+            writer.start()
+            writer.stop()
+
+            with open(path) as fp:
+                self.assertEqual(fp.read(), self.registry.render())
+            self.assertEqual(os.listdir(directory), ['nhlstats.prom'])
+        finally:
+            shutil.rmtree(directory)
+
+        server = serve_metrics(self.registry, 0, host='127.0.0.1')
+        try:
+            response = urllib2.urlopen('http://127.0.0.1:{}/metrics'.format(
+                server.server_port
+            ))
+            self.assertEqual(response.read(), self.registry.render())
+        finally:
+            server.shutdown()
+
+
+class TestCollectorMetrics(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.directory = tempfile.mkdtemp()
+        self.cache = FileCache(self.directory)
+        with open(os.path.join(PAGES, 'standings.htm'), 'rb') as fp:
+            self.size = len(fp.read())
+            fp.seek(0)
+            self.cache.store(collect.DIVISION_URL.format(''), fp.read())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        metrics.reset()
+
+    def test_scrape(self):
+        collect.NHLDivisions(use_cache=True, cache=self.cache).scrape()
+
+        labels = (('collector', 'NHLDivisions'), ('source', 'cache'))
+        self.assertEqual(
+            metrics.counters[('nhlstats_fetch_bytes_total', labels)],
+            self.size
+        )
+        self.assertEqual(metrics.counters[(
+            'nhlstats_cache_requests_total',
+            (('collector', 'NHLDivisions'), ('result', 'hit'))
+        )], 1)
+
+        stages = sorted(
+            dict(labels)['stage']
+            for name, labels in metrics.summaries
+            if name == 'nhlstats_parse_seconds'
+        )
+        self.assertEqual(stages, ['build', 'parse', 'verify'])
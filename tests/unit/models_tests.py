@@ -64,6 +64,14 @@ class TestModelPlayerSkaterStat(unittest.TestCase):
         pks = PlayerSkaterStat(shots=100, g=100)
         self.assertEqual(pks.shotpct, '100.0')
 
+    def test_missing(self):
+        pks = PlayerSkaterStat(gp=2, pts=0, shots=0, g=0)
+        self.assertEqual(pks.ptspgp, '0.00')
+        self.assertIsNone(pks.shotpct)
+        pks = PlayerSkaterStat()
+        self.assertIsNone(pks.ptspgp)
+        self.assertIsNone(pks.shotpct)
+
 
 class TestModelPlayerGoalieStat(unittest.TestCase):
 
@@ -82,3 +90,11 @@ class TestModelPlayerGoalieStat(unittest.TestCase):
         self.assertEqual(pgs.svpct, '0.850')
         pgs = PlayerGoalieStat(ga=1, sha=100)
         self.assertEqual(pgs.svpct, '0.990')
+
+    def test_missing(self):
+        pgs = PlayerGoalieStat(ga=0, sha=0, min=120)
+        self.assertEqual(pgs.gaa, '0.00')
+        self.assertIsNone(pgs.svpct)
+        pgs = PlayerGoalieStat()
+        self.assertIsNone(pgs.gaa)
+        self.assertIsNone(pgs.svpct)
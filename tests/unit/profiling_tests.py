@@ -0,0 +1,161 @@
+import os
+import time
+import pstats
+import shutil
+import tempfile
+import unittest
+import threading
+
+from nhlstats.profiling import Profiler, CPROFILE, SAMPLE
+
+
+def busy(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+def outer():
+    busy(0.01)
+    inner()
+
+
+def inner():
+    busy(0.01)
+
+
+class FakeGame(object):
+
+    report_id = '021014'
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = os.path.join(tempfile.mkdtemp(), 'profiles')
+        self.profiler = Profiler()
+
+    def tearDown(self):
+        self.profiler.configure()
+        shutil.rmtree(os.path.dirname(self.directory))
+
+    def profiles(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_disabled(self):
+        with self.profiler.profile('collect'):
+            outer()
+        self.assertFalse(os.path.exists(self.directory))
+
+    def test_cprofile(self):
+        self.profiler.configure(self.directory, CPROFILE, per_game=True)
+        with self.profiler.profile('collect'):
+            outer()
+            with self.profiler.game(FakeGame()):
+                inner()
+
+        game, action = self.profiles()
+        self.assertTrue(game.endswith('-game-021014.prof'))
+        self.assertTrue(action.endswith('-collect.prof'))
+
+        def calls(name):
+            stats = pstats.Stats(os.path.join(self.directory, name)).stats
+            return dict(
+                (function, values[1]) for (_, _, function), values
+                in stats.items() if function in ('outer', 'inner')
+            )
+
+        # The game's calls are included in the action's profile.
+        self.assertEqual(calls(game), {'inner': 1})
+        self.assertEqual(calls(action), {'outer': 1, 'inner': 2})
+
+    def test_sample(self):
+        self.profiler.configure(self.directory, SAMPLE, interval=0.001)
+        with self.profiler.game(FakeGame()):
+            pass
+        with self.profiler.profile('update'):
+            for _ in range(10):
+                outer()
+
+        profile, = self.profiles()
+        self.assertTrue(profile.endswith('-update.folded'))
+        with open(os.path.join(self.directory, profile)) as fp:
+            lines = fp.read().splitlines()
+
+        self.assertTrue(any(
+            ';outer (profiling_tests.py:18);inner (profiling_tests.py:23);'
+            'busy (profiling_tests.py:12) ' in line
+            for line in lines
+        ))
+
+    def test_sample_game_thread(self):
+        self.profiler.configure(self.directory, SAMPLE, per_game=True,
+                                interval=0.001)
+        stopped = threading.Event()
+
+        def other_game():
+            while not stopped.is_set():
+                outer()
+
+        with self.profiler.profile('update'):
+            thread = threading.Thread(target=other_game)
+            thread.start()
+            try:
+                with self.profiler.game(FakeGame()):
+                    for _ in range(10):
+                        inner()
+            finally:
+                stopped.set()
+                thread.join()
+
+        def stacks(name):
+            with open(os.path.join(self.directory, name)) as fp:
+                return fp.read()
+
+        # Only the action's profile sees the other thread's game.
+        game, action = self.profiles()
+        self.assertTrue(game.endswith('-game-021014.folded'))
+        self.assertIn('inner (profiling_tests.py:23)', stacks(game))
+        self.assertNotIn('outer (profiling_tests.py:18)', stacks(game))
+        self.assertIn('outer (profiling_tests.py:18)', stacks(action))
+
+    def test_game_across_threads(self):
+        for mode in (CPROFILE, SAMPLE):
+            self.profiler.configure(self.directory, mode, per_game=True,
+                                    interval=0.001)
+            with self.profiler.profile('collect'):
+                profile = self.profiler.game(FakeGame())
+                thread = threading.Thread(
+                    target=profile.call, args=(outer,)
+                )
+                thread.start()
+                thread.join()
+                with profile:
+                    inner()
+
+        def functions(name):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.prof'):
+                return set(
+                    function for (_, _, function)
+                    in pstats.Stats(path).stats
+                )
+            with open(path) as fp:
+                return set(
+                    frame.split(' ')[0]
+                    for line in fp for frame in line.split(';')
+                )
+
+        # The game's fetch on the worker is in its profile, but not in
+        # the action's, which only profiles the main thread for cProfile.
+        game, action, sampled_game, sampled_action = self.profiles()
+        self.assertTrue(game.endswith('-game-021014.prof'))
+        self.assertIn('outer', functions(game))
+        self.assertNotIn('outer', functions(action))
+        self.assertTrue(sampled_game.endswith('-game-021014.folded'))
+        self.assertIn('outer', functions(sampled_game))
+        self.assertIn('inner', functions(sampled_game))
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            self.profiler.configure(self.directory, 'dtrace')
@@ -0,0 +1,80 @@
+import unittest
+
+from nhlstats.scheduler import FixedRateScheduler
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class TestFixedRateScheduler(unittest.TestCase):
+
+    def run_scheduler(self, durations, period=10):
+        clock = FakeClock()
+        scheduler = FixedRateScheduler(period, clock=clock, sleep=clock.sleep)
+        started = []
+
+        def action():
+            started.append(clock.now - 100)
+            clock.now += durations[len(started) - 1]
+
+        scheduler.run(action, runs=len(durations))
+        return scheduler, started, clock
+
+    def test_no_drift(self):
+        scheduler, started, clock = self.run_scheduler([3, 4, 1, 9])
+
+        # Runs start every period, however long they take
+        self.assertEqual(started, [0, 10, 20, 30])
+        self.assertEqual(clock.slept, [7, 6, 9])
+        self.assertEqual(scheduler.stats.skipped, 0)
+
+    def test_overruns_skip(self):
+        scheduler, started, clock = self.run_scheduler([25, 10, 2, 1])
+
+        # The first run covers the ticks at 10 and 20, and the second
+        # ends exactly on the next tick
+        self.assertEqual(started, [0, 30, 40, 50])
+        self.assertEqual(scheduler.stats.skipped, 2)
+        self.assertEqual(scheduler.stats.runs, 4)
+
+    def test_lag_and_jitter(self):
+        clock = FakeClock()
+
+        def late_sleep(seconds):
+            # Oversleep by a growing amount
+            clock.sleep(seconds + 0.1 * (len(clock.slept) + 1))
+
+        scheduler = FixedRateScheduler(5, clock=clock, sleep=late_sleep)
+        scheduler.run(lambda: None, runs=3)
+
+        stats = scheduler.stats
+        self.assertAlmostEqual(stats.max_lag, 0.2)
+        self.assertAlmostEqual(stats.mean_lag, 0.1)
+        self.assertAlmostEqual(stats.max_jitter, 0.1)
+        self.assertAlmostEqual(stats.mean_jitter, 0.1)
+
+    def test_errors_stop(self):
+        clock = FakeClock()
+        scheduler = FixedRateScheduler(5, clock=clock, sleep=clock.sleep)
+
+        def action():
+            raise RuntimeError('boom')
+
+        with self.assertRaises(RuntimeError):
+            scheduler.run(action)
+        self.assertEqual(scheduler.stats.runs, 1)
+
+    def test_bad_period(self):
+        with self.assertRaises(ValueError):
+            FixedRateScheduler(0)
@@ -0,0 +1,94 @@
+import unittest
+
+from nhlstats.shifts import sweep, strengths
+
+HOME, ROAD = 1, 2
+
+
+def on_ice(home, road, goalies=(10, 20)):
+    players = dict((player, (HOME, player in goalies)) for player in home)
+    players.update((player, (ROAD, player in goalies)) for player in road)
+    return players
+
+
+FULL = on_ice([10, 11, 12, 13, 14, 15], [20, 21, 22, 23, 24, 25])
+CHANGED = on_ice([10, 11, 12, 13, 14, 16], [20, 21, 22, 23, 24, 25])
+PENALTY = on_ice([10, 11, 12, 13, 14, 16], [20, 21, 22, 23, 24])
+
+
+class TestStrengths(unittest.TestCase):
+
+    def test_strengths(self):
+        self.assertEqual(strengths(FULL)[11], (HOME, 'ev'))
+        self.assertEqual(strengths(PENALTY)[10], (HOME, 'pp'))
+        self.assertEqual(strengths(PENALTY)[21], (ROAD, 'sh'))
+
+    def test_pulled_goalie(self):
+        # An extra attacker for the goalie is still even strength
+        pulled = on_ice([11, 12, 13, 14, 15, 16], [20, 21, 22, 23, 24, 25])
+        self.assertEqual(strengths(pulled)[11], (HOME, 'ev'))
+        self.assertEqual(strengths(pulled)[21], (ROAD, 'ev'))
+        # but not on a power play
+        pulled = on_ice([11, 12, 13, 14, 15, 16], [20, 21, 22, 23, 24])
+        self.assertEqual(strengths(pulled)[11], (HOME, 'pp'))
+        self.assertEqual(strengths(pulled)[21], (ROAD, 'sh'))
+
+
+class TestSweep(unittest.TestCase):
+
+    def shifts(self, events, player):
+        return [shift[2:] for shift in sweep(events) if shift[0] == player]
+
+    def test_change(self):
+        events = [
+            (1, 0, 'start', FULL),
+            (1, 40, 'hit', FULL),
+            (1, 90, 'shot', CHANGED),
+            (1, 1200, 'end', CHANGED),
+        ]
+        self.assertEqual(self.shifts(events, 15), [(1, 0, 90, 'ev')])
+        self.assertEqual(self.shifts(events, 16), [(1, 90, 1200, 'ev')])
+        self.assertEqual(self.shifts(events, 10), [(1, 0, 1200, 'ev')])
+
+    def test_strength(self):
+        events = [
+            (1, 0, 'start', FULL),
+            (1, 100, 'penalty', CHANGED),
+            (1, 100, 'face', PENALTY),
+            (1, 220, 'face', CHANGED),
+            (1, 300, 'stop', {}),
+            (1, 1200, 'end', CHANGED),
+        ]
+        self.assertEqual(self.shifts(events, 10), [
+            (1, 0, 100, 'ev'), (1, 100, 220, 'pp'), (1, 220, 1200, 'ev'),
+        ])
+        self.assertEqual(self.shifts(events, 25), [
+            (1, 0, 100, 'ev'), (1, 220, 1200, 'ev'),
+        ])
+        self.assertEqual(self.shifts(events, 16), [
+            (1, 100, 220, 'pp'), (1, 220, 1200, 'ev'),
+        ])
+
+    def test_off_and_on(self):
+        # Listed off and straight back on at the same time carries on.
+        events = [
+            (1, 0, 'start', FULL),
+            (1, 60, 'stop', CHANGED),
+            (1, 60, 'face', FULL),
+            (1, 1200, 'end', FULL),
+        ]
+        self.assertEqual(self.shifts(events, 15), [(1, 0, 1200, 'ev')])
+        self.assertEqual(self.shifts(events, 16), [])
+
+    def test_periods(self):
+        events = [
+            (1, 0, 'start', FULL),
+            (1, 1150, 'shot', FULL),
+            (2, 0, 'start', FULL),
+            (2, 300, 'shot', FULL),
+        ]
+        # Without a period end, shifts end at the period's last event,
+        # and at the last event we have.
+        self.assertEqual(self.shifts(events, 11),
+                         [(1, 0, 1150, 'ev'), (2, 0, 300, 'ev')])
+        self.assertEqual(sweep([]), [])
@@ -0,0 +1,139 @@
+import time
+import threading
+import unittest
+
+from nhlstats.throttle import HostThrottle, TokenBucket
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(2, 3, clock=clock, sleep=clock.sleep)
+
+        # The first burst requests go straight through
+        self.assertEqual([bucket.acquire() for _ in range(3)], [0, 0, 0])
+        self.assertEqual(clock.slept, [])
+
+        # After that we're held to 2 requests per second
+        self.assertAlmostEqual(bucket.acquire(), 0.5)
+        self.assertAlmostEqual(bucket.acquire(), 0.5)
+        self.assertAlmostEqual(clock.now, 1.0)
+
+    def test_refills_while_idle(self):
+        clock = FakeClock()
+        bucket = TokenBucket(1, 2, clock=clock, sleep=clock.sleep)
+        bucket.acquire()
+        bucket.acquire()
+
+        # Idle time never accrues more than burst tokens
+        clock.now += 60
+        self.assertEqual([bucket.acquire() for _ in range(2)], [0, 0])
+        self.assertAlmostEqual(bucket.acquire(), 1.0)
+
+    def test_queues_waiters(self):
+        clock = FakeClock()
+        bucket = TokenBucket(1, 1, clock=clock, sleep=clock.sleep)
+        bucket.reserve()
+
+        # Callers arriving together are spaced out in arrival order
+        self.assertAlmostEqual(bucket.reserve(), 1.0)
+        self.assertAlmostEqual(bucket.reserve(), 2.0)
+
+
+class TestHostThrottle(unittest.TestCase):
+
+    def run_requests(self, throttle, urls):
+        lock = threading.Lock()
+        state = {'active': {}, 'peak': {}}
+
+        def request(url):
+            host = url.split('/')[2]
+            with throttle.request(url):
+                with lock:
+                    state['active'][host] = state['active'].get(host, 0) + 1
+                    state['peak'][host] = max(
+                        state['peak'].get(host, 0), state['active'][host])
+                time.sleep(0.01)
+                with lock:
+                    state['active'][host] -= 1
+
+        threads = [threading.Thread(target=request, args=(url,))
+                   for url in urls]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return state['peak']
+
+    def test_limits_per_host(self):
+        throttle = HostThrottle(concurrency=2, rate=0)
+        peak = self.run_requests(
+            throttle,
+            ['http://www.nhl.com/{}'.format(i) for i in range(8)] +
+            ['http://live.nhl.com/{}'.format(i) for i in range(8)]
+        )
+        self.assertEqual(peak['www.nhl.com'], 2)
+        self.assertEqual(peak['live.nhl.com'], 2)
+
+    def test_configure(self):
+        throttle = HostThrottle(concurrency=4, rate=0)
+        throttle.configure(concurrency=1)
+        peak = self.run_requests(
+            throttle,
+            ['http://www.nhl.com/{}'.format(i) for i in range(4)]
+        )
+        self.assertEqual(peak['www.nhl.com'], 1)
+
+    def test_rate_per_host(self):
+        clock = FakeClock()
+        throttle = HostThrottle(rate=1, burst=1, clock=clock,
+                                sleep=clock.sleep)
+
+        for url in ['http://www.nhl.com/a', 'http://live.nhl.com/a',
+                    'http://www.nhl.com/b', 'http://ducks.nhl.com/a']:
+            with throttle.request(url):
+                pass
+
+        # Only the second www.nhl.com request had to wait
+        self.assertEqual(clock.slept, [1.0])
+        self.assertEqual(throttle.stats['www.nhl.com'].requests, 2)
+        self.assertEqual(throttle.stats['www.nhl.com'].waits, 1)
+        self.assertAlmostEqual(throttle.stats['www.nhl.com'].waited, 1.0)
+        self.assertEqual(throttle.stats['live.nhl.com'].waits, 0)
+
+    def test_waiting_for_a_slot(self):
+        throttle = HostThrottle(concurrency=1, rate=0)
+        holding = threading.Event()
+
+        def hold():
+            with throttle.request('http://www.nhl.com/a'):
+                holding.set()
+                time.sleep(0.05)
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        holding.wait()
+        with throttle.request('http://www.nhl.com/b'):
+            pass
+        thread.join()
+
+        # Waiting for the first request to finish counts as waiting
+        stats = throttle.stats['www.nhl.com']
+        self.assertEqual((stats.requests, stats.waits), (2, 1))
+        self.assertGreater(stats.waited, 0.02)